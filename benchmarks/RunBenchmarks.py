@@ -0,0 +1,254 @@
+# This script times each stage of the pipeline on synthetic, C. elegans-scale data (see SyntheticData.py),
+# reporting wall time, records per second, and peak resident memory for each stage.
+# Results can be saved as a named baseline and later runs compared against it to catch regressions.
+# Example:  python benchmarks/RunBenchmarks.py --scale 0.1 --save-baseline
+#           python benchmarks/RunBenchmarks.py --scale 0.1   (exits with status 1 if any stage regressed)
+
+import os, sys, json, time, resource, argparse, contextlib, traceback
+import multiprocessing as mp
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIRECTORY), "python_scripts"))
+import SyntheticData
+
+DEFAULT_DATA_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "data")
+BASELINE_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "baselines")
+
+ACCEPTABLE_CHROMOSOMES = tuple(SyntheticData.CHROMOSOME_LENGTHS)
+
+
+# Generates the synthetic data set for the given scale and seed in the given directory, unless it is already there.
+# Returns a dictionary of file paths and record counts describing the data set.
+def prepareData(dataDirectory, scale, seed):
+
+    dataSetDirectory = os.path.join(dataDirectory, "scale_" + str(scale) + "_seed_" + str(seed))
+    descriptionFilePath = os.path.join(dataSetDirectory, "data_set.json")
+    if os.path.exists(descriptionFilePath):
+        with open(descriptionFilePath, 'r') as descriptionFile: return json.load(descriptionFile)
+
+    print("Generating synthetic data in",dataSetDirectory)
+    os.makedirs(dataSetDirectory, exist_ok = True)
+    dataSet = {"directory": dataSetDirectory, "scale": scale, "seed": seed,
+               "genome": os.path.join(dataSetDirectory, "synthetic_genome.fa"),
+               "geneDesignations": os.path.join(dataSetDirectory, "synthetic_gene_designations.bed"),
+               "mutations": os.path.join(dataSetDirectory, "synthetic_trinuc_context_mutations.bed"),
+               "SNVDirectory": os.path.join(dataSetDirectory, "SNVs"),
+               "sampleInfo": os.path.join(dataSetDirectory, "sample_info.csv"),
+               "geneExpression": os.path.join(dataSetDirectory, "synthetic_gene_expression.txt"),
+               "filteredGenesDirectory": os.path.join(dataSetDirectory, "filtered_genes")}
+
+    SyntheticData.writeGenome(dataSet["genome"], scale, seed)
+    dataSet["genomeBases"] = sum(SyntheticData.getChromosomeLengths(scale).values())
+    geneNames = SyntheticData.writeGeneDesignations(dataSet["geneDesignations"], scale, seed)
+    dataSet["genes"] = len(geneNames)
+    SyntheticData.writeTrinucleotideMutations(dataSet["mutations"], scale, seed)
+    with open(dataSet["mutations"], 'r') as mutationFile: dataSet["mutationCount"] = sum(1 for _ in mutationFile)
+    dataSet["VCFMutations"] = SyntheticData.writeVCFs(dataSet["SNVDirectory"], dataSet["sampleInfo"], scale, seed)
+    dataSet["expressionValues"] = SyntheticData.writeGeneExpression(dataSet["geneExpression"], geneNames, scale, seed)
+    os.makedirs(dataSet["filteredGenesDirectory"], exist_ok = True)
+    dataSet["filteredGeneFiles"] = SyntheticData.writeFilteredGeneFiles(dataSet["filteredGenesDirectory"], geneNames, seed)
+    dataSet["filteredGenes"] = len(dataSet["filteredGeneFiles"])*(len(geneNames)//4)
+
+    with open(descriptionFilePath, 'w') as descriptionFile: json.dump(dataSet, descriptionFile, indent = 2)
+    return dataSet
+
+
+# Each stage function runs one stage of the pipeline on the given data set (writing any output to the given directory)
+# and returns the number of records processed.  Imports are done inside the stage so that a stage whose
+# dependencies are missing can be skipped without affecting the others.
+
+def runParseVCFs(dataSet, outputDirectory, workers):
+    from ParseVCF_ForMutperiod import parseVCFsForMutperiod
+    parseVCFsForMutperiod(dataSet["SNVDirectory"], dataSet["sampleInfo"], outputDirectory, workers = workers)
+    return dataSet["VCFMutations"]
+
+def runGenerateGeneBackground(dataSet, outputDirectory, workers):
+    import shutil
+    from GenerateGeneBackground import generateGeneBackground
+    geneDesignationsFilePath = os.path.join(outputDirectory, os.path.basename(dataSet["geneDesignations"]))
+    shutil.copy(dataSet["geneDesignations"], geneDesignationsFilePath)
+    generateGeneBackground([geneDesignationsFilePath], dataSet["genome"], useVectorizedCounting = True, useGenomeIndex = True)
+    return dataSet["genomeBases"]
+
+# NOTE: countInTranscribedRegions itself needs mutperiod's metadata files, so counting is timed through countMutationFile,
+# which does all of the actual work.
+def runCountMergeWalk(dataSet, outputDirectory, workers):
+    from CountInTranscribedRegions import countMutationFile
+    countMutationFile(dataSet["mutations"], dataSet["geneDesignations"], None,
+                      os.path.join(outputDirectory, "merge_walk_counts.tsv"), ACCEPTABLE_CHROMOSOMES, None)
+    return dataSet["mutationCount"]
+
+def runCountIntervalIndex(dataSet, outputDirectory, workers):
+    from CountInTranscribedRegions import countMutationFile, GeneIntervalIndex
+    countMutationFile(dataSet["mutations"], dataSet["geneDesignations"],
+                      GeneIntervalIndex(dataSet["geneDesignations"], useCache = False),
+                      os.path.join(outputDirectory, "interval_index_counts.tsv"), ACCEPTABLE_CHROMOSOMES, None)
+    return dataSet["mutationCount"]
+
+def runFindHighlyExpressedGenes(dataSet, outputDirectory, workers):
+    import shutil
+    from FindHighlyExpressedGenes import findHighlyExpressedGenes
+    geneExpressionFilePath = os.path.join(outputDirectory, os.path.basename(dataSet["geneExpression"]))
+    shutil.copy(dataSet["geneExpression"], geneExpressionFilePath)
+    findHighlyExpressedGenes(geneExpressionFilePath, "Any")
+    return dataSet["expressionValues"]
+
+def runFindHighlyExpressedGenesMatrix(dataSet, outputDirectory, workers):
+    import shutil
+    from FindHighlyExpressedGenes import findHighlyExpressedGenes
+    geneExpressionFilePath = os.path.join(outputDirectory, os.path.basename(dataSet["geneExpression"]))
+    shutil.copy(dataSet["geneExpression"], geneExpressionFilePath)
+    findHighlyExpressedGenes(geneExpressionFilePath, "Any", useExpressionMatrix = True)
+    return dataSet["expressionValues"]
+
+def runHighlyExpressedGenesSweep(dataSet, outputDirectory, workers):
+    import shutil
+    from FindHighlyExpressedGenes import sweepHighlyExpressedGenes, TISSUE_FILTERING_OPTIONS
+    geneExpressionFilePath = os.path.join(outputDirectory, os.path.basename(dataSet["geneExpression"]))
+    shutil.copy(dataSet["geneExpression"], geneExpressionFilePath)
+    sweepHighlyExpressedGenes(geneExpressionFilePath, TISSUE_FILTERING_OPTIONS, (5, 10, 15, 20, 25, 30))
+    return dataSet["expressionValues"]
+
+def runCheckOverlap(dataSet, outputDirectory, workers):
+    from CheckOverlap import checkOverlap
+    checkOverlap(dataSet["filteredGeneFiles"], os.path.join(outputDirectory, "intersection.tsv"),
+                 os.path.join(outputDirectory, "union.tsv"))
+    return dataSet["filteredGenes"]
+
+def runCheckOverlapBitsets(dataSet, outputDirectory, workers):
+    from CheckOverlap import checkOverlap
+    checkOverlap(dataSet["filteredGeneFiles"], os.path.join(outputDirectory, "intersection.tsv"),
+                 os.path.join(outputDirectory, "union.tsv"), os.path.join(outputDirectory, "overlap"))
+    return dataSet["filteredGenes"]
+
+STAGES = {"parse_vcfs": runParseVCFs,
+          "gene_background": runGenerateGeneBackground,
+          "count_merge_walk": runCountMergeWalk,
+          "count_interval_index": runCountIntervalIndex,
+          "find_highly_expressed_genes": runFindHighlyExpressedGenes,
+          "find_highly_expressed_genes_matrix": runFindHighlyExpressedGenesMatrix,
+          "highly_expressed_genes_sweep": runHighlyExpressedGenesSweep,
+          "check_overlap": runCheckOverlap,
+          "check_overlap_bitsets": runCheckOverlapBitsets}
+
+
+# Runs a single stage and puts its results on the given queue.  (Called in a fresh child process so that
+# the peak memory measured belongs to this stage alone.)
+def runStageInChild(stageName, dataSet, workers, verbose, resultQueue: mp.Queue):
+
+    outputDirectory = os.path.join(dataSet["directory"], "output", stageName)
+    os.makedirs(outputDirectory, exist_ok = True)
+
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.ExitStack() as stack:
+            if not verbose: stack.enter_context(contextlib.redirect_stdout(devnull))
+            startTime = time.perf_counter()
+            records = STAGES[stageName](dataSet, outputDirectory, workers)
+            seconds = time.perf_counter() - startTime
+    except ImportError as error:
+        resultQueue.put({"skipped": "Missing dependency: " + str(error)})
+        return
+    except Exception:
+        resultQueue.put({"error": traceback.format_exc()})
+        return
+
+    # ru_maxrss is in kilobytes on Linux.  Count worker processes (and sort, etc.) as well as this one.
+    peakRSSKilobytes = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    resultQueue.put({"seconds": seconds, "records": records, "recordsPerSecond": records/seconds if seconds > 0 else None,
+                     "peakRSSMegabytes": peakRSSKilobytes/1024})
+
+
+# Runs each of the given stages in its own child process and returns a dictionary of results with stage names as keys.
+def runBenchmarks(dataSet, stageNames, workers = 1, verbose = False):
+
+    context = mp.get_context("fork")
+    results = dict()
+
+    for stageName in stageNames:
+
+        print("Running",stageName,"...", end = ' ', flush = True)
+        resultQueue = context.Queue()
+        process = context.Process(target = runStageInChild, args = (stageName, dataSet, workers, verbose, resultQueue))
+        process.start()
+        process.join()
+        results[stageName] = (resultQueue.get() if not resultQueue.empty() else
+                              {"error": "Stage process exited with code " + str(process.exitcode)})
+
+        result = results[stageName]
+        if "skipped" in result: print("skipped (" + result["skipped"] + ')')
+        elif "error" in result: print("failed\n" + result["error"])
+        else: print("{:.2f} s, {:,.0f} records/s, {:.1f} MB peak RSS".format(result["seconds"], result["recordsPerSecond"] or 0,
+                                                                        result["peakRSSMegabytes"]))
+
+    return results
+
+
+# Compares the given results to the given baseline and returns a list of descriptions of any regressions,
+# i.e. stages that took longer or used more memory than the baseline by more than the given fraction.
+def findRegressions(results, baseline, tolerance):
+
+    regressions = list()
+    for stageName, result in results.items():
+
+        baselineResult = baseline["stages"].get(stageName)
+        if baselineResult is None or "seconds" not in baselineResult or "seconds" not in result: continue
+
+        for measure, unit in (("seconds", 's'), ("peakRSSMegabytes", " MB")):
+            if result[measure] > baselineResult[measure]*(1 + tolerance):
+                regressions.append("{}: {} went from {:.2f}{} to {:.2f}{}".format(stageName, measure, baselineResult[measure],
+                                                                               unit, result[measure], unit))
+
+    return regressions
+
+
+def getBaselineFilePath(baselineName):
+    return os.path.join(BASELINE_DIRECTORY, baselineName + ".json")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = "Benchmark each pipeline stage on synthetic C. elegans-scale data.")
+    parser.add_argument("--scale", type = float, default = 1,
+                        help = "Size of the synthetic data relative to C. elegans scale (default: 1)")
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed for the synthetic data generators")
+    parser.add_argument("--stages", nargs = '+', choices = list(STAGES), default = list(STAGES),
+                        help = "Stages to run (default: all)")
+    parser.add_argument("--workers", type = int, default = 1, help = "Worker processes for stages which support them")
+    parser.add_argument("--data-directory", default = DEFAULT_DATA_DIRECTORY,
+                        help = "Where to keep the generated data (reused between runs)")
+    parser.add_argument("--baseline", help = "Name of the baseline to compare to or save (default: based on the scale)")
+    parser.add_argument("--save-baseline", action = "store_true", help = "Save the results as the baseline")
+    parser.add_argument("--tolerance", type = float, default = 0.25,
+                        help = "Fractional slowdown or memory growth allowed before a regression is reported (default: 0.25)")
+    parser.add_argument("--verbose", action = "store_true", help = "Show the output of each stage")
+    args = parser.parse_args()
+
+    dataSet = prepareData(args.data_directory, args.scale, args.seed)
+    results = runBenchmarks(dataSet, args.stages, args.workers, args.verbose)
+
+    baselineFilePath = getBaselineFilePath(args.baseline or "scale_" + str(args.scale))
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIRECTORY, exist_ok = True)
+        baseline = {"stages": dict()}
+        if os.path.exists(baselineFilePath):
+            with open(baselineFilePath, 'r') as baselineFile: baseline = json.load(baselineFile)
+        baseline.update({"scale": args.scale, "seed": args.seed, "workers": args.workers})
+        baseline["stages"].update({stageName: result for stageName, result in results.items() if "seconds" in result})
+        with open(baselineFilePath, 'w') as baselineFile: json.dump(baseline, baselineFile, indent = 2)
+        print("Saved baseline to",baselineFilePath)
+
+    elif os.path.exists(baselineFilePath):
+        with open(baselineFilePath, 'r') as baselineFile: baseline = json.load(baselineFile)
+        regressions = findRegressions(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions compared to",os.path.basename(baselineFilePath) + ':')
+            for regression in regressions: print('\t' + regression)
+            sys.exit(1)
+        print("\nNo regressions compared to",os.path.basename(baselineFilePath))
+
+    if any("error" in result for result in results.values()): sys.exit(1)
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,177 @@
+# This script generates deterministic synthetic data sets at (roughly) C. elegans scale for benchmarking the pipeline.
+# Every generator takes a scale factor (1 for full size) and a seed, so the same data set can be regenerated anywhere.
+
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python_scripts"))
+from BedSorting import sortBedLines
+
+# Approximate C. elegans chromosome lengths (~100 Mb in total).
+CHROMOSOME_LENGTHS = {"chrI": 15072434, "chrII": 15279421, "chrIII": 13783801,
+                      "chrIV": 17493829, "chrV": 20924180, "chrX": 17718942}
+
+BASES = np.frombuffer(b"ACGT", dtype = np.uint8)
+TISSUES = ("Whole organism", "Sperm", "Oocyte", "Germ line", "Intestine", "Neurons")
+MUTAGENS = ("EMS", "MMS", "DMS", "UV", "Aflatoxin B1")
+GENOTYPES = ("N2", "xpc-1 (tm3886)", "polh-1 (ok3317)", "mlh-1 (gk691866)")
+
+
+# Returns the chromosome lengths for the given scale.
+def getChromosomeLengths(scale):
+    return {chromosome: max(1000, int(length*scale)) for chromosome, length in CHROMOSOME_LENGTHS.items()}
+
+
+# Returns the given number of random chromosome names, weighted by chromosome length.
+def getRandomChromosomes(randomGenerator: np.random.Generator, chromosomeLengths, count):
+    chromosomes = np.array(list(chromosomeLengths))
+    lengths = np.array(list(chromosomeLengths.values()), dtype = np.float64)
+    return chromosomes[randomGenerator.choice(len(chromosomes), size = count, p = lengths/lengths.sum())]
+
+
+# Writes a random genome fasta file with 60 bases per line.
+def writeGenome(genomeFilePath, scale, seed = 0):
+
+    randomGenerator = np.random.default_rng(seed)
+    with open(genomeFilePath, 'wb') as genomeFile:
+        for chromosome, length in getChromosomeLengths(scale).items():
+            genomeFile.write(('>' + chromosome + '\n').encode())
+            sequence = BASES[randomGenerator.integers(0, 4, size = length, dtype = np.uint8)]
+            for lineStart in range(0, length, 60*100000):
+                lines = sequence[lineStart:lineStart + 60*100000]
+                fullLineBases = len(lines) - len(lines) % 60
+                withNewlines = np.full((fullLineBases//60, 61), ord('\n'), dtype = np.uint8)
+                withNewlines[:,:60] = lines[:fullLineBases].reshape(-1, 60)
+                genomeFile.write(withNewlines.tobytes())
+                if fullLineBases < len(lines): genomeFile.write(lines[fullLineBases:].tobytes() + b'\n')
+
+
+# Writes a sorted gene designations bed file (chromosome, start, end, name, other name, strand).
+# Gene lengths are log-normally distributed around a few kb, and genes are placed independently of each other,
+# so overlapping genes (on either strand) are common.  Returns the list of "other" gene names.
+def writeGeneDesignations(geneDesignationsFilePath, scale, seed = 0, geneCount = 20000):
+
+    randomGenerator = np.random.default_rng(seed)
+    chromosomeLengths = getChromosomeLengths(scale)
+    geneCount = max(10, int(geneCount*scale))
+
+    chromosomes = getRandomChromosomes(randomGenerator, chromosomeLengths, geneCount)
+    geneLengths = np.clip(randomGenerator.lognormal(7.6, 0.9, size = geneCount).astype(np.int64), 100, 100000)
+    maxStartPositions = np.array([chromosomeLengths[chromosome] for chromosome in chromosomes]) - geneLengths
+    startPositions = (randomGenerator.random(geneCount)*np.maximum(maxStartPositions, 1)).astype(np.int64)
+    strands = np.where(randomGenerator.random(geneCount) < 0.5, '+', '-')
+    otherNames = ["gene-" + str(i) for i in range(geneCount)]
+
+    lines = ['\t'.join((chromosome, str(start), str(start + length), "WBGene{:08d}".format(i), otherNames[i], strand)) + '\n'
+             for i, (chromosome, start, length, strand) in enumerate(zip(chromosomes.tolist(), startPositions.tolist(),
+                                                                         geneLengths.tolist(), strands.tolist()))]
+    with open(geneDesignationsFilePath, 'w') as geneDesignationsFile: geneDesignationsFile.writelines(sortBedLines(lines))
+
+    return otherNames
+
+
+# Writes a sorted trinucleotide context mutation bed file (chromosome, start, end, context, mutant base, strand).
+def writeTrinucleotideMutations(mutationFilePath, scale, seed = 0, mutationCount = 2000000):
+
+    randomGenerator = np.random.default_rng(seed)
+    chromosomeLengths = getChromosomeLengths(scale)
+    mutationCount = max(10, int(mutationCount*scale))
+
+    chromosomes = getRandomChromosomes(randomGenerator, chromosomeLengths, mutationCount)
+    positions = (randomGenerator.random(mutationCount)*
+                 np.array([chromosomeLengths[chromosome] - 2 for chromosome in chromosomes])).astype(np.int64) + 1
+    order = np.lexsort((positions, chromosomes))
+    chromosomes, positions = chromosomes[order], positions[order]
+
+    # Mutations are given as pyrimidine-centered trinucleotides.
+    flankingBases = BASES[randomGenerator.integers(0, 4, size = (mutationCount, 2))]
+    centralBases = np.frombuffer(b"CT", dtype = np.uint8)[randomGenerator.integers(0, 2, size = mutationCount)]
+    mutantBases = np.array([[base for base in b"ACGT" if base != centralBase] for centralBase in b"CT"], dtype = np.uint8)
+    mutantBases = mutantBases[(centralBases == ord('T')).astype(int), randomGenerator.integers(0, 3, size = mutationCount)]
+    contexts = np.stack((flankingBases[:,0], centralBases, flankingBases[:,1]), axis = 1).view("S3").ravel().astype(str)
+    strands = np.where(randomGenerator.random(mutationCount) < 0.5, '+', '-')
+
+    with open(mutationFilePath, 'w') as mutationFile:
+        for chromosome, position, context, mutantBase, strand in zip(chromosomes.tolist(), positions.tolist(), contexts.tolist(),
+                                                                     mutantBases.view("S1").astype(str).tolist(), strands.tolist()):
+            mutationFile.write('\t'.join((chromosome, str(position), str(position + 1), context, mutantBase, strand)) + '\n')
+
+
+# Writes a directory of small per-sample VCF files and the matching sample info csv file.
+# Returns the total number of mutations written.
+def writeVCFs(SNVDirectory, sampleInfoFilePath, scale, seed = 0, sampleCount = 2700, meanMutationsPerSample = 200):
+
+    randomGenerator = np.random.default_rng(seed)
+    chromosomeLengths = getChromosomeLengths(scale)
+    sampleCount = max(2, int(sampleCount*scale))
+    os.makedirs(SNVDirectory, exist_ok = True)
+
+    totalMutations = 0
+    with open(sampleInfoFilePath, 'w') as sampleInfoFile:
+
+        sampleInfoFile.write("Sample,Genotype,Generation,Dose,Mutagen\n")
+        sampleInfoFile.write(",,,,\n")
+
+        for sampleIndex in range(sampleCount):
+
+            sampleName = "CD{:04d}".format(sampleIndex)
+            sampleInfoFile.write(','.join((sampleName, GENOTYPES[randomGenerator.integers(len(GENOTYPES))], "20", "1",
+                                           MUTAGENS[randomGenerator.integers(len(MUTAGENS))])) + '\n')
+
+            mutationCount = int(randomGenerator.poisson(meanMutationsPerSample))
+            chromosomes = getRandomChromosomes(randomGenerator, chromosomeLengths, mutationCount)
+            positions = (randomGenerator.random(mutationCount)*
+                         np.array([chromosomeLengths[chromosome] for chromosome in chromosomes])).astype(np.int64) + 1
+            referenceBases = BASES[randomGenerator.integers(0, 4, size = mutationCount)].view("S1").astype(str)
+            alternateBases = BASES[(randomGenerator.integers(1, 4, size = mutationCount) +
+                                    np.searchsorted(BASES, referenceBases.astype("S1").view(np.uint8))) % 4].view("S1").astype(str)
+
+            with open(os.path.join(SNVDirectory, sampleName + "_snv.vcf"), 'w') as VCFFile:
+                VCFFile.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+                for chromosome, position, referenceBase, alternateBase in zip(chromosomes.tolist(), positions.tolist(),
+                                                                             referenceBases.tolist(), alternateBases.tolist()):
+                    VCFFile.write('\t'.join((chromosome[3:], str(position), '.', referenceBase, alternateBase,
+                                             "50", "PASS", '.')) + '\n')
+            totalMutations += mutationCount
+
+    return totalMutations
+
+
+# Writes a gene expression table in the format read by FindHighlyExpressedGenes: a header line, a line of column
+# names (the gene names are given in parentheses), and then one row of FPKM values per data set.
+# Returns the number of expression values written.
+def writeGeneExpression(geneExpressionFilePath, geneNames, scale, seed = 0, dataSetCount = 200):
+
+    randomGenerator = np.random.default_rng(seed)
+    dataSetCount = max(5, int(dataSetCount*scale))
+
+    with open(geneExpressionFilePath, 'w') as geneExpressionFile:
+
+        geneExpressionFile.write("Synthetic gene expression data\n")
+        geneExpressionFile.write('\t'.join(["ID", "Study", "Strain", "Stage", "Tissue", "Method", "Notes"] +
+                                           ["Gene (" + geneName + ')' for geneName in geneNames]) + '\n')
+
+        for dataSetIndex in range(dataSetCount):
+
+            values = np.round(randomGenerator.lognormal(1.5, 2, size = len(geneNames)), 3).astype(str)
+            values[randomGenerator.random(len(geneNames)) < 0.05] = "N.A."
+            geneExpressionFile.write('\t'.join(["DS" + str(dataSetIndex), "Synthetic", "N2", "Adult",
+                                                TISSUES[dataSetIndex % len(TISSUES)], "RNA-seq", ''] + values.tolist()) + '\n')
+
+    return dataSetCount*len(geneNames)
+
+
+# Writes the given number of filtered gene files (gene name and value) in the format read by CheckOverlap,
+# each containing a random quarter of the given genes.  Returns the list of file paths.
+def writeFilteredGeneFiles(directory, geneNames, seed = 0, fileCount = 8):
+
+    randomGenerator = np.random.default_rng(seed)
+    filteredGeneFilePaths = list()
+
+    for fileIndex in range(fileCount):
+        filteredGeneFilePaths.append(os.path.join(directory, "set_" + str(fileIndex) + "_highly_expressed_genes.tsv"))
+        chosenGenes = randomGenerator.choice(len(geneNames), size = len(geneNames)//4, replace = False)
+        with open(filteredGeneFilePaths[-1], 'w') as filteredGeneFile:
+            for geneIndex in chosenGenes.tolist(): filteredGeneFile.write(geneNames[geneIndex] + '\t' + "NA" + '\n')
+
+    return filteredGeneFilePaths
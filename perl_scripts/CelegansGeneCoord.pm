@@ -14,7 +14,8 @@ sub new
 	my $self = bless {}, $class;
 
 	# open file with gene positions
-	open( GENE, File::Spec->catfile($FindBin::Bin,"..","data","test_gene_designations.bed")) || die "Couldn't open file\n";
+	my $genefile = File::Spec->catfile($FindBin::Bin,"..","data","test_gene_designations.bed");
+	open( GENE, $genefile ) || die "Couldn't open file\n";
 	my $header = <GENE>;
 	
 	my %chromosome;
@@ -54,6 +55,7 @@ sub new
 	$self->{'tss'} = \%tss;
 	$self->{'tts'} = \%tts;
 	$self->{'strand'} = \%strand;
+	$self->{'file'} = $genefile;
 
 	return $self;	
 }
@@ -86,6 +88,13 @@ sub get_strand
 
         return %{$self->{'strand'}};
 }
+
+sub get_gene_file
+{
+        my ($self) = @_;
+
+        return $self->{'file'};
+}
 	
 	
 
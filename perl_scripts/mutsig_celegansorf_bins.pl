@@ -4,9 +4,14 @@ use strict;
 use warnings;
 use FindBin;
 use lib $FindBin::Bin;
+use Getopt::Long;
 
 use CelegansGeneCoord;
 
+# Pass --strand-bitmap to look mutations up in the strand annotation bitmap for the gene coordinates.
+my $usebitmap = 0;
+GetOptions( "strand-bitmap" => \$usebitmap ) || die "Usage: $0 [--strand-bitmap]\n";
+
 # ask for probe filename to analyze
 print STDERR "Enter filename of sorted mutation bedfile\n";
 my $mutbedfile = <STDIN>;
@@ -32,8 +37,42 @@ my %trxstart = $genes->get_tss();
 my %trxend = $genes->get_tts();
 my %trxstrand = $genes->get_strand();
 
+# If requested, look up each mutation in the strand annotation bitmap for the gene coordinates (written by 
+# GeneAnnotationIndex.py) instead of building a hash with every genic base on each chromosome.
+# The bitmap stores 2 bits per base (0-based): 0 for no gene, 1 for genes on "-" only, 2 for genes on "+" only, and 3 for both.
+# Genes in the bitmap span the bed coordinates exactly, while the hash also includes the base just before each gene,
+# so those bases are kept in %edgebits and combined with the bitmap to give the same results as the hash.
+my $genefile = $genes->get_gene_file();
+my $bitmapfile = "$genefile.strand_bitmap";
+my %bitmapoffset;
+my %bitmapbytes;
+my %strandbits = ( "-" => 1, "+" => 2 );
+my @bitmapstrand = ( "", "-", "+", "AMBIG" );
+if ( $usebitmap )
+{
+	if ( !( -e $bitmapfile && -e "$bitmapfile.idx" && 
+		-M $bitmapfile <= -M $genefile && -M "$bitmapfile.idx" <= -M $genefile ) )
+	{
+		die "No up to date strand annotation bitmap for $genefile (run GeneAnnotationIndex.py on it first)\n";
+	}
+	print STDERR "Using strand annotation bitmap\n";
+	open ( BITMAPIDX, "$bitmapfile.idx" ) || die "Couldn't open file: $bitmapfile.idx\n";
+	while ( my $line = <BITMAPIDX> )
+	{
+		chomp $line;
+		my @fields = split /\t/, $line;
+		$bitmapoffset{$fields[0]} = $fields[1];
+		$bitmapbytes{$fields[0]} = $fields[2];
+	}
+	close ( BITMAPIDX );
+	open ( BITMAP, $bitmapfile ) || die "Couldn't open file: $bitmapfile\n";
+	binmode BITMAP;
+}
+
 my $chr = "";
 my %genelookup;
+my $chrbitmap = "";
+my %edgebits;
 my $mitomutcount = 0;
 while ( my $line = <MUT> )
 {
@@ -47,22 +86,26 @@ while ( my $line = <MUT> )
                 	print STDERR "Starting to process $temp\n";
 			$chr = $temp;
 			%genelookup = ();
+			$chrbitmap = "";
+			%edgebits = ();
+			# The same gene checks are made with or without the strand annotation bitmap, and the genes skipped
+			# here are left out of both the gene lookup hash and the bitmap's edge bases.
 			my $skipped = 0;
 			foreach my $acc ( @{$chromosomes{$chr}} )
 			{
 				my $strand = $trxstrand{$acc};
-                		if ( exists $trxend{$acc} )
-                		{
+				if ( exists $trxend{$acc} )
+				{
 					;
-                		}
-                		else
-                		{
+				}
+				else
+				{
 					$skipped++;
-                        		next;
-                		}
+					next;
+				}
 
-                                my $start;
-                                my $end;
+				my $start;
+				my $end;
 				if ( $strand eq "+" )
 				{
 					$start = $trxstart{$acc};
@@ -77,12 +120,18 @@ while ( my $line = <MUT> )
 				{
 					die "No strand info!\n";
 				}
-		
+	
 				if ( $start >= $end )
 				{
 					die "Error with gene coords!\n";
 				}
-	
+
+				if ( $usebitmap )
+				{
+					$edgebits{$start - 1} |= $strandbits{$strand};
+					next;
+				}
+
 				for ( my $i = $start; $i <= $end; $i++ )
 				{
 					if ( exists $genelookup{$i} )
@@ -107,6 +156,15 @@ while ( my $line = <MUT> )
 			}
 
 			print STDERR "$skipped skipped genes\n";
+
+			if ( $usebitmap && exists $bitmapoffset{$chr} )
+			{
+				seek ( BITMAP, $bitmapoffset{$chr}, 0 ) || die "Couldn't seek in strand annotation bitmap\n";
+				if ( read ( BITMAP, $chrbitmap, $bitmapbytes{$chr} ) != $bitmapbytes{$chr} )
+				{
+					die "Truncated strand annotation bitmap\n";
+				}
+			}
 		}
 		my $mutpos = $fields[2];  #use 1-based end coord;
 		if ( $mutpos != $fields[1] + 1 )
@@ -125,11 +183,23 @@ while ( my $line = <MUT> )
 
 		$trinucref{$trinuc} = 1;
 		$subref{$substitution} = 1;
-		if ( exists $genelookup{$mutpos} )
+
+		# The coding strand of the gene(s) containing the mutation, "AMBIG", or "" if intergenic.
+		my $genestrand = "";
+		if ( $usebitmap )
+		{
+			$genestrand = $bitmapstrand[vec( $chrbitmap, $fields[1], 2 ) | ( $edgebits{$fields[1]} || 0 )];
+		}
+		elsif ( exists $genelookup{$mutpos} )
+		{
+			$genestrand = $genelookup{$mutpos};
+		}
+
+		if ( $genestrand ne "" )
 		{			
-			if ( $genelookup{$mutpos} ne "+" && $genelookup{$mutpos} ne "-" )
+			if ( $genestrand ne "+" && $genestrand ne "-" )
 			{
-				if ( $genelookup{$mutpos} eq "AMBIG" )	
+				if ( $genestrand eq "AMBIG" )	
 				{
 					$intergenicbin{$trinuc}{$substitution}++;
 				}
@@ -138,7 +208,7 @@ while ( my $line = <MUT> )
 					die "Error with gene strand\n";
 				}
 			}
-			elsif ( $genelookup{$mutpos} eq $mutstrand )
+			elsif ( $genestrand eq $mutstrand )
 			{
 				$ntsbin{$trinuc}{$substitution}++; # Shouldn't this be the opposite?
 			}	
@@ -0,0 +1,135 @@
+# This script contains functions for sorting bed files in-process, in the same order as "sort -k1,1 -k2,2n"
+# (first by chromosome as a string, then by start position as a number, with any ties broken by the whole line).
+# Larger inputs can be sorted with bounded memory by writing sorted runs to disk and merging them.
+# Header lines at the start of a bed file (e.g. column names, or "track" and "browser" lines) are kept at the start.
+
+import io, os, heapq, tempfile
+from typing import List, Iterable
+from BgzfFiles import openTextFileForReading
+
+# The most bed data (in bytes of text) that sortBedFile sorts in memory at once.
+DEFAULT_MAX_CHUNK_SIZE = 256*1024*1024
+
+
+# Returns whether or not the given line from the start of a bed file is a header line rather than data.
+def isBedHeaderLine(line: str):
+    choppedUpLine = line.split()
+    return not (len(choppedUpLine) > 1 and choppedUpLine[1].isdigit() and not line.startswith('#'))
+
+
+# Returns the number of header lines at the start of the given bed lines.
+def countBedHeaderLines(bedLines: Iterable[str]):
+
+    headerLineCount = 0
+    for line in bedLines:
+        if not isBedHeaderLine(line): break
+        headerLineCount += 1
+    return headerLineCount
+
+
+# Returns the key used to sort the given bed line.
+def getBedSortKey(line: str):
+    choppedUpLine = line.split(None, 2)
+    return (choppedUpLine[0], int(choppedUpLine[1]), line)
+
+
+# Sorts the given bed lines in memory and returns them as a new list.
+def sortBedLines(lines: Iterable[str]) -> List[str]:
+    return sorted(lines, key = getBedSortKey)
+
+
+# Writes the given bed lines, sorted, to the given file path.
+def writeSortedRun(lines: Iterable[str], runFilePath):
+    with open(runFilePath, 'w') as runFile:
+        runFile.writelines(sortBedLines(lines))
+
+
+# Merges the given sorted bed files into the given output file (already opened for writing) with a k-way heap merge.
+# If there are more than maxOpenFiles runs, they are merged in batches into intermediate runs first.
+# Any inMemoryRuns (sorted bed text already held in memory) are merged in along with the files, without being written out.
+def mergeSortedBedFiles(runFilePaths: List[str], outputFile, maxOpenFiles = 256, inMemoryRuns: Iterable[str] = ()):
+
+    with tempfile.TemporaryDirectory(dir = os.path.dirname(os.path.abspath(outputFile.name))) as intermediateRunDirectory:
+
+        mergePass = 0
+        while len(runFilePaths) > maxOpenFiles:
+            intermediateRunFilePaths = list()
+            for i in range(0, len(runFilePaths), maxOpenFiles):
+                intermediateRunFilePath = os.path.join(intermediateRunDirectory, str(mergePass) + '_' + str(i) + ".bed")
+                with open(intermediateRunFilePath, 'w') as intermediateRunFile:
+                    mergeSortedBedFiles(runFilePaths[i:i+maxOpenFiles], intermediateRunFile, maxOpenFiles)
+                intermediateRunFilePaths.append(intermediateRunFilePath)
+            runFilePaths = intermediateRunFilePaths
+            mergePass += 1
+
+        runFiles = [open(runFilePath, 'r') for runFilePath in runFilePaths]
+        try: outputFile.writelines(heapq.merge(*runFiles, *(io.StringIO(inMemoryRun) for inMemoryRun in inMemoryRuns),
+                                               key = getBedSortKey))
+        finally:
+            for runFile in runFiles: runFile.close()
+
+
+# Reads through the given bed file and returns whether or not it is sorted by chromosome and then start position.
+# (Stops at the first line that is out of order.  Header lines at the start of the file are skipped.)
+# The bed file may be plain text or gzipped.
+def isBedFileSorted(bedFilePath):
+
+    lastChromosome = None
+    lastStartPos = None
+    with openTextFileForReading(bedFilePath) as bedFile:
+        for line in bedFile:
+            if lastChromosome is None and isBedHeaderLine(line): continue
+            choppedUpLine = line.split(None, 2)
+            chromosome = choppedUpLine[0]
+            startPos = int(choppedUpLine[1])
+            if lastChromosome is not None and (chromosome < lastChromosome or
+                                               (chromosome == lastChromosome and startPos < lastStartPos)):
+                return False
+            lastChromosome = chromosome
+            lastStartPos = startPos
+
+    return True
+
+
+# Sorts the given bed file into the given output file path.  If the file has no more than maxChunkSize bytes, it is
+# sorted in memory.  Otherwise, it is split into chunks of about that size which are sorted into runs on disk
+# (next to the output file) and merged, so memory use stays bounded.  Any header lines are written first, unsorted.
+# The bed file may be plain text or gzipped, but the sorted file is always written as plain text.
+def sortBedFile(bedFilePath, sortedBedFilePath, maxChunkSize = DEFAULT_MAX_CHUNK_SIZE):
+
+    with tempfile.TemporaryDirectory(dir = os.path.dirname(os.path.abspath(sortedBedFilePath))) as runDirectory:
+
+        runFilePaths = list()
+        headerLines = list()
+        chunkLines = list()
+        chunkSize = 0
+
+        with openTextFileForReading(bedFilePath) as bedFile:
+            for line in bedFile:
+
+                if len(chunkLines) == 0 and len(runFilePaths) == 0 and isBedHeaderLine(line):
+                    headerLines.append(line)
+                    continue
+
+                chunkLines.append(line)
+                chunkSize += len(line)
+
+                if chunkSize >= maxChunkSize:
+                    runFilePaths.append(os.path.join(runDirectory, str(len(runFilePaths)) + ".bed"))
+                    writeSortedRun(chunkLines, runFilePaths[-1])
+                    chunkLines = list()
+                    chunkSize = 0
+
+        with open(sortedBedFilePath, 'w') as sortedBedFile:
+
+            sortedBedFile.writelines(headerLines)
+
+            # Everything fit in one chunk, so just write it out.
+            if len(runFilePaths) == 0: sortedBedFile.writelines(sortBedLines(chunkLines))
+
+            else:
+                if len(chunkLines) > 0:
+                    runFilePaths.append(os.path.join(runDirectory, str(len(runFilePaths)) + ".bed"))
+                    writeSortedRun(chunkLines, runFilePaths[-1])
+                chunkLines = None
+                mergeSortedBedFiles(runFilePaths, sortedBedFile)
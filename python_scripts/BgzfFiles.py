@@ -0,0 +1,199 @@
+# This script contains functions for reading gzipped (including BGZF) text files and writing BGZF text files.
+# BGZF files (like those produced by bgzip) are a series of independently compressed gzip blocks,
+# so their blocks can be decompressed and compressed in parallel threads (zlib releases the GIL while it works).
+# Any BGZF file is also a valid gzip file, so the output can still be read with gzip, zcat, etc.
+
+import os, io, gzip, zlib, struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Everything in a BGZF block header up to the BSIZE field (the total block size minus 1).
+BGZF_HEADER_PREFIX = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+BGZF_HEADER_SIZE = 18
+
+# The empty block which marks the end of a BGZF file.
+BGZF_EOF_BLOCK = BGZF_HEADER_PREFIX + b"\x1b\x00\x03\x00" + b"\x00"*8
+
+# The most uncompressed data put into one block.  (Small enough that the compressed block always fits in 64 KiB.)
+MAX_BGZF_BLOCK_INPUT_SIZE = 0xff00
+
+
+# Returns whether or not the given bytes start with a BGZF block header.
+def isBgzfHeader(headerBytes: bytes):
+    return (len(headerBytes) >= BGZF_HEADER_SIZE and headerBytes[:4] == b"\x1f\x8b\x08\x04" and
+            headerBytes[12:16] == b"BC\x02\x00")
+
+
+# Reads through the given BGZF file (opened in binary mode) and yields the raw deflate data from each block,
+# along with the CRC32 and size of its uncompressed data.
+def readBgzfBlocks(bgzfFile):
+
+    while True:
+
+        header = bgzfFile.read(12)
+        if len(header) == 0: return
+        if len(header) < 12 or header[:2] != GZIP_MAGIC or not header[3] & 4:
+            raise ValueError("Invalid BGZF block header in " + bgzfFile.name)
+
+        # Find the BSIZE value in the extra subfields.
+        extraLength = struct.unpack("<H", header[10:12])[0]
+        extraFields = bgzfFile.read(extraLength)
+        blockSize = None
+        i = 0
+        while i + 4 <= len(extraFields):
+            subfieldLength = struct.unpack("<H", extraFields[i+2:i+4])[0]
+            if extraFields[i:i+2] == b"BC" and subfieldLength == 2:
+                blockSize = struct.unpack("<H", extraFields[i+4:i+6])[0] + 1
+            i += 4 + subfieldLength
+        if blockSize is None: raise ValueError("Missing BGZF block size in " + bgzfFile.name)
+
+        compressedData = bgzfFile.read(blockSize - extraLength - 20)
+        footer = bgzfFile.read(8)
+        if len(footer) < 8: raise ValueError("Truncated BGZF block in " + bgzfFile.name)
+        dataCRC, dataSize = struct.unpack("<II", footer)
+
+        yield compressedData, dataCRC, dataSize
+
+
+# Decompresses a single BGZF block's deflate data and checks it against the block's CRC32 and size.
+def decompressBgzfBlock(compressedData, dataCRC, dataSize):
+
+    data = zlib.decompress(compressedData, -15)
+    if len(data) != dataSize or zlib.crc32(data) != dataCRC:
+        raise ValueError("BGZF block failed its integrity check.")
+    return data
+
+
+# Compresses the given data into a single, complete BGZF block.
+def compressBgzfBlock(data, compressionLevel = 6):
+
+    compressor = zlib.compressobj(compressionLevel, zlib.DEFLATED, -15)
+    compressedData = compressor.compress(data) + compressor.flush()
+    return (BGZF_HEADER_PREFIX + struct.pack("<H", len(compressedData) + 25) + compressedData +
+            struct.pack("<II", zlib.crc32(data), len(data)))
+
+
+# A raw binary stream of the decompressed contents of a BGZF file.
+# Blocks are decompressed ahead of the reader in a pool of threads.
+class BgzfReader(io.RawIOBase):
+
+    def __init__(self, filePath, threads = DEFAULT_THREADS):
+
+        self.name = filePath
+        self.bgzfFile = open(filePath, 'rb')
+        self.executor = ThreadPoolExecutor(max_workers = threads) if threads > 1 else None
+        self.maxPendingBlocks = threads*4
+        self.decompressedBlocks = self.decompressBlocks()
+        self.currentBlock = b''
+        self.currentBlockPos = 0
+
+
+    # Yields the decompressed data from each block in order.
+    def decompressBlocks(self):
+
+        if self.executor is None:
+            for compressedBlock in readBgzfBlocks(self.bgzfFile): yield decompressBgzfBlock(*compressedBlock)
+            return
+
+        pendingBlocks = deque()
+        for compressedBlock in readBgzfBlocks(self.bgzfFile):
+            pendingBlocks.append(self.executor.submit(decompressBgzfBlock, *compressedBlock))
+            if len(pendingBlocks) >= self.maxPendingBlocks: yield pendingBlocks.popleft().result()
+        while pendingBlocks: yield pendingBlocks.popleft().result()
+
+
+    def readable(self): return True
+
+    def readinto(self, buffer):
+
+        # Move on to the next non-empty block if this one has been used up.
+        while self.currentBlockPos >= len(self.currentBlock):
+            self.currentBlock = next(self.decompressedBlocks, None)
+            self.currentBlockPos = 0
+            if self.currentBlock is None:
+                self.currentBlock = b''
+                return 0
+
+        readSize = min(len(buffer), len(self.currentBlock) - self.currentBlockPos)
+        buffer[:readSize] = self.currentBlock[self.currentBlockPos:self.currentBlockPos + readSize]
+        self.currentBlockPos += readSize
+        return readSize
+
+    def close(self):
+        if not self.closed:
+            if self.executor is not None: self.executor.shutdown(cancel_futures = True)
+            self.bgzfFile.close()
+        super().close()
+
+
+# A raw binary stream which writes BGZF blocks (and the EOF marker block on closing) to the given file path.
+# Blocks are compressed in batches in a pool of threads.
+class BgzfWriter(io.RawIOBase):
+
+    def __init__(self, filePath, threads = DEFAULT_THREADS, compressionLevel = 6):
+
+        self.name = filePath
+        self.bgzfFile = open(filePath, 'wb')
+        self.executor = ThreadPoolExecutor(max_workers = threads) if threads > 1 else None
+        self.compressionLevel = compressionLevel
+        self.batchSize = MAX_BGZF_BLOCK_INPUT_SIZE*threads*4
+        self.uncompressedData = bytearray()
+
+
+    # Compresses and writes all complete blocks of uncompressed data (and the leftover partial block, if requested).
+    def writeBlocks(self, includePartialBlock):
+
+        blockCount = len(self.uncompressedData)//MAX_BGZF_BLOCK_INPUT_SIZE
+        if includePartialBlock and len(self.uncompressedData) % MAX_BGZF_BLOCK_INPUT_SIZE: blockCount += 1
+
+        blocks = [bytes(self.uncompressedData[i*MAX_BGZF_BLOCK_INPUT_SIZE:(i+1)*MAX_BGZF_BLOCK_INPUT_SIZE])
+                  for i in range(blockCount)]
+        del self.uncompressedData[:blockCount*MAX_BGZF_BLOCK_INPUT_SIZE]
+
+        compressionLevels = [self.compressionLevel]*blockCount
+        if self.executor is None: compressedBlocks = map(compressBgzfBlock, blocks, compressionLevels)
+        else: compressedBlocks = self.executor.map(compressBgzfBlock, blocks, compressionLevels)
+        for compressedBlock in compressedBlocks: self.bgzfFile.write(compressedBlock)
+
+
+    def writable(self): return True
+
+    def write(self, data):
+        self.uncompressedData += data
+        if len(self.uncompressedData) >= self.batchSize: self.writeBlocks(False)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.writeBlocks(True)
+                self.bgzfFile.write(BGZF_EOF_BLOCK)
+            finally:
+                if self.executor is not None: self.executor.shutdown()
+                self.bgzfFile.close()
+        super().close()
+
+
+# Returns whether or not the given file is gzipped (including BGZF compressed files).
+def isGzipFile(filePath):
+    with open(filePath, 'rb') as file: return file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+# Opens the given file for reading as text, whether it is plain text, gzipped, or BGZF compressed.
+# (BGZF files are decompressed with the given number of threads.)
+def openTextFileForReading(filePath, threads = DEFAULT_THREADS):
+
+    with open(filePath, 'rb') as file: header = file.read(BGZF_HEADER_SIZE)
+
+    if not header.startswith(GZIP_MAGIC): return open(filePath, 'r')
+    elif isBgzfHeader(header): return io.TextIOWrapper(io.BufferedReader(BgzfReader(filePath, threads)))
+    else: return gzip.open(filePath, 'rt')
+
+
+# Opens the given file for writing BGZF compressed text, compressing with the given number of threads.
+def openBgzfFileForWriting(filePath, threads = DEFAULT_THREADS):
+    return io.TextIOWrapper(io.BufferedWriter(BgzfWriter(filePath, threads)))
@@ -1,10 +1,22 @@
-import os
-from typing import List, Dict
-from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+import os, sys, argparse
+from typing import List, Dict, Tuple
+import numpy as np
+from StageInstrumentation import instrumentStage
+
+# The number of set bits in each possible byte, for counting the genes in packed gene sets.
+BYTE_POPCOUNTS = np.unpackbits(np.arange(256, dtype = np.uint8)[:,None], axis = 1).sum(axis = 1).astype(np.int64)
 
 
 # Given a list of gene designations file paths, check the amount of overlap between genes in each unique pair.
-def checkOverlap(geneDesignationsFilePaths, intersectOutputFilePath, unionOutputFilePath):
+# If overlapMatrixFilePathPrefix is given (or useBitsets is True), the overlap is found with checkOverlapWithBitsets
+# instead, and the pairwise overlaps are written as intersection, union and Jaccard index matrices.
+def checkOverlap(geneDesignationsFilePaths, intersectOutputFilePath, unionOutputFilePath,
+                 overlapMatrixFilePathPrefix = None, useBitsets = False):
+
+    if useBitsets or overlapMatrixFilePathPrefix is not None:
+        checkOverlapWithBitsets(geneDesignationsFilePaths, intersectOutputFilePath, unionOutputFilePath,
+                                overlapMatrixFilePathPrefix)
+        return
 
     print("Working with files:")
     for geneDesignationsFilePath in geneDesignationsFilePaths:
@@ -71,8 +83,136 @@ def checkOverlap(geneDesignationsFilePaths, intersectOutputFilePath, unionOutput
     print("Total Overlap: ", totalOverlapCount, '/', len(geneUnion), sep = '')
 
 
+# Reads the gene names (the first column) from each of the given files and interns them to integer IDs in the order
+# they are first seen.  Returns the list of gene names (indexed by ID) and a 2D array of packed bits with a row for each
+# file, where bit i is set if the file contains the gene with ID i.
+def readPackedGeneSets(geneDesignationsFilePaths) -> Tuple[List[str], np.ndarray]:
+
+    geneIDs: Dict[str,int] = dict()
+    geneSetIDs: List[np.ndarray] = list()
+
+    for geneDesignationsFilePath in geneDesignationsFilePaths:
+        with open(geneDesignationsFilePath, 'r') as geneDesignationsFile:
+            geneSetIDs.append(np.fromiter((geneIDs.setdefault(line.strip().split('\t')[0], len(geneIDs))
+                                           for line in geneDesignationsFile), dtype = np.int64))
+
+    geneSets = np.zeros((len(geneSetIDs), len(geneIDs)), dtype = bool)
+    for geneSetIndex, IDs in enumerate(geneSetIDs): geneSets[geneSetIndex, IDs] = True
+
+    return list(geneIDs), np.packbits(geneSets, axis = 1)
+
+
+# Returns the number of genes in each of the given packed gene sets (along the last axis).
+# (NumPy 2 has a popcount ufunc, and older versions use the lookup table.)
+def countPackedGenes(packedGeneSets: np.ndarray):
+    if hasattr(np, "bitwise_count"): return np.bitwise_count(packedGeneSets).sum(axis = -1, dtype = np.int64)
+    else: return BYTE_POPCOUNTS[packedGeneSets].sum(axis = -1)
+
+
+# Returns the k x k matrices of intersection sizes, union sizes, and Jaccard indices (NaN where both sets are empty)
+# for the given k packed gene sets.
+def getOverlapMatrices(packedGeneSets: np.ndarray):
+
+    geneSetSizes = countPackedGenes(packedGeneSets)
+    intersectionSizes = np.zeros((len(packedGeneSets), len(packedGeneSets)), dtype = np.int64)
+
+    # AND each gene set against every other set at once.
+    for geneSetIndex, packedGeneSet in enumerate(packedGeneSets):
+        intersectionSizes[geneSetIndex] = countPackedGenes(packedGeneSets & packedGeneSet)
+
+    unionSizes = geneSetSizes[:,None] + geneSetSizes[None,:] - intersectionSizes
+    jaccardIndices = np.full(intersectionSizes.shape, np.nan)
+    np.divide(intersectionSizes, unionSizes, out = jaccardIndices, where = unionSizes > 0)
+
+    return intersectionSizes, unionSizes, jaccardIndices
+
+
+# Returns the paths to the intersection, union, and Jaccard index matrix files for the given prefix.
+def getOverlapMatrixFilePaths(overlapMatrixFilePathPrefix):
+    return (overlapMatrixFilePathPrefix + "_intersection_matrix.tsv", overlapMatrixFilePathPrefix + "_union_matrix.tsv",
+            overlapMatrixFilePathPrefix + "_jaccard_matrix.tsv")
+
+
+# Writes the given matrix as a tsv file with the given labels on the first row and column.
+# NaN values are written as "NA".
+def writeOverlapMatrix(matrixFilePath, labels: List[str], matrix: np.ndarray):
+
+    with open(matrixFilePath, 'w') as matrixFile:
+        matrixFile.write('\t'.join([''] + labels) + '\n')
+        for label, row in zip(labels, matrix.tolist()):
+            matrixFile.write('\t'.join([label] + ["NA" if value != value else str(value) for value in row]) + '\n')
+
+
+# Checks the overlap between every pair of the given gene sets at once by representing each set as a packed bit vector
+# over the interned gene names.  The pairwise intersection and union sizes and Jaccard indices are written as
+# matrices if overlapMatrixFilePathPrefix is given, and the total intersection and union are written as in checkOverlap.
+def checkOverlapWithBitsets(geneDesignationsFilePaths, intersectOutputFilePath, unionOutputFilePath,
+                            overlapMatrixFilePathPrefix = None):
+
+    print("Working with",len(geneDesignationsFilePaths),"files.")
+    print()
+
+    with instrumentStage("checkOverlapWithBitsets", geneSetCount = len(geneDesignationsFilePaths)) as stage:
+
+        genes, packedGeneSets = readPackedGeneSets(geneDesignationsFilePaths)
+        stage.addRecords(int(countPackedGenes(packedGeneSets).sum()))
+
+        for geneDesignationsFilePath, geneCount in zip(geneDesignationsFilePaths, countPackedGenes(packedGeneSets).tolist()):
+            print(geneCount,"genes found in",os.path.basename(geneDesignationsFilePath))
+        print()
+
+        if overlapMatrixFilePathPrefix is not None:
+
+            # Label the matrices with the file names, unless they're ambiguous.
+            labels = [os.path.basename(geneDesignationsFilePath) for geneDesignationsFilePath in geneDesignationsFilePaths]
+            if len(set(labels)) < len(labels): labels = list(geneDesignationsFilePaths)
+
+            for matrixFilePath, matrix in zip(getOverlapMatrixFilePaths(overlapMatrixFilePathPrefix),
+                                              getOverlapMatrices(packedGeneSets)):
+                writeOverlapMatrix(matrixFilePath, labels, matrix)
+                print("Wrote",os.path.basename(matrixFilePath))
+            print()
+
+        # Genes are interned in the order they're first seen, so both of these are in the same order as in checkOverlap.
+        intersectingGenes = np.flatnonzero(np.unpackbits(np.bitwise_and.reduce(packedGeneSets, axis = 0),
+                                                         count = len(genes)))
+        if intersectOutputFilePath is not None:
+            with open(intersectOutputFilePath, 'w') as intersectOutputFile:
+                for geneID in intersectingGenes.tolist(): intersectOutputFile.write(genes[geneID] + '\t' + "NA" + '\n')
+        if unionOutputFilePath is not None:
+            with open(unionOutputFilePath, 'w') as unionOutputFile:
+                for gene in genes: unionOutputFile.write(gene + '\t' + "NA" + '\n')
+
+    print("Total Overlap: ", len(intersectingGenes), '/', len(genes), sep = '')
+
+
+# Runs checkOverlap non-interactively with the given command line arguments.
+def runFromCommandLine(arguments):
+
+    parser = argparse.ArgumentParser(description = "Check the overlap between sets of genes.")
+    parser.add_argument("geneDesignationsFilePaths", nargs = '+', metavar = "filtered_genes_file",
+                        help = "Files with a gene name in the first column of each line")
+    parser.add_argument("--intersection-output", dest = "intersectOutputFilePath", metavar = "FILE",
+                        help = "Output the intersection to this file")
+    parser.add_argument("--union-output", dest = "unionOutputFilePath", metavar = "FILE",
+                        help = "Output the union to this file")
+    parser.add_argument("--overlap-matrices", dest = "overlapMatrixFilePathPrefix", metavar = "PREFIX",
+                        help = "Output the pairwise intersection, union and Jaccard index matrices to files starting "
+                               "with this prefix (implies --bitsets)")
+    parser.add_argument("--bitsets", action = "store_true", help = "Compare the gene sets as packed bit vectors")
+    args = parser.parse_args(arguments)
+
+    checkOverlap(args.geneDesignationsFilePaths, args.intersectOutputFilePath, args.unionOutputFilePath,
+                 args.overlapMatrixFilePathPrefix, args.bitsets)
+
+
 def main():
 
+    # Given any command line arguments, run without the UI.
+    if len(sys.argv) > 1: return runFromCommandLine(sys.argv[1:])
+
+    from benbiohelpers.TkWrappers.TkinterDialog import TkinterDialog
+
     # Create a simple dialog for selecting the gene designation files.
     dialog = TkinterDialog(workingDirectory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
     dialog.createMultipleFileSelector("Filtered Genes File", 0, "highly_expressed_genes.tsv", 
@@ -2,15 +2,33 @@
 # and calculates how many mutations occured in transcribed vs. non-transcribed strands.
 # NOTE:  Both input files must be sorted for this script to run properly. 
 #        (Sorted first by chromosome (string) and then by nucleotide position (numeric))
-
-import os, warnings
-from typing import List
-from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog, Selections
-from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import (Metadata, generateFilePath, getDataDirectory,
-                                                                  DataTypeStr, getContext)
+#        Use the sortInputs option in countInTranscribedRegions to check for this and sort the inputs if necessary.
+
+import os, io, sys, shutil, argparse, warnings
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Deque, Dict, Tuple
+from GeneAnnotationIndex import (GeneIntervalIndex, getBedHeaderLineCount,
+                                 TRANSCRIBED_PLUS, TRANSCRIBED_MINUS, AMBIGUOUS)
+from MutationStore import MutationStore, updateMutationStore
+from BedSorting import isBedFileSorted, sortBedFile
+from BgzfFiles import openTextFileForReading, isGzipFile
+from StageInstrumentation import instrumentStage
+
+# The chromosomes mutations are expected to fall on.
+ACCEPTABLE_CHROMOSOMES = ("chrI","chrII","chrIII","chrIV","chrV","chrX")
+
+# The rows of the cohort counts array in the CountsFileGenerator.
+INTERGENIC_AND_AMBIGUOUS_BIN = 0
+TS_BIN = 1
+NTS_BIN = 2
 
 class MutationData:
 
+    # Slots keep each mutation small while it waits in the overlap window.
+    __slots__ = ("chromosome", "position", "context", "strand", "strandMatchesTS", "cohort", "cohortContextIndex")
+
     def __init__(self, line, acceptableChromosomes):
 
         # Read in the next line.
@@ -23,6 +41,8 @@ class MutationData:
         self.strand = choppedUpLine[5] # Either '+' or '-' depending on which strand houses the mutation.
         self.strandMatchesTS = None # Whether or not the strand of the mutation matches the transcribed strand in
                                     # the gene region encompassing the mutation (NoneType if intergenic or ambiguous)
+        self.cohort = choppedUpLine[6] if len(choppedUpLine) > 6 else None # e.g. the genotype (from ParseVCF_ForMutperiod)
+        self.cohortContextIndex = None # The mutation's column in the cohort counts array, if cohorts are being counted.
 
         # Make sure the mutation is in a valid chromosome.
         if not self.chromosome in acceptableChromosomes:
@@ -32,6 +52,8 @@ class MutationData:
 # Contains data on a single gene position obtained by reading the next available line in a given file.
 class GeneData:
 
+    __slots__ = ("chromosome", "startPos", "endPos", "transcribedStrand")
+
     def __init__(self, line):
 
         # Read in the next line.
@@ -43,6 +65,84 @@ class GeneData:
         self.transcribedStrand = {'+':'-', '-':'+'}[choppedUpLine[5]] # The transcribed strand (reversed because the coding strand is given)
 
 
+# Bins the positions of genic mutations within their genes into fixed-size TS and NTS histograms, as an alternative to
+# recording every mutation's gene position.  Absolute bins are binWidth bases wide, counted from the gene's 5' end,
+# with a final overflow bin for anything past the last bin.  Relative bins split each gene into equal parts from 5' to 3'
+# (by the proportion of the gene's bases at or behind the mutation).  Either or both kinds of bins may be used.
+class MetageneHistogram:
+
+    def __init__(self, absoluteBinWidth = None, absoluteBinCount = None, relativeBinCount = None):
+
+        if (absoluteBinWidth is None) != (absoluteBinCount is None):
+            raise ValueError("Absolute bins need both a bin width and a bin count.")
+        if absoluteBinWidth is None and relativeBinCount is None:
+            raise ValueError("No absolute or relative metagene bins given.")
+        if (absoluteBinWidth is not None and (absoluteBinWidth < 1 or absoluteBinCount < 1) or
+            relativeBinCount is not None and relativeBinCount < 1):
+            raise ValueError("Metagene bin widths and counts must be positive.")
+
+        self.absoluteBinWidth = absoluteBinWidth
+        self.absoluteBinCount = absoluteBinCount
+        self.relativeBinCount = relativeBinCount
+
+        # Counts for TS (row 0) and NTS (row 1) mutations in each bin.  (The last absolute bin is the overflow bin.)
+        self.absoluteCounts = None if absoluteBinWidth is None else np.zeros((2, absoluteBinCount + 1), dtype = np.int64)
+        self.relativeCounts = None if relativeBinCount is None else np.zeros((2, relativeBinCount), dtype = np.int64)
+
+
+    # Returns a new, empty histogram with the same bins.
+    def getEmptyCopy(self):
+        return MetageneHistogram(self.absoluteBinWidth, self.absoluteBinCount, self.relativeBinCount)
+
+
+    # Adds a single mutation at the given absolute position (1-based, from the gene's 5' end) in a gene of the given length.
+    def addMutation(self, absolutePos, geneLength, strandMatchesTS):
+
+        strandRow = 0 if strandMatchesTS else 1
+        if self.absoluteCounts is not None:
+            self.absoluteCounts[strandRow, min((absolutePos - 1)//self.absoluteBinWidth, self.absoluteBinCount)] += 1
+        if self.relativeCounts is not None:
+            self.relativeCounts[strandRow, (absolutePos - 1)*self.relativeBinCount//geneLength] += 1
+
+
+    # Adds every mutation in the given arrays at once.  (See addMutation.)
+    def addMutations(self, absolutePositions: np.ndarray, geneLengths: np.ndarray, strandMatchesTS: np.ndarray):
+
+        strandRows = np.where(strandMatchesTS, 0, 1)
+        if self.absoluteCounts is not None:
+            np.add.at(self.absoluteCounts, (strandRows, np.minimum((absolutePositions - 1)//self.absoluteBinWidth,
+                                                                   self.absoluteBinCount)), 1)
+        if self.relativeCounts is not None:
+            np.add.at(self.relativeCounts, (strandRows, (absolutePositions - 1)*self.relativeBinCount//geneLengths), 1)
+
+
+    # Adds the counts from another histogram with the same bins (e.g. from a shard of a mutation file).
+    def addHistogram(self, metageneHistogram: "MetageneHistogram"):
+        if self.absoluteCounts is not None: self.absoluteCounts += metageneHistogram.absoluteCounts
+        if self.relativeCounts is not None: self.relativeCounts += metageneHistogram.relativeCounts
+
+
+    # Writes the histogram to the given file, with a row for each bin.
+    # Absolute bins are given as 1-based, inclusive positions, and relative bins as proportions of the gene.
+    def write(self, metageneHistogramFilePath):
+
+        with open(metageneHistogramFilePath, 'w') as metageneHistogramFile:
+
+            metageneHistogramFile.write('\t'.join(("Bin_Type", "Bin_Start", "Bin_End", "TS_Counts", "NTS_Counts")) + '\n')
+
+            if self.absoluteCounts is not None:
+                for binIndex, (TSCounts, NTSCounts) in enumerate(self.absoluteCounts.T.tolist()):
+                    binEnd = "Inf" if binIndex == self.absoluteBinCount else str((binIndex + 1)*self.absoluteBinWidth)
+                    metageneHistogramFile.write('\t'.join(("Absolute", str(binIndex*self.absoluteBinWidth + 1), binEnd,
+                                                           str(TSCounts), str(NTSCounts))) + '\n')
+
+            if self.relativeCounts is not None:
+                for binIndex, (TSCounts, NTSCounts) in enumerate(self.relativeCounts.T.tolist()):
+                    metageneHistogramFile.write('\t'.join(("Relative", str(binIndex/self.relativeBinCount),
+                                                           str((binIndex + 1)/self.relativeBinCount),
+                                                           str(TSCounts), str(NTSCounts))) + '\n')
+
+
 # Uses the given gene positions file and mutation file to count the number of mutations 
 # in transcribed, non-transcribed and intergenic regions.  
 # Generates a new file to store these results.
@@ -53,11 +153,13 @@ class CountsFileGenerator:
 
     def __init__(self, mutationFilePath, genePositionsFilePath, 
                  transcribedRegionMutationCountsFilePath, acceptableChromosomes,
-                 mutationGenePosFilePath = None):
+                 mutationGenePosFilePath = None, cohortCountsFilePath = None,
+                 metageneHistogram: MetageneHistogram = None):
 
         # Open the mutation and gene positions files to compare against one another.
-        self.mutationFile = open(mutationFilePath, 'r')
+        self.mutationFile = openTextFileForReading(mutationFilePath)
         self.genePosFile = open(genePositionsFilePath,'r')
+        for _ in range(getBedHeaderLineCount(genePositionsFilePath)): self.genePosFile.readline()
         self.mutationGenePosFilePath = mutationGenePosFilePath
 
         # Store the other arguments passed to the constructor
@@ -70,11 +172,23 @@ class CountsFileGenerator:
         self.nontranscribedRegionMutationCounts = dict() 
         self.intergenicAndAmbiguousMutationCounts = dict()
 
-        # If mutationGenePosFilePath is given, store absolute and relative gene positions as a list of tuples
-        if self.mutationGenePosFilePath is not None: self.mutationGenePos = list()
+        # If cohortCountsFilePath is given, mutations are also counted separately for each cohort (the 7th column
+        # of the mutation file) in a dense table with a row for each bin (see above) and a column for each
+        # (cohort, context) pair.  Columns are added as new pairs are found.
+        # (Plain lists are used because incrementing single elements of a NumPy array is much slower.)
+        self.cohortCountsFilePath = cohortCountsFilePath
+        self.cohortContextIndices: Dict[Tuple[str,str], int] = dict()
+        self.cohortCounts: List[List[int]] = [list(), list(), list()]
+
+        # If mutationGenePosFilePath is given, absolute and relative gene positions are written to this file
+        # as they are found during counting.  If a metagene histogram is also given, the positions are binned into
+        # it instead, and the histogram is written to the file in place of the individual positions.
+        self.mutationGenePosFile = None
+        self.metageneHistogram = metageneHistogram
 
         # Keeps track of mutations that matched to a gene to check for overlap.
-        self.mutationsInPotentialOverlap: List[MutationData] = list()
+        # Mutations are added in order of position, so those behind a new gene can be removed from the front.
+        self.mutationsInPotentialOverlap: Deque[MutationData] = deque()
 
         # The mutation and gene currently being investigated.
         self.currentMutation: MutationData = None
@@ -96,8 +210,33 @@ class CountsFileGenerator:
             # Assign each mutation to intergenic/ambiguous by default
             self.intergenicAndAmbiguousMutationCounts[self.currentMutation.context] = \
                 self.intergenicAndAmbiguousMutationCounts.setdefault(self.currentMutation.context,0) + 1
+            if self.cohortCountsFilePath is not None:
+                self.currentMutation.cohortContextIndex = self.getCohortContextIndex(self.currentMutation)
+                self.cohortCounts[INTERGENIC_AND_AMBIGUOUS_BIN][self.currentMutation.cohortContextIndex] += 1
 
     
+    # Returns the column of the cohort counts array for the given mutation's cohort and context,
+    # adding a new column (and growing the array) if necessary.
+    def getCohortContextIndex(self, mutation: MutationData):
+
+        if mutation.cohort is None:
+            raise ValueError("Mutation at " + mutation.chromosome + ':' + str(mutation.position) +
+                             " has no cohort (7th column) to count by.")
+
+        cohortContextIndex = self.cohortContextIndices.setdefault((mutation.cohort, mutation.context),
+                                                                  len(self.cohortContextIndices))
+        if cohortContextIndex == len(self.cohortCounts[0]):
+            for binCounts in self.cohortCounts: binCounts.append(0)
+        return cohortContextIndex
+
+
+    # Moves the given mutation from one bin to another in the cohort counts (if cohorts are being counted).
+    def moveCohortCount(self, mutation: MutationData, fromBin, toBin):
+        if mutation.cohortContextIndex is None: return
+        self.cohortCounts[fromBin][mutation.cohortContextIndex] -= 1
+        self.cohortCounts[toBin][mutation.cohortContextIndex] += 1
+
+
     # Reads in the next gene from the genePos file into currentGene
     def readNextGene(self) -> GeneData:
 
@@ -129,6 +268,20 @@ class CountsFileGenerator:
         return (absolutePos, relativePos)
 
 
+    # Opens the mutation gene positions file for writing and writes its headers.
+    def openMutationGenePosFile(self):
+
+        mutationGenePosFile = open(self.mutationGenePosFilePath, 'w')
+        mutationGenePosFile.write('\t'.join(("Absolute_Position","Relative_Position")) + '\n')
+        return mutationGenePosFile
+
+
+    # Writes a single mutation's absolute and relative gene position to the given file.
+    @staticmethod
+    def writeMutationGenePos(mutationGenePosFile, absolutePos, relativePos):
+        mutationGenePosFile.write('\t'.join((str(absolutePos), str(relativePos))) + '\n')
+
+
     # Takes a mutation object and gene object which have unequal chromosomes and read through data until they are equal.
     def reconcileChromosomes(self):
         
@@ -170,30 +323,42 @@ class CountsFileGenerator:
                 self.transcribedRegionMutationCounts[self.currentMutation.context] = \
                     self.transcribedRegionMutationCounts.setdefault(self.currentMutation.context, 0) + 1
                 self.currentMutation.strandMatchesTS = True
+                self.moveCohortCount(self.currentMutation, INTERGENIC_AND_AMBIGUOUS_BIN, TS_BIN)
             else: 
                 self.nontranscribedRegionMutationCounts[self.currentMutation.context] = \
                     self.nontranscribedRegionMutationCounts.setdefault(self.currentMutation.context, 0) + 1
                 self.currentMutation.strandMatchesTS = False
+                self.moveCohortCount(self.currentMutation, INTERGENIC_AND_AMBIGUOUS_BIN, NTS_BIN)
             
             # Add the mutation to the list of mutations in the current nucleosome
             self.mutationsInPotentialOverlap.append(self.currentMutation)
 
-            # If relevant, add the mutation's gene positions to the list.
-            if self.mutationGenePosFilePath is not None: 
-                self.mutationGenePos.append(self.getMutationGenePos(self.currentMutation, self.currentGene))
+            # If relevant, write (or bin) the mutation's gene positions.
+            if self.mutationGenePosFile is not None: 
+                self.writeMutationGenePos(self.mutationGenePosFile, 
+                                          *self.getMutationGenePos(self.currentMutation, self.currentGene))
+            elif self.metageneHistogram is not None and self.mutationGenePosFilePath is not None:
+                self.metageneHistogram.addMutation(self.getMutationGenePos(self.currentMutation, self.currentGene)[0],
+                                                   self.currentGene.endPos - self.currentGene.startPos + 1,
+                                                   self.currentMutation.strandMatchesTS)
 
 
     # Check to see if any previous mutations called for previous genes are present in the current gene due to overlap.
     def checkMutationsInOverlap(self):    
 
         # First, get rid of any mutations that fall before the start position of the new gene.
-        self.mutationsInPotentialOverlap = [mutation for mutation in self.mutationsInPotentialOverlap 
-                                            if mutation.position >= self.currentGene.startPos and 
-                                            mutation.chromosome == self.currentGene.chromosome]
+        # (Genes are sorted, so these mutations can't be in any later genes either.)
+        while (len(self.mutationsInPotentialOverlap) > 0 and 
+               (self.mutationsInPotentialOverlap[0].position < self.currentGene.startPos or
+                self.mutationsInPotentialOverlap[0].chromosome != self.currentGene.chromosome)):
+            self.mutationsInPotentialOverlap.popleft()
 
         # Next, check all remaining mutations to see if their previous TS/NTS assignment matches with the new gene.
         for mutation in self.mutationsInPotentialOverlap:
-            
+
+            # Skip mutations that were already found to be ambiguous.
+            if mutation.strandMatchesTS is None: continue
+
             assert self.mutationGenePosFilePath is None, "No gene overlap should exist while recording gene-relative mutation positions."
                 
 
@@ -206,16 +371,41 @@ class CountsFileGenerator:
                 if mutation.strandMatchesTS: self.transcribedRegionMutationCounts[mutation.context] -= 1
                 else: self.nontranscribedRegionMutationCounts[mutation.context] -= 1
                 self.intergenicAndAmbiguousMutationCounts[mutation.context] += 1
+                self.moveCohortCount(mutation, TS_BIN if mutation.strandMatchesTS else NTS_BIN,
+                                     INTERGENIC_AND_AMBIGUOUS_BIN)
                 mutation.strandMatchesTS = None
 
-        # Remove any mutations that were found to be ambiguous.
-        self.mutationsInPotentialOverlap = [mutation for mutation in self.mutationsInPotentialOverlap 
-                                            if mutation.strandMatchesTS is not None]
-
 
     # Assign all mutations to either the TS, NTS, or intergenic/ambiguous bins based on the genePos file.
     # (Further bins results by mutation context.)
     def count(self):
+
+        with instrumentStage("CountsFileGenerator.count", mutationFilePath = self.mutationFile.name) as stage:
+
+            if self.mutationGenePosFilePath is not None and self.metageneHistogram is None:
+                self.mutationGenePosFile = self.openMutationGenePosFile()
+            try: self.countMutations()
+            except BaseException:
+                # Don't leave a partial mutation gene positions file behind.
+                if self.mutationGenePosFile is not None:
+                    self.mutationGenePosFile.close()
+                    os.remove(self.mutationGenePosFilePath)
+                raise
+            if self.mutationGenePosFile is not None: self.mutationGenePosFile.close()
+
+            stage.addRecords(self.getCountedMutationTotal())
+
+
+    # Returns the total number of mutations counted so far across all bins.
+    def getCountedMutationTotal(self):
+        return sum(sum(countsDict.values()) for countsDict in (self.transcribedRegionMutationCounts,
+                                                               self.nontranscribedRegionMutationCounts,
+                                                               self.intergenicAndAmbiguousMutationCounts))
+
+
+    # The merge-walk for count.
+    def countMutations(self):
+
         # Get data on the first mutation and gene and reconcile their chromosomes if necessary to start things off.
         # If either the mutation file or gene file is empty, make sure to bypass the check.
         self.readNextMutation()
@@ -276,27 +466,491 @@ class CountsFileGenerator:
                     TSMutationCountsFile.write('\t'.join((context.split('>')[0],context.split('>')[1],
                                                         str(TSCounts), str(NTSCounts), str(IACounts), str(NTSOverTS))) + '\n')
 
+        self.writeCohortResults()
+
+        # (Mutation gene positions were already written during counting, unless they were binned.)
+        if self.mutationGenePosFilePath is not None and self.metageneHistogram is not None:
+            self.metageneHistogram.write(self.mutationGenePosFilePath)
+
+
+    # Writes the cohort counts (if they were requested) as a single long format table, with a row for each cohort
+    # and context in the same format as the mutation counts file.
+    def writeCohortResults(self):
+
+        if self.cohortCountsFilePath is None: return
+
+        with open(self.cohortCountsFilePath, 'w') as cohortCountsFile:
+
+            cohortCountsFile.write('\t'.join(("Cohort", "Mutation_Context", "Mutant_Base", "TS_Counts", "NTS_Counts",
+                                              "Intergenic_And_Ambiguous_Counts", "NTS_to_TS_Ratio")) + '\n')
+
+            cohortCounts = self.cohortCounts
+            for (cohort, context), cohortContextIndex in sorted(self.cohortContextIndices.items(),
+                                                                key = lambda item: (item[0][0], item[0][1][4] + item[0][1])):
+
+                TSCounts = cohortCounts[TS_BIN][cohortContextIndex]
+                NTSCounts = cohortCounts[NTS_BIN][cohortContextIndex]
+                IACounts = cohortCounts[INTERGENIC_AND_AMBIGUOUS_BIN][cohortContextIndex]
+
+                if TSCounts != 0: NTSOverTS = NTSCounts/TSCounts
+                else: NTSOverTS = "NA"
+
+                cohortCountsFile.write('\t'.join((cohort, context.split('>')[0], context.split('>')[1],
+                                                  str(TSCounts), str(NTSCounts), str(IACounts), str(NTSOverTS))) + '\n')
+
+
+# An alternative to the CountsFileGenerator which loads all the mutations at once and assigns them to
+# TS, NTS, or intergenic/ambiguous bins with vectorized lookups against a GeneIntervalIndex.
+# The results are identical to those from the merge-walk in CountsFileGenerator, 
+# including which mutations are counted at all when the gene positions file ends before the mutation file.
+# If a byte range is given, only the mutations in that part of the mutation file are counted, and the counts
+# are expected to be combined with those from the rest of the file's shards using addShardCounts.
+class IntervalIndexCountsFileGenerator(CountsFileGenerator):
+
+    # NOTE: The base class's constructor opens both input files for line-by-line reading, so it is not called here.
+    def __init__(self, mutationFilePath, geneIntervalIndex: GeneIntervalIndex, 
+                 transcribedRegionMutationCountsFilePath, acceptableChromosomes,
+                 mutationGenePosFilePath = None, mutationRange = None, mutationStorePath = None,
+                 metageneHistogram: MetageneHistogram = None):
+
+        self.mutationFilePath = mutationFilePath
+        # If given, mutations are read from this mutation store instead of the mutation file.
+        self.mutationStorePath = mutationStorePath
+        # If given, only this range of mutations is counted as a shard of the whole file: a byte range of the
+        # mutation file, or a range of rows in the mutation store.
+        self.mutationRange = mutationRange
+        self.geneIntervalIndex = geneIntervalIndex
+        self.mutationGenePosFilePath = mutationGenePosFilePath
+        self.acceptableChromosomes = acceptableChromosomes
+        self.transcribedRegionMutationCountsFilePath = transcribedRegionMutationCountsFilePath
+        self.cohortCountsFilePath = None # Cohort counts are only kept by the merge-walk.
+
+        self.transcribedRegionMutationCounts = dict()
+        self.nontranscribedRegionMutationCounts = dict() 
+        self.intergenicAndAmbiguousMutationCounts = dict()
+
+        self.metageneHistogram = metageneHistogram
+        # Mutation gene positions are written out a chromosome at a time as they are found, so they are never all
+        # held in memory.  (Shards write theirs to a temporary file which is appended to the full file by addShardCounts.)
+        self.mutationGenePosFile = None
+
+        # The chromosome and context of the first mutation past the last gene, which the merge-walk reads (and
+        # counts as intergenic) before stopping.
+        self.firstUncountedMutation = None
+
+
+    # Reads the relevant columns from every line of the mutation file (or the given range of it) into arrays.
+    # (Byte ranges can only be read from plain text mutation files.  Gzipped files are read whole.)
+    def readMutations(self):
+
+        if self.mutationStorePath is not None: return self.readMutationStore()
+
+        if self.mutationRange is None: mutationFile = openTextFileForReading(self.mutationFilePath)
+        else:
+            if isGzipFile(self.mutationFilePath):
+                raise ValueError("Byte ranges can't be read from gzipped mutation files: " + self.mutationFilePath)
+            with open(self.mutationFilePath, 'rb') as rawMutationFile:
+                rawMutationFile.seek(self.mutationRange[0])
+                mutationFile = io.StringIO(rawMutationFile.read(self.mutationRange[1] - self.mutationRange[0]).decode())
+
+        with mutationFile, warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message = "loadtxt: input contained no data")
+            mutationColumns = np.loadtxt(mutationFile, dtype = str, usecols = (0,1,3,4,5), 
+                                         comments = None, ndmin = 2)
+
+        chromosomes = mutationColumns[:,0]
+        positions = mutationColumns[:,1].astype(np.int64)
+        contexts = np.char.add(np.char.add(mutationColumns[:,2], '>'), mutationColumns[:,3])
+        strands = mutationColumns[:,4]
+
+        return chromosomes, positions, contexts, strands
+
+
+    # Reads the same columns as readMutations from the (memory-mapped) mutation store.
+    def readMutationStore(self):
+
+        mutationStore = MutationStore(self.mutationStorePath)
+        rowRange = (0, len(mutationStore)) if self.mutationRange is None else self.mutationRange
+
+        return (mutationStore.getChromosomes(rowRange), mutationStore.positions[rowRange[0]:rowRange[1]].astype(np.int64),
+                mutationStore.getContexts(rowRange), mutationStore.getStrands(rowRange))
+
+
+    # Determines which mutations the merge-walk would have read (and therefore counted).
+    # Reading stops with the first mutation past the last gene, so anything after that is never counted.
+    # (That first mutation is handled separately through firstUncountedMutation.)
+    def getCountedMutations(self, chromosomes: np.ndarray, positions: np.ndarray):
+
+        if self.geneIntervalIndex.lastChromosome is None: 
+            return np.zeros(len(positions), dtype = bool)
+        else:
+            return ((chromosomes < self.geneIntervalIndex.lastChromosome) | 
+                    ((chromosomes == self.geneIntervalIndex.lastChromosome) & 
+                     (positions <= self.geneIntervalIndex.lastChromosomeMaxEndPos)))
+
+
+    # Counts the first mutation past the last gene as intergenic, just like the merge-walk does.
+    def countFirstUncountedMutation(self):
+
+        if self.firstUncountedMutation is None: return
+
+        chromosome, context = self.firstUncountedMutation
+        if not chromosome in self.acceptableChromosomes:
+            raise ValueError(chromosome + " is not a valid chromosome for the mutation trinuc file.")
+        self.intergenicAndAmbiguousMutationCounts[context] = \
+            self.intergenicAndAmbiguousMutationCounts.setdefault(context,0) + 1
+
+
+    # Returns the path to the temporary file holding the mutation gene positions found in this counter's shard.
+    def getShardMutationGenePosFilePath(self):
+        return "{}.shard_{}_{}.tmp".format(self.mutationGenePosFilePath, *self.mutationRange)
+
+
+    # Opens the mutation gene positions file for writing, or the temporary file (without headers) for a shard.
+    def openMutationGenePosFile(self):
+
+        if self.mutationRange is None: return super().openMutationGenePosFile()
+        else: return open(self.getShardMutationGenePosFilePath(), 'w')
+
+
+    # Returns the counts from this counter in a form that can be passed between processes.
+    # (The mutation gene positions are given as the metagene histogram, if there is one, or the path to the
+    # shard's temporary mutation gene positions file otherwise.)
+    def getShardCounts(self):
+
+        if self.mutationGenePosFilePath is None: mutationGenePos = None
+        elif self.metageneHistogram is not None: mutationGenePos = self.metageneHistogram
+        else: mutationGenePos = self.getShardMutationGenePosFilePath()
+
+        return (self.transcribedRegionMutationCounts, self.nontranscribedRegionMutationCounts,
+                self.intergenicAndAmbiguousMutationCounts, mutationGenePos, self.firstUncountedMutation)
+
+
+    # Adds the counts from a shard of the mutation file (see getShardCounts) to this counter's counts.
+    # Shards must be added in the order they appear in the mutation file, and countFirstUncountedMutation
+    # should be called once all shards have been added.
+    def addShardCounts(self, shardCounts):
+
+        shardTSCounts, shardNTSCounts, shardIACounts, shardMutationGenePos, shardFirstUncountedMutation = shardCounts
+
+        for countsDict, shardCountsDict in ((self.transcribedRegionMutationCounts, shardTSCounts),
+                                            (self.nontranscribedRegionMutationCounts, shardNTSCounts),
+                                            (self.intergenicAndAmbiguousMutationCounts, shardIACounts)):
+            for context in shardCountsDict:
+                countsDict[context] = countsDict.setdefault(context, 0) + shardCountsDict[context]
+
         if self.mutationGenePosFilePath is not None:
+            if self.metageneHistogram is not None: self.metageneHistogram.addHistogram(shardMutationGenePos)
+            else:
+                if self.mutationGenePosFile is None: self.mutationGenePosFile = self.openMutationGenePosFile()
+                with open(shardMutationGenePos, 'r') as shardMutationGenePosFile:
+                    shutil.copyfileobj(shardMutationGenePosFile, self.mutationGenePosFile)
+                os.remove(shardMutationGenePos)
+        if self.firstUncountedMutation is None: self.firstUncountedMutation = shardFirstUncountedMutation
 
-            # Write the results to the output file.
-            with open(self.mutationGenePosFilePath,'w') as mutationGenePosFile:
 
-                # Write the headers to the file.
-                mutationGenePosFile.write('\t'.join(("Absolute_Position","Relative_Position")) + '\n')
+    # Assign all mutations to either the TS, NTS, or intergenic/ambiguous bins based on the gene interval index.
+    # (Further bins results by mutation context.)
+    def count(self):
+
+        with instrumentStage("IntervalIndexCountsFileGenerator.count", mutationFilePath = self.mutationFilePath,
+                             mutationStorePath = self.mutationStorePath, mutationRange = self.mutationRange) as stage:
+
+            if self.mutationGenePosFilePath is not None and self.metageneHistogram is None:
+                self.mutationGenePosFile = self.openMutationGenePosFile()
+            try: self.countWithIndex()
+            except BaseException:
+                # Don't leave a partial mutation gene positions file behind.
+                if self.mutationGenePosFile is not None:
+                    self.mutationGenePosFile.close()
+                    os.remove(self.mutationGenePosFile.name)
+                raise
+            if self.mutationGenePosFile is not None: self.mutationGenePosFile.close()
+
+            stage.addRecords(self.getCountedMutationTotal())
+
+
+    # The vectorized lookups for count.
+    def countWithIndex(self):
+
+        chromosomes, positions, contexts, strands = self.readMutations()
+        if self.mutationRange is None and (len(positions) == 0 or self.geneIntervalIndex.lastChromosome is None):
+            warnings.warn("Empty Mutation or Gene Positions file.  Output will most likely be unhelpful.")
+
+        counted = self.getCountedMutations(chromosomes, positions)
+        uncountedMutationIndices = np.flatnonzero(~counted)
+        if len(uncountedMutationIndices) > 0:
+            self.firstUncountedMutation = (str(chromosomes[uncountedMutationIndices[0]]), 
+                                           str(contexts[uncountedMutationIndices[0]]))
+        chromosomes, positions, contexts, strands = (chromosomes[counted], positions[counted], 
+                                                     contexts[counted], strands[counted])
+
+        # Make sure every mutation is in a valid chromosome.
+        invalidChromosomes = ~np.isin(chromosomes, self.acceptableChromosomes)
+        if np.any(invalidChromosomes):
+            raise ValueError(chromosomes[invalidChromosomes][0] + " is not a valid chromosome for the mutation trinuc file.")
+
+        # 0 for intergenic/ambiguous, 1 for TS, and 2 for NTS.
+        strandDesignations = np.zeros(len(positions), dtype = np.int8)
+
+        # Go through the chromosomes in mutation file order so that the mutation gene positions come out in that order
+        # as each chromosome is finished.  (The mutation file is sorted, so each chromosome's mutations are together.)
+        uniqueChromosomes, firstMutationIndices = np.unique(chromosomes, return_index = True)
+        for chromosome in uniqueChromosomes[np.argsort(firstMutationIndices)].tolist():
+
+            if chromosome not in self.geneIntervalIndex.startPositions: continue
+            chromosomeMutationIndices = np.flatnonzero(chromosomes == chromosome)
+            print("Counting in",chromosome)
+            chromosomePositions = positions[chromosomeMutationIndices]
+
+            # Mutations covered by genes on both strands are ambiguous.
+            strandAnnotations = self.geneIntervalIndex.getStrandAnnotations(chromosome, chromosomePositions)
+            chromosomeStrands = strands[chromosomeMutationIndices]
+            clearlyGenic = (strandAnnotations == TRANSCRIBED_PLUS) | (strandAnnotations == TRANSCRIBED_MINUS)
+            strandMatchesTS = np.where(strandAnnotations == TRANSCRIBED_PLUS, chromosomeStrands == '+', chromosomeStrands == '-')
+            strandDesignations[chromosomeMutationIndices[clearlyGenic & strandMatchesTS]] = 1
+            strandDesignations[chromosomeMutationIndices[clearlyGenic & ~strandMatchesTS]] = 2
+
+            if self.mutationGenePosFilePath is not None:
+                self.recordMutationGenePositions(chromosome, chromosomePositions,
+                                                 clearlyGenic | (strandAnnotations == AMBIGUOUS), strandMatchesTS)
+
+        # Tally up the results for each context.
+        uniqueContexts, contextIndices = np.unique(contexts, return_inverse = True)
+        for strandDesignation, countsDict in ((0, self.intergenicAndAmbiguousMutationCounts),
+                                              (1, self.transcribedRegionMutationCounts),
+                                              (2, self.nontranscribedRegionMutationCounts)):
+            contextCounts = np.bincount(contextIndices[strandDesignations == strandDesignation], 
+                                        minlength = len(uniqueContexts))
+            for context, contextCount in zip(uniqueContexts.tolist(), contextCounts.tolist()):
+                if strandDesignation == 0 or contextCount > 0: countsDict[context] = contextCount
+
+        # Shards leave this to whoever combines them.
+        if self.mutationRange is None: self.countFirstUncountedMutation()
+
+
+    # Determines the absolute and relative position of the given chromosome's genic mutations in the first gene
+    # containing them (See getMutationGenePos) and writes them to the mutation gene positions file.
+    # If there is a metagene histogram, the positions are binned into it instead (split by strandMatchesTS).
+    def recordMutationGenePositions(self, chromosome, chromosomePositions: np.ndarray, isGenic: np.ndarray,
+                                    strandMatchesTS: np.ndarray):
+
+        startPositions = self.geneIntervalIndex.startPositions[chromosome]
+        endPositions = self.geneIntervalIndex.endPositions[chromosome]
+
+        genicPositions = chromosomePositions[isGenic]
+        geneIndices = np.searchsorted(self.geneIntervalIndex.maxEndPositions[chromosome], genicPositions, side = "left")
+
+        # Mirror the merge-walk's requirement that there is no overlap between genes.
+        nextGeneIndices = geneIndices + 1
+        hasNextGene = nextGeneIndices < len(startPositions)
+        assert not np.any(startPositions[nextGeneIndices[hasNextGene]] <= genicPositions[hasNextGene]), (
+            "No gene overlap should exist while recording gene-relative mutation positions.")
+
+        absolutePositions = np.where(self.geneIntervalIndex.transcribedStrandIsPlus[chromosome][geneIndices],
+                                     genicPositions - startPositions[geneIndices] + 1,
+                                     endPositions[geneIndices] - genicPositions + 1)
+        geneLengths = endPositions[geneIndices] - startPositions[geneIndices] + 1
+
+        if self.metageneHistogram is not None:
+            self.metageneHistogram.addMutations(absolutePositions, geneLengths, strandMatchesTS[isGenic])
+        else:
+            for absolutePos, relativePos in zip(absolutePositions.tolist(), (geneLengths/absolutePositions).tolist()):
+                self.writeMutationGenePos(self.mutationGenePosFile, absolutePos, relativePos)
+
+
+    # Writes the mutation counts, and finishes off the mutation gene positions file for combined shards.
+    # (It still needs its headers if no shards were added.)
+    def writeResults(self):
+
+        super().writeResults()
+
+        if self.mutationGenePosFilePath is not None and self.metageneHistogram is None:
+            if self.mutationGenePosFile is None: self.mutationGenePosFile = self.openMutationGenePosFile()
+            self.mutationGenePosFile.close()
+
+
+# Splits the given (sorted) mutation file into byte ranges, one for each of the given chromosomes.
+# Chromosome boundaries are found by bisecting the file, so only a handful of lines are actually read.
+# (Any lines for chromosomes not in the given list end up in the range for the preceding chromosome, 
+# or in an extra range at the start of the file.)
+# Gzipped files can't be split this way, since finding a line in them means decompressing everything before it.
+def getChromosomeByteRanges(mutationFilePath, chromosomes):
+
+    if isGzipFile(mutationFilePath):
+        raise ValueError("Byte ranges can't be found in gzipped mutation files: " + mutationFilePath)
+
+    fileSize = os.path.getsize(mutationFilePath)
+
+    with open(mutationFilePath, 'rb') as mutationFile:
+
+        # Returns the offset of the first line starting at or after the given offset.
+        def getLineStart(offset):
+            if offset == 0: return 0
+            mutationFile.seek(offset - 1)
+            mutationFile.readline()
+            return mutationFile.tell()
+
+        # Returns the offset of the first line whose chromosome is not less than the given chromosome.
+        def findChromosomeStart(chromosome):
+            low, high = 0, fileSize
+            while low < high:
+                middle = (low + high) // 2
+                mutationFile.seek(getLineStart(middle))
+                line = mutationFile.readline()
+                if len(line) == 0 or line.split(None, 1)[0].decode() >= chromosome: high = middle
+                else: low = middle + 1
+            return getLineStart(low)
 
-                # Write the positions.
-                for pos in self.mutationGenePos:
-                    mutationGenePosFile.write('\t'.join((str(pos[0]), str(pos[1]))) + '\n')
+        boundaries = [0] + [findChromosomeStart(chromosome) for chromosome in sorted(chromosomes)] + [fileSize]
+
+    return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end]
+
+
+# Returns the ranges to split the given mutation file into for counting in shards, one for each of the given
+# chromosomes: rows of its mutation store if one is given, or byte ranges of the file itself otherwise.
+# Returns None if the file can't be split (a gzipped file without a mutation store), in which case it is counted whole.
+def getMutationShardRanges(mutationFilePath, mutationStorePath, chromosomes):
+
+    if mutationStorePath is not None: return MutationStore(mutationStorePath).getChromosomeRowRanges(chromosomes)
+    elif isGzipFile(mutationFilePath): return None
+    else: return getChromosomeByteRanges(mutationFilePath, chromosomes)
+
+
+# Counts the mutations in one range of a mutation file (or its mutation store) with the IntervalIndexCountsFileGenerator.
+# (Used to fan out shards of a mutation file to worker processes.)
+def countMutationFileShard(mutationFilePath, geneIntervalIndex: GeneIntervalIndex, acceptableChromosomes,
+                           mutationGenePosFilePath, mutationRange, mutationStorePath = None,
+                           metageneHistogram: MetageneHistogram = None):
+
+    counter = IntervalIndexCountsFileGenerator(mutationFilePath, geneIntervalIndex, None, acceptableChromosomes,
+                                               mutationGenePosFilePath, mutationRange, mutationStorePath,
+                                               metageneHistogram)
+    counter.count()
+    return counter.getShardCounts()
+
+
+# Counts the mutations in a whole mutation file and writes the results.  If a gene interval index is given, the 
+# IntervalIndexCountsFileGenerator is used (reading from the given mutation store, if any).  
+# Otherwise, the merge-walk in CountsFileGenerator is used (which can also write per-cohort counts).
+# If a metagene histogram is given, mutation gene positions are binned into it and written as a histogram.
+def countMutationFile(mutationFilePath, genePositionsFilePath, geneIntervalIndex: GeneIntervalIndex,
+                      transcribedRegionMutationCountsFilePath, acceptableChromosomes, mutationGenePosFilePath,
+                      mutationStorePath = None, cohortCountsFilePath = None, metageneHistogram: MetageneHistogram = None):
+
+    if geneIntervalIndex is not None:
+        if cohortCountsFilePath is not None: raise ValueError("Cohort counts can only be kept by the merge-walk.")
+        counter = IntervalIndexCountsFileGenerator(mutationFilePath, geneIntervalIndex,
+                                                   transcribedRegionMutationCountsFilePath, acceptableChromosomes,
+                                                   mutationGenePosFilePath, mutationStorePath = mutationStorePath,
+                                                   metageneHistogram = metageneHistogram)
+    else:
+        counter = CountsFileGenerator(mutationFilePath, genePositionsFilePath, 
+                                      transcribedRegionMutationCountsFilePath, acceptableChromosomes,
+                                      mutationGenePosFilePath, cohortCountsFilePath, metageneHistogram)
+    counter.count()
+    counter.writeResults()
+
+
+# Returns the path to the output file of the given data type (e.g. "transcriptional_asymmetry" counts) for the given
+# mutation file, named from its mutperiod metadata.  If a gene set name is given, it is added to the data type so that
+# counts in different sets of genes don't overwrite one another.
+def getCountsFilePath(mutationFilePath, dataType = "transcriptional_asymmetry", geneSetName = None):
+
+    # Only needed here, so that importing the counting classes doesn't pull in mutperiod.
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import Metadata, generateFilePath
+
+    metadata = Metadata(mutationFilePath)
+    if geneSetName is not None: dataType = geneSetName + '_' + dataType
+    return generateFilePath(directory = metadata.directory, dataGroup = metadata.dataGroupName,
+                            fileExtension = ".tsv", dataType = dataType)
+
+
+# Returns the path to the sorted copy kept alongside the given bed file ("<name>_sorted.bed").
+# (Sorted copies of gzipped files are plain text, so they lose the ".gz" extension.)
+def getSortedCopyFilePath(bedFilePath):
+    if bedFilePath.endswith(".gz"): bedFilePath = bedFilePath[:-3]
+    return "_sorted".join(os.path.splitext(bedFilePath))
+
+
+# Returns a path to a sorted version of the given bed file: the file itself if it is already sorted, or otherwise,
+# a sorted copy kept alongside it (see getSortedCopyFilePath).  The copy is only sorted again when the original file
+# is newer than it, so anything cached alongside the copy (e.g. the gene interval index or strand annotation bitmap)
+# is reused on later runs too.
+def getSortedInputFilePath(bedFilePath):
+
+    sortedBedFilePath = getSortedCopyFilePath(bedFilePath)
+    if os.path.exists(sortedBedFilePath) and os.path.getmtime(sortedBedFilePath) >= os.path.getmtime(bedFilePath):
+        return sortedBedFilePath
+
+    if isBedFileSorted(bedFilePath): return bedFilePath
+
+    # Sort into a temporary file first so that an interrupted sort never leaves a partial copy behind.
+    print("Sorting",os.path.basename(bedFilePath))
+    sortBedFile(bedFilePath, sortedBedFilePath + ".tmp")
+    os.replace(sortedBedFilePath + ".tmp", sortedBedFilePath)
+    return sortedBedFilePath
 
 
 # Main functionality starts here.
-def countInTranscribedRegions(mutationFilePaths, genePositionsFilePath: str, recordMutationGenePos, writeMutCounts):
+# If useIntervalIndex is True, the gene positions file is loaded once into a GeneIntervalIndex (cached next to
+# the gene positions file for later runs) and mutations are counted with the vectorized 
+# IntervalIndexCountsFileGenerator instead of the merge-walk.
+# If more than one worker is requested, mutation files are counted in parallel in a pool of processes.  With the 
+# interval index, each mutation file is further split into per-chromosome shards whose counts are merged before writing.
+# If useMutationStore is True, each mutation file is converted to a memory-mappable mutation store (kept alongside
+# the mutation file and only rebuilt when the file changes) which the interval index counting reads from instead.
+# If useStrandAnnotationBitmap is True, the interval index counting looks up each mutation's strand annotation directly
+# in a per-base bitmap (kept alongside the gene positions file and shared with the perl scripts).
+# If sortInputs is True, each input file is checked to make sure it is sorted, and any that aren't are sorted 
+# (in memory if they are small enough, or with a chunked external sort otherwise) into "_sorted" copies alongside them,
+# which are counted instead and reused on later runs.
+# If countByCohort is True, the merge-walk also counts mutations separately for each cohort (e.g. genotype) given in the
+# 7th column of the mutation file, and writes the counts for every cohort to a single "cohort_transcriptional_asymmetry"
+# table, all in the same pass.
+# If metageneBins is given along with recordMutationGenePos, mutation gene positions are binned into a small
+# "metagene_histogram" table of TS and NTS counts instead of being written one line per mutation.  metageneBins is a
+# tuple of (absolute bin width, absolute bin count, relative bin count), where either the absolute or relative bins
+# may be None.  (See MetageneHistogram.)
+def countInTranscribedRegions(mutationFilePaths, genePositionsFilePath: str, recordMutationGenePos, writeMutCounts,
+                              useIntervalIndex = False, workers = 1, useMutationStore = False,
+                              useStrandAnnotationBitmap = False, sortInputs = False, countByCohort = False,
+                              metageneBins = None):
+
+    # Only needed here, so that importing the counting classes doesn't pull in mutperiod.
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import DataTypeStr, getContext
 
     transcribedRegionMutationCountsFilePaths = list() # A list of paths to the output files generated by the function
 
-    if not recordMutationGenePos and not writeMutCounts:
+    if not recordMutationGenePos and not writeMutCounts and not countByCohort:
         warnings.warn("Nothing will be written... But here we go anyway!")
 
+    if useMutationStore and not useIntervalIndex:
+        raise ValueError("Mutation stores can only be read with interval index counting.")
+    if useStrandAnnotationBitmap and not useIntervalIndex:
+        raise ValueError("The strand annotation bitmap can only be used with interval index counting.")
+    if countByCohort and useIntervalIndex:
+        raise ValueError("Cohort counts can only be kept by the merge-walk, not interval index counting.")
+    if metageneBins is not None and not recordMutationGenePos:
+        raise ValueError("Metagene bins are only used when recording mutation gene positions.")
+    if metageneBins is not None: MetageneHistogram(*metageneBins) # Check the bins before any counting starts.
+
+    # Check the original gene positions file's name, since a sorted copy's name ends in "_sorted.bed" instead.
+    if recordMutationGenePos:
+        assert genePositionsFilePath.endswith("clear_gene_ranges.bed"), "Expected gene positioning file without overlap (\"...clear_gene_ranges.bed\")"
+
+    if sortInputs: genePositionsFilePath = getSortedInputFilePath(genePositionsFilePath)
+
+    if useIntervalIndex: geneIntervalIndex = GeneIntervalIndex(genePositionsFilePath, 
+                                                               useStrandAnnotationBitmap = useStrandAnnotationBitmap)
+    else: geneIntervalIndex = None
+
+    # Get the list of acceptable chromosomes
+    acceptableChromosomes = ACCEPTABLE_CHROMOSOMES
+
+    # The arguments to countMutationFile for each mutation file.
+    countingJobs = list()
+
     # Loop through each given mutation file path, creating a corresponding transcribed region mutation count file for each.
     for mutationFilePath in mutationFilePaths:
 
@@ -308,47 +962,146 @@ def countInTranscribedRegions(mutationFilePaths, genePositionsFilePath: str, rec
         
         assert getContext(mutationFilePath, True) == 3, ("Expected trinucleotide context mutation file." +
                                                          "Code needs to be modified to accept other formats.")
-            
-        # Get the list of acceptable chromosomes
-        acceptableChromosomes = ("chrI","chrII","chrIII","chrIV","chrV","chrX")
-        
-        # Get metadata and use it to generate a path to the nucleosome positions file.
-        metadata = Metadata(mutationFilePath)
 
         # Generate the output file path for mutation counts.
         if writeMutCounts:
-            transcribedRegionMutationCountsFilePath = generateFilePath(directory = metadata.directory,
-                                                                    dataGroup = metadata.dataGroupName, 
-                                                                    fileExtension = ".tsv", dataType = "transcriptional_asymmetry")
+            transcribedRegionMutationCountsFilePath = getCountsFilePath(mutationFilePath)
             transcribedRegionMutationCountsFilePaths.append(transcribedRegionMutationCountsFilePath)
         else: transcribedRegionMutationCountsFilePath = None
 
-        # If requested, generate the output file path for mutation positions relative to genes.
+        # If requested, generate the output file path for mutation positions relative to genes (or their histogram).
         if recordMutationGenePos:
-            assert genePositionsFilePath.endswith("clear_gene_ranges.bed"), "Expected gene positioning file without overlap (\"...clear_gene_ranges.bed\")"
-            mutationGenePosFilePath = generateFilePath(directory = metadata.directory,
-                                                       dataGroup = metadata.dataGroupName, 
-                                                       fileExtension = ".tsv", dataType = "mutation_gene_pos")
+            mutationGenePosFilePath = getCountsFilePath(mutationFilePath, "mutation_gene_pos" if metageneBins is None
+                                                                          else "metagene_histogram")
         else: mutationGenePosFilePath = None
 
+        if recordMutationGenePos and metageneBins is not None: metageneHistogram = MetageneHistogram(*metageneBins)
+        else: metageneHistogram = None
+
+        # If requested, generate the output file path for the per-cohort mutation counts.
+        if countByCohort:
+            cohortCountsFilePath = getCountsFilePath(mutationFilePath, "cohort_transcriptional_asymmetry")
+            transcribedRegionMutationCountsFilePaths.append(cohortCountsFilePath)
+        else: cohortCountsFilePath = None
+
+        # If requested, make sure the mutation file is sorted.
+        if sortInputs: countedMutationFilePath = getSortedInputFilePath(mutationFilePath)
+        else: countedMutationFilePath = mutationFilePath
+
+        # If requested, make sure the mutation store is ready before any counting starts.
+        if useMutationStore: mutationStorePath = updateMutationStore(countedMutationFilePath)
+        else: mutationStorePath = None
+
+        countingJobs.append((countedMutationFilePath, genePositionsFilePath, geneIntervalIndex,
+                             transcribedRegionMutationCountsFilePath, acceptableChromosomes, mutationGenePosFilePath,
+                             mutationStorePath, cohortCountsFilePath, metageneHistogram))
+
         # Ready, set, go!
-        counter = CountsFileGenerator(mutationFilePath, genePositionsFilePath, 
-                                      transcribedRegionMutationCountsFilePath, acceptableChromosomes,
-                                      mutationGenePosFilePath)
-        counter.count()
-        counter.writeResults()
+        if workers == 1: countMutationFile(*countingJobs[-1])
+
+    if workers > 1:
+
+        print("\nCounting",len(countingJobs),"mutation file(s) with",workers,"workers")
+
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+
+            # Without the interval index, only whole files can be counted in parallel.
+            if not useIntervalIndex:
+                for future in [executor.submit(countMutationFile, *countingJob) for countingJob in countingJobs]:
+                    future.result()
+
+            # Otherwise, submit every shard of every file up front, then combine the shards' counts for each file in order.
+            # (Files which can't be split into shards are counted whole.)
+            else:
+
+                shardRangesByJob = [getMutationShardRanges(countingJob[0], countingJob[6], acceptableChromosomes)
+                                    for countingJob in countingJobs]
+                wholeFileFutures = [executor.submit(countMutationFile, *countingJob)
+                                    for countingJob, shardRanges in zip(countingJobs, shardRangesByJob)
+                                    if shardRanges is None]
+                shardFuturesByJob = [None if shardRanges is None else
+                                     [executor.submit(countMutationFileShard, mutationFilePath, geneIntervalIndex,
+                                                      acceptableChromosomes, mutationGenePosFilePath, mutationRange,
+                                                      mutationStorePath, metageneHistogram)
+                                      for mutationRange in shardRanges]
+                                     for (mutationFilePath, _, _, _, _, mutationGenePosFilePath, 
+                                          mutationStorePath, _, metageneHistogram), shardRanges
+                                     in zip(countingJobs, shardRangesByJob)]
+
+                for future in wholeFileFutures: future.result()
+                for (mutationFilePath, _, _, transcribedRegionMutationCountsFilePath, _, mutationGenePosFilePath,
+                     mutationStorePath, _, metageneHistogram), shardFutures in zip(countingJobs, shardFuturesByJob):
+                    if shardFutures is None: continue
+                    counter = IntervalIndexCountsFileGenerator(mutationFilePath, geneIntervalIndex,
+                                                               transcribedRegionMutationCountsFilePath, acceptableChromosomes,
+                                                               mutationGenePosFilePath, mutationStorePath = mutationStorePath,
+                                                               metageneHistogram = metageneHistogram)
+                    for shardFuture in shardFutures: counter.addShardCounts(shardFuture.result())
+                    counter.countFirstUncountedMutation()
+                    counter.writeResults()
 
     return transcribedRegionMutationCountsFilePaths
 
 
+# Runs countInTranscribedRegions non-interactively with the given command line arguments.
+def runFromCommandLine(arguments):
+
+    parser = argparse.ArgumentParser(description = "Count mutations on the transcribed and non-transcribed strands of genes.")
+    parser.add_argument("mutationFilePaths", nargs = '+', metavar = "mutation_file",
+                        help = "Trinucleotide context mutation bed files")
+    parser.add_argument("-g", "--gene-positions", required = True, dest = "genePositionsFilePath",
+                        metavar = "FILE", help = "Gene positions bed file")
+    parser.add_argument("--record-mutation-gene-pos", action = "store_true",
+                        help = "Record mutation positions relative to gene boundaries")
+    parser.add_argument("--no-mutation-counts", action = "store_true", help = "Don't write mutation counts")
+    parser.add_argument("--interval-index", action = "store_true", help = "Use vectorized interval index counting")
+    parser.add_argument("--workers", type = int, default = 1, help = "Number of worker processes (default: 1)")
+    parser.add_argument("--mutation-store", action = "store_true",
+                        help = "Read mutations through a memory-mapped mutation store")
+    parser.add_argument("--strand-annotation-bitmap", action = "store_true",
+                        help = "Look up strand annotations in a per-base bitmap")
+    parser.add_argument("--sort-inputs", action = "store_true", help = "Sort input files if they are not already sorted")
+    parser.add_argument("--count-by-cohort", action = "store_true",
+                        help = "Also count mutations for each cohort (7th column) in one table (merge-walk only)")
+    parser.add_argument("--absolute-metagene-bins", nargs = 2, type = int, metavar = ("WIDTH", "COUNT"),
+                        help = "Bin mutation gene positions into COUNT bins of WIDTH bases (plus an overflow bin) "
+                               "instead of recording each one (implies --record-mutation-gene-pos)")
+    parser.add_argument("--relative-metagene-bins", type = int, metavar = "COUNT",
+                        help = "Bin mutation gene positions into COUNT equal parts of each gene "
+                               "instead of recording each one (implies --record-mutation-gene-pos)")
+    args = parser.parse_args(arguments)
+
+    if args.absolute_metagene_bins is None and args.relative_metagene_bins is None: metageneBins = None
+    else: metageneBins = (*(args.absolute_metagene_bins or (None, None)), args.relative_metagene_bins)
+
+    countInTranscribedRegions(args.mutationFilePaths, args.genePositionsFilePath,
+                              args.record_mutation_gene_pos or metageneBins is not None,
+                              not args.no_mutation_counts, args.interval_index, workers = args.workers,
+                              useMutationStore = args.mutation_store,
+                              useStrandAnnotationBitmap = args.strand_annotation_bitmap, sortInputs = args.sort_inputs,
+                              countByCohort = args.count_by_cohort, metageneBins = metageneBins)
+
+
 def main():
 
+    # Given any command line arguments, run without the UI.
+    if len(sys.argv) > 1: return runFromCommandLine(sys.argv[1:])
+
+    # The UI modules are only imported when they're actually used.
+    from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog, Selections
+    from mutperiodpy.helper_scripts.UsefulFileSystemFunctions import getDataDirectory, DataTypeStr
+
     #Create the Tkinter UI
     dialog = TkinterDialog(workingDirectory=getDataDirectory())
     dialog.createMultipleFileSelector("Mutation Files:",0,DataTypeStr.mutations + ".bed",("Bed Files",".bed"))
     dialog.createFileSelector("Gene Position File:", 1, ("Bed Files",".bed"))
     dialog.createCheckbox("Record mutation positions relative to gene boundaries", 2, 0)
     dialog.createCheckbox("Don't write mutation counts", 3, 0)
+    dialog.createCheckbox("Use vectorized interval index counting", 4, 0)
+    dialog.createCheckbox("Read mutations through a memory-mapped mutation store", 5, 0)
+    dialog.createCheckbox("Look up strand annotations in a per-base bitmap", 6, 0)
+    dialog.createCheckbox("Sort input files if they are not already sorted", 7, 0)
+    dialog.createCheckbox("Also count mutations for each cohort (merge-walk only)", 8, 0)
 
     # Run the UI
     dialog.mainloop()
@@ -362,7 +1115,15 @@ def main():
     genePositionsFilePath = selections.getIndividualFilePaths()[0] # The gene positions file path
     recordMutationGenePos = selections.getToggleStates()[0]
     writeMutCounts = not selections.getToggleStates()[1]
-
-    countInTranscribedRegions(mutationFilePaths, genePositionsFilePath, recordMutationGenePos, writeMutCounts)
+    useIntervalIndex = selections.getToggleStates()[2]
+    useMutationStore = selections.getToggleStates()[3]
+    useStrandAnnotationBitmap = selections.getToggleStates()[4]
+    sortInputs = selections.getToggleStates()[5]
+    countByCohort = selections.getToggleStates()[6]
+
+    countInTranscribedRegions(mutationFilePaths, genePositionsFilePath, recordMutationGenePos, writeMutCounts,
+                              useIntervalIndex, useMutationStore = useMutationStore,
+                              useStrandAnnotationBitmap = useStrandAnnotationBitmap, sortInputs = sortInputs,
+                              countByCohort = countByCohort)
 
 if __name__ == "__main__": main()
\ No newline at end of file
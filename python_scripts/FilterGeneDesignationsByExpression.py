@@ -1,5 +1,31 @@
-import os
-from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
+import os, sys, argparse
+from contextlib import ExitStack
+from typing import Iterable, List, Dict
+from StageInstrumentation import instrumentStage
+from ParseGeneDesignations import readIndexedGeneDesignationLines, OTHER_NAME_COLUMN
+
+
+# Returns the path to the filtered gene designations file produced from the given filtered genes file.
+def getFilteredGeneDesignationsFilePath(filteredGenesFilePath):
+    dataDirectory = os.path.dirname(filteredGenesFilePath)
+    baseFilteredFileName = os.path.basename(filteredGenesFilePath).rsplit("s.tsv",1)[0]
+    return os.path.join(dataDirectory, baseFilteredFileName+"_designations.bed")
+
+
+# Returns a hash of the gene names in the given lines from a filtered genes file.
+def getFilteredGenes(filteredGenesLines: Iterable[str]):
+
+    filteredGenes = dict()
+    for line in filteredGenesLines:
+        # NOTE: The double underscore string is used to separate the multiple acceptable names for a single gene.
+        for gene in line.strip().split('\t')[0].split('__'): filteredGenes[gene] = None
+    return filteredGenes
+
+
+# Yields the lines from the given gene designations whose genes are in the given filtered genes.
+def filterGeneDesignationLines(filteredGenes, geneDesignationLines: Iterable[str]):
+    for line in geneDesignationLines:
+        if line.strip().split('\t')[4] in filteredGenes: yield line
 
 
 # Combines data from the filtered genes file path and the unfiltered gene designations file path to 
@@ -12,32 +38,104 @@ def filterGeneDesignationsByExpression(filteredGenesFilePath: str, unfilteredGen
     assert filteredGenesFilePath.endswith("_highly_expressed_genes.tsv"), "Unexpected file ending"
 
     # Get the relevant paths for the input and output files.
-    dataDirectory = os.path.dirname(filteredGenesFilePath)
-    baseFilteredFileName = os.path.basename(filteredGenesFilePath).rsplit("s.tsv",1)[0]
-    filteredGeneDesignationsFilePath = os.path.join(dataDirectory, baseFilteredFileName+"_designations.bed")
+    filteredGeneDesignationsFilePath = getFilteredGeneDesignationsFilePath(filteredGenesFilePath)
 
     # Get a hash of the highly expressed genes
-    filteredGenes = dict()
-    with open(filteredGenesFilePath, 'r') as filteredGenesFile:
-        
-        for line in filteredGenesFile:
-            # NOTE: The double underscore string is used to separate the multiple acceptable names for a single gene.
-            for gene in line.strip().split('\t')[0].split('__'): filteredGenes[gene] = None
+    with open(filteredGenesFilePath, 'r') as filteredGenesFile: filteredGenes = getFilteredGenes(filteredGenesFile)
+
+    # If the gene designations have an up to date gene name index (from ParseGeneDesignations),
+    # read just the filtered genes' lines.
+    indexedGeneDesignationLines = readIndexedGeneDesignationLines(unfilteredGeneDesignationsFilePath, filteredGenes,
+                                                                  OTHER_NAME_COLUMN)
+    if indexedGeneDesignationLines is not None:
+        with open(filteredGeneDesignationsFilePath, 'w') as filteredGeneDesignationsFile:
+            filteredGeneDesignationsFile.writelines(indexedGeneDesignationLines)
+        return
 
-    # Filter the original gene designations file to only include data from the filtered genes.
+    # Otherwise, filter the original gene designations file to only include data from the filtered genes.
     with open(unfilteredGeneDesignationsFilePath, 'r') as unfilteredGeneDesignationsFile:
         with open(filteredGeneDesignationsFilePath, 'w') as filteredGeneDesignationsFile:
+            filteredGeneDesignationsFile.writelines(filterGeneDesignationLines(filteredGenes, unfilteredGeneDesignationsFile))
+
 
-            for line in unfilteredGeneDesignationsFile:
-                if line.strip().split('\t')[4] in filteredGenes:
-                    filteredGeneDesignationsFile.write(line)
+# Returns a dictionary mapping every gene name in the given filtered genes files to a bitmask of the files it is in
+# (bit i is set for the ith file).
+def getFilteredGeneBitmasks(filteredGenesFilePaths: List[str]) -> Dict[str,int]:
+
+    filteredGeneBitmasks: Dict[str,int] = dict()
+    for i, filteredGenesFilePath in enumerate(filteredGenesFilePaths):
+        with open(filteredGenesFilePath, 'r') as filteredGenesFile:
+            for gene in getFilteredGenes(filteredGenesFile):
+                filteredGeneBitmasks[gene] = filteredGeneBitmasks.get(gene, 0) | (1 << i)
+    return filteredGeneBitmasks
+
+
+# Filters the unfiltered gene designations for every one of the given filtered genes files with a single scan of the
+# designations.  Every output file is opened up front, and each designation line is written straight to the output
+# for every file in its gene's bitmask, so memory use doesn't grow with the number of files or matching lines.
+# The output files are identical to those from calling filterGeneDesignationsByExpression on each file.
+def filterGeneDesignationsByExpressionInBatch(filteredGenesFilePaths: List[str], unfilteredGeneDesignationsFilePath: str):
+
+    filteredGenesFilePaths = list(dict.fromkeys(filteredGenesFilePaths))
+    print("Working with",len(filteredGenesFilePaths),"filtered genes files and",
+          os.path.basename(unfilteredGeneDesignationsFilePath))
+
+    for filteredGenesFilePath in filteredGenesFilePaths:
+        assert filteredGenesFilePath.endswith("_highly_expressed_genes.tsv"), "Unexpected file ending"
+
+    with instrumentStage("filterGeneDesignationsByExpressionInBatch", filteredGenesFileCount = len(filteredGenesFilePaths),
+                         geneDesignationsFilePath = unfilteredGeneDesignationsFilePath) as stage:
+
+        filteredGeneBitmasks = getFilteredGeneBitmasks(filteredGenesFilePaths)
+
+        with ExitStack() as exitStack:
+
+            filteredGeneDesignationsFiles = [exitStack.enter_context(
+                open(getFilteredGeneDesignationsFilePath(filteredGenesFilePath), 'w'))
+                for filteredGenesFilePath in filteredGenesFilePaths]
+
+            # Scan the unfiltered designations once (or just the lines for any of the filtered genes, if they have an
+            # up to date gene name index), writing each line to the output for every set bit in its gene's bitmask.
+            unfilteredGeneDesignationsFile = exitStack.enter_context(open(unfilteredGeneDesignationsFilePath, 'r'))
+            geneDesignationLines = readIndexedGeneDesignationLines(unfilteredGeneDesignationsFilePath, filteredGeneBitmasks,
+                                                                   OTHER_NAME_COLUMN)
+            if geneDesignationLines is None: geneDesignationLines = unfilteredGeneDesignationsFile
+            for line in geneDesignationLines:
+                stage.addRecords(1)
+                bitmask = filteredGeneBitmasks.get(line.strip().split('\t')[4], 0)
+                while bitmask:
+                    lowestBit = bitmask & -bitmask
+                    filteredGeneDesignationsFiles[lowestBit.bit_length() - 1].write(line)
+                    bitmask ^= lowestBit
+
+
+# Runs filterGeneDesignationsByExpression non-interactively with the given command line arguments.
+def runFromCommandLine(arguments):
+
+    parser = argparse.ArgumentParser(description = "Filter gene designations down to the genes in filtered genes files.")
+    parser.add_argument("filteredGenesFilePaths", nargs = '+', metavar = "filtered_genes_file",
+                        help = "Filtered genes files (ending in _highly_expressed_genes.tsv).  "
+                               "More than one file is filtered in a single scan of the gene designations.")
+    parser.add_argument("unfilteredGeneDesignationsFilePath", metavar = "gene_designations_file",
+                        help = "Unfiltered gene designations bed file")
+    args = parser.parse_args(arguments)
+
+    if len(args.filteredGenesFilePaths) > 1:
+        filterGeneDesignationsByExpressionInBatch(args.filteredGenesFilePaths, args.unfilteredGeneDesignationsFilePath)
+    else: filterGeneDesignationsByExpression(args.filteredGenesFilePaths[0], args.unfilteredGeneDesignationsFilePath)
 
 
 def main():
 
+    # Given any command line arguments, run without the UI.
+    if len(sys.argv) > 1: return runFromCommandLine(sys.argv[1:])
+
+    from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
+
     # Create a simple dialog for selecting the filtered and unfiltered gene files.
     dialog = TkinterDialog(workingDirectory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
-    dialog.createFileSelector("Filtered Genes File", 0, ("Tab Separated Values File", ".tsv"))
+    dialog.createMultipleFileSelector("Filtered Genes Files", 0, "highly_expressed_genes.tsv",
+                                      ("Tab Separated Values File", ".tsv"))
     dialog.createFileSelector("Unfiltered Gene Designations File", 1, ("Bed File", ".bed"))
 
     dialog.mainloop()
@@ -45,8 +143,8 @@ def main():
     if dialog.selections is None: quit()
 
     # Retrieve the selections and pass the relevant arguments to the primary function.
-    filterGeneDesignationsByExpression(dialog.selections.getIndividualFilePaths()[0], 
-                                       dialog.selections.getIndividualFilePaths()[1])
+    filterGeneDesignationsByExpressionInBatch(dialog.selections.getFilePathGroups()[0],
+                                              dialog.selections.getIndividualFilePaths()[0])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -1,91 +1,342 @@
-import os, subprocess
-from typing import List, Dict
-from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
+import os, sys, argparse, subprocess
+from typing import List, Dict, Tuple
+import numpy as np
+from StageInstrumentation import instrumentStage
 
-# Given a file of RPKM/FPKM values, pull out the most highly expressed genes based on a given percent cutoff value.
-# Filtering may be specified to only use data from a specific tissue/cell type.
-def findHighlyExpressedGenes(geneExpressionFilePath, tissueFiltering: str, percentCutoff = 25):
+TISSUE_FILTERING_OPTIONS = ("Any","Sperm Only", "Oocyte Only", "Germ Line Only", "Any Germ Line Association")
 
-    print("Filtering in",os.path.basename(geneExpressionFilePath),"with a",percentCutoff,"percent cutoff.")
-    print("Tissue filtering is set to:",tissueFiltering)
-    print()
+# Returns the paths to the average expression file and the highly expressed genes file
+# for the given gene expression file and tissue filtering.  If a percent cutoff is given, it is included in the
+# highly expressed genes file name (e.g. "..._top_10_percent_highly_expressed_genes.tsv"), so that sweeps over
+# several cutoffs don't overwrite each other.
+def getHighlyExpressedGenesFilePaths(geneExpressionFilePath, tissueFiltering: str, percentCutoff = None):
 
-    # Get the relevant paths for the input and output files.
     dataDirectory = os.path.dirname(geneExpressionFilePath)
     geneExpressionFileName = os.path.basename(geneExpressionFilePath).rsplit('_gene_expression.txt',1)[0]
     if tissueFiltering != "Any": geneExpressionFileName += '_' + tissueFiltering.lower().replace(' ', '_')
     averageGeneExpressionFilePath = os.path.join(dataDirectory, geneExpressionFileName + "_average_FPKM.tsv")
+    if percentCutoff is not None: geneExpressionFileName += "_top_{:g}_percent".format(percentCutoff)
     filteredGenesFilePath = os.path.join(dataDirectory, geneExpressionFileName + "_highly_expressed_genes.tsv")
+    return averageGeneExpressionFilePath, filteredGenesFilePath
+
+
+# Returns whether or not a data set from the given tissue/cell type should be used with the given tissue filtering.
+def passesTissueFiltering(tissue: str, tissueFiltering: str):
+
+    tissue = tissue.upper()
+    if tissueFiltering == "Sperm Only": return "SPERM" in tissue
+    elif tissueFiltering == "Oocyte Only": return "OOCYTE" in tissue
+    elif tissueFiltering == "Germ Line Only": return "GERM LINE" in tissue
+    elif tissueFiltering == "Any Germ Line Association":
+        return "SPERM" in tissue or "OOCYTE" in tissue or "GERMLINE" in tissue
+    else:
+        assert tissueFiltering == "Any", "Unrecognized tissue filtering option: " + tissueFiltering
+        return True
+
+
+# Returns the gene names from the given line of column names in a gene expression file.
+# (The gene names are given in parentheses after the first 7 columns.)
+def parseGeneExpressionColumnNames(columnNamesLine: str) -> List[str]:
+    return [geneColumnName.split('(',1)[1].rsplit(')',1)[0].replace(", ", "__")
+            for geneColumnName in columnNamesLine.strip().split('\t')[7:]]
+
+
+# Reads the given gene expression file and returns every gene paired with its average RPKM/FPKM value
+# (as a string, or '0' if it has no values) across the data sets that pass the tissue filtering, in file order.
+def getAverageGeneExpression(geneExpressionFilePath, tissueFiltering: str) -> List[Tuple[str,str]]:
 
     with open(geneExpressionFilePath, 'r') as geneExpressionFile:
-        with open(averageGeneExpressionFilePath, 'w') as averageGeneExpressionFile:
 
-            genes = list() # An ordered list of the genes 
-            rawRPKM: Dict[str,List] = dict() # A dictionary containing the list of RPKM values for each gene.
+        genes = list() # An ordered list of the genes 
+        rawRPKM: Dict[str,List] = dict() # A dictionary containing the list of RPKM values for each gene.
+
+        # Skip the header.
+        geneExpressionFile.readline()
+
+        # Populate the ordered list of gene names and create lists in rawRPKM.
+        for gene in parseGeneExpressionColumnNames(geneExpressionFile.readline()):
+            genes.append(gene)
+            rawRPKM[gene] = list()
+
+        # Populate the dictionary of raw RPKM values if the data set meets the conditions.
+
+        for line in geneExpressionFile:
+
+            choppedUpLine = line.strip().split('\t')
+
+            # Filter as necessary.
+            if not passesTissueFiltering(choppedUpLine[4], tissueFiltering): continue
+
+            for i,RPKMValue in enumerate(choppedUpLine[7:]):
+                #print("Gene:",genes[i])
+                if RPKMValue == '' or RPKMValue == "N.A.": continue
+                rawRPKM[genes[i]].append(float(RPKMValue))
+
+    # Average the values.
+    averageGeneExpression = list()
+    for gene in genes:
+        if len(rawRPKM[gene]) == 0: averageRPKM = '0'
+        else: averageRPKM = str(sum(rawRPKM[gene])/len(rawRPKM[gene]))
+        averageGeneExpression.append((gene, averageRPKM))
+
+    return averageGeneExpression
+
+
+# Sorts the given genes and average values in descending order of value, in the same order as "sort -k2,2gr" on the
+# average expression file.  (Ties are broken by the whole line, ascending, as sort does in the C locale.)
+def rankAverageGeneExpression(averageGeneExpression: List[Tuple[str,str]]) -> List[Tuple[str,str]]:
+    return sorted(averageGeneExpression, key = lambda geneAndAverage: (-float(geneAndAverage[1]),
+                                                                       geneAndAverage[0] + '\t' + geneAndAverage[1]))
+
+
+# Returns the number of genes that make up the given percent cutoff.
+def getGeneCountCutoff(geneCount, percentCutoff):
+    return int(geneCount*percentCutoff/100)
+
+
+# Reads the given gene expression file into a masked 2D array of RPKM/FPKM values with a row for each data set and
+# a column for each gene.  Blank and "N.A." values are masked.  If tissueFilterings are given, data sets which don't pass
+# any of them are skipped without being parsed.
+# Returns the gene names, the tissue/cell type of each data set (row), and the array.
+def loadGeneExpressionMatrix(geneExpressionFilePath, tissueFilterings: List[str] = None
+                             ) -> Tuple[List[str], List[str], np.ma.MaskedArray]:
+
+    with open(geneExpressionFilePath, 'r') as geneExpressionFile:
+
+        # Skip the header.
+        geneExpressionFile.readline()
+        genes = parseGeneExpressionColumnNames(geneExpressionFile.readline())
+
+        tissues = list()
+        rows = list()
+        rowMasks = list()
+        for line in geneExpressionFile:
+
+            choppedUpLine = line.strip().split('\t')
+            if tissueFilterings is not None and not any(passesTissueFiltering(choppedUpLine[4], tissueFiltering)
+                                                        for tissueFiltering in tissueFilterings): continue
+            tissues.append(choppedUpLine[4])
+
+            # Rows may be missing trailing blank values, since the line is stripped.
+            RPKMValues = choppedUpLine[7:]
+            if len(RPKMValues) > len(genes):
+                raise ValueError("Data set " + choppedUpLine[0] + " has more values than there are genes.")
+            RPKMValues = np.array(RPKMValues + ['']*(len(genes) - len(RPKMValues)), dtype = object)
+
+            # Convert one row at a time so that only the floats for the whole table are held in memory.
+            # (Converting from objects uses Python's float parsing, which is faster than NumPy's string conversion.)
+            missingValues = (RPKMValues == '') | (RPKMValues == "N.A.")
+            RPKMValues[missingValues] = 0.0
+            rows.append(RPKMValues.astype(np.float64))
+            rowMasks.append(missingValues.astype(bool))
+
+    if len(rows) == 0: rows, rowMasks = [np.zeros((0, len(genes)))], [np.zeros((0, len(genes)), dtype = bool)]
+    return genes, tissues, np.ma.MaskedArray(np.vstack(rows), mask = np.vstack(rowMasks))
+
+
+# Returns a boolean mask of the data sets (rows) that pass the given tissue filtering.
+def getTissueFilteringMask(tissues: List[str], tissueFiltering: str):
+    return np.fromiter((passesTissueFiltering(tissue, tissueFiltering) for tissue in tissues),
+                       dtype = bool, count = len(tissues))
+
+
+# Returns the average value of each gene (column) across the data sets (rows) selected by each of the given masks,
+# along with the number of values averaged for each gene, as arrays with a row for each mask.
+# NOTE: Summing down the columns of a C-ordered array adds the rows in order, so the averages are identical to those
+# from getAverageGeneExpression.  (A matrix product with the masks would not guarantee this.)
+def getGroupedGeneExpressionMeans(expressionMatrix: np.ma.MaskedArray, rowMasks):
+
+    rowMasks = np.asarray(rowMasks, dtype = bool).reshape(-1, expressionMatrix.shape[0])
+    totals = np.zeros((len(rowMasks), expressionMatrix.shape[1]), dtype = np.float64)
+    valueCounts = np.zeros(totals.shape, dtype = np.int64)
 
-            # Skip the header.
-            geneExpressionFile.readline()
+    for maskIndex, rowMask in enumerate(rowMasks):
+        maskedRows = expressionMatrix[rowMask]
+        totals[maskIndex] = np.ascontiguousarray(maskedRows.filled(0.0)).sum(axis = 0)
+        valueCounts[maskIndex] = maskedRows.count(axis = 0)
 
-            # Populate the ordered list of gene names and create lists in rawRPKM.
-            for gene in geneExpressionFile.readline().strip().split('\t')[7:]:
-                gene = gene.split('(',1)[1].rsplit(')',1)[0]
-                gene = gene.replace(", ", "__")
-                genes.append(gene)
-                rawRPKM[gene] = list()
+    means = np.zeros_like(totals)
+    np.divide(totals, valueCounts, out = means, where = valueCounts > 0)
+    return means, valueCounts
 
-            # Populate the dictionary of raw RPKM values if the data set meets the conditions.
 
-            for line in geneExpressionFile:
+# Returns the average value of each gene (column) across the data sets (rows) selected by the given mask, along with
+# the number of values averaged for each gene.  (See getGroupedGeneExpressionMeans.)
+def getMaskedGeneExpressionMeans(expressionMatrix: np.ma.MaskedArray, rowMask):
+    means, valueCounts = getGroupedGeneExpressionMeans(expressionMatrix, [rowMask])
+    return means[0], valueCounts[0]
 
-                choppedUpLine = line.strip().split('\t')
 
-                # Filter as necessary.
-                if tissueFiltering == "Sperm Only":
-                    if not "SPERM" in choppedUpLine[4].upper(): continue
-                elif tissueFiltering == "Oocyte Only":
-                    if not "OOCYTE" in choppedUpLine[4].upper(): continue
-                elif tissueFiltering == "Germ Line Only":
-                    if not "GERM LINE" in choppedUpLine[4].upper(): continue
-                elif tissueFiltering == "Any Germ Line Association":
-                    if not ("SPERM" in choppedUpLine[4].upper() or "OOCYTE" in choppedUpLine[4].upper() or
-                            "GERMLINE" in choppedUpLine[4].upper()): continue
-                else: assert tissueFiltering == "Any", "Unrecognized tissue filtering option: " + tissueFiltering
+# Formats the given means as getAverageGeneExpression does, using '0' for genes with no values.
+def formatGeneExpressionMeans(means, valueCounts) -> List[str]:
+    return [str(mean) if valueCount > 0 else '0' for mean, valueCount in zip(means.tolist(), valueCounts.tolist())]
 
-                for i,RPKMValue in enumerate(choppedUpLine[7:]):
-                    #print("Gene:",genes[i])
-                    if RPKMValue == '' or RPKMValue == "N.A.": continue
-                    rawRPKM[genes[i]].append(float(RPKMValue))
 
-            # Average the values.  Write the averaged values and their respective genes to the output file.
-            for gene in genes:
-                if len(rawRPKM[gene]) == 0: averageRPKM = '0'
-                else: averageRPKM = str(sum(rawRPKM[gene])/len(rawRPKM[gene]))
-                averageGeneExpressionFile.write(gene + '\t' + averageRPKM + '\n')
+# Returns the indices of the given number of genes with the highest mean values, in the same order as
+# rankAverageGeneExpression.  The candidates are found with argpartition, so only they (and anything tied with the
+# last of them) need to be fully sorted.  tieBreakers holds each gene's average expression line, without the newline.
+def getTopGeneIndices(means: np.ndarray, tieBreakers: np.ndarray, geneCount):
 
+    if geneCount <= 0: return np.zeros(0, dtype = np.int64)
+
+    if geneCount < len(means):
+        threshold = means[np.argpartition(-means, geneCount - 1)[:geneCount]].min()
+        candidates = np.flatnonzero(means >= threshold)
+    else: candidates = np.arange(len(means))
+
+    return candidates[np.lexsort((tieBreakers[candidates], -means[candidates]))][:geneCount]
+
+
+# Given a file of RPKM/FPKM values, pull out the most highly expressed genes based on a given percent cutoff value.
+# Filtering may be specified to only use data from a specific tissue/cell type.
+# If useExpressionMatrix is True, the values are loaded into a NumPy array and averaged and ranked in-process
+# (see findHighlyExpressedGenesWithMatrix) instead of through sort and head.  The output files are the same.
+def findHighlyExpressedGenes(geneExpressionFilePath, tissueFiltering: str, percentCutoff = 25, useExpressionMatrix = False):
+
+    print("Filtering in",os.path.basename(geneExpressionFilePath),"with a",percentCutoff,"percent cutoff.")
+    print("Tissue filtering is set to:",tissueFiltering)
+    print()
+
+    # Get the relevant paths for the input and output files.
+    averageGeneExpressionFilePath, filteredGenesFilePath = getHighlyExpressedGenesFilePaths(geneExpressionFilePath,
+                                                                                            tissueFiltering)
+
+    if useExpressionMatrix:
+        findHighlyExpressedGenesWithMatrix(geneExpressionFilePath, tissueFiltering, percentCutoff,
+                                           averageGeneExpressionFilePath, filteredGenesFilePath)
+        return
+
+    # Write the averaged values and their respective genes to the output file.
+    averageGeneExpression = getAverageGeneExpression(geneExpressionFilePath, tissueFiltering)
+    with open(averageGeneExpressionFilePath, 'w') as averageGeneExpressionFile:
+        for gene, averageRPKM in averageGeneExpression: averageGeneExpressionFile.write(gene + '\t' + averageRPKM + '\n')
 
     # Sort the output file in descending order
     subprocess.run(" ".join(("sort","-k2,2gr",averageGeneExpressionFilePath,
                             "-o",averageGeneExpressionFilePath)), shell = True, check = True)
 
     # Output the highly expressed genes to a separate file.
-    geneCountCutoff = str(int(len(genes)*percentCutoff/100))
+    geneCountCutoff = str(getGeneCountCutoff(len(averageGeneExpression), percentCutoff))
     subprocess.run(" ".join(("head", '-'+geneCountCutoff, averageGeneExpressionFilePath, 
                             '>', filteredGenesFilePath)), shell = True, check = True)
 
 
+# Ranks the given genes by their mean values, writes every gene to the average expression file in that order,
+# and writes the top genes for each of the given percent cutoffs to the paired highly expressed genes file.
+# (Only the average expression file needs a full sort; the top genes for each cutoff are selected with getTopGeneIndices.)
+def writeRankedGeneExpression(genes: List[str], means, valueCounts, averageGeneExpressionFilePath,
+                              filteredGenesFilePathsByCutoff: Dict[float,str]):
+
+    averageGeneExpressionLines = np.array([gene + '\t' + averageRPKM for gene, averageRPKM
+                                           in zip(genes, formatGeneExpressionMeans(means, valueCounts))])
+
+    with open(averageGeneExpressionFilePath, 'w') as averageGeneExpressionFile:
+        for line in averageGeneExpressionLines[np.lexsort((averageGeneExpressionLines, -means))].tolist():
+            averageGeneExpressionFile.write(line + '\n')
+
+    for percentCutoff, filteredGenesFilePath in filteredGenesFilePathsByCutoff.items():
+        topGeneIndices = getTopGeneIndices(means, averageGeneExpressionLines, getGeneCountCutoff(len(genes), percentCutoff))
+        with open(filteredGenesFilePath, 'w') as filteredGenesFile:
+            for line in averageGeneExpressionLines[topGeneIndices].tolist(): filteredGenesFile.write(line + '\n')
+
+
+# Writes the ranked average expression file and the highly expressed genes file from a masked expression matrix.
+def findHighlyExpressedGenesWithMatrix(geneExpressionFilePath, tissueFiltering: str, percentCutoff,
+                                       averageGeneExpressionFilePath, filteredGenesFilePath):
+
+    with instrumentStage("findHighlyExpressedGenesWithMatrix", geneExpressionFilePath = geneExpressionFilePath,
+                         tissueFiltering = tissueFiltering) as stage:
+
+        genes, tissues, expressionMatrix = loadGeneExpressionMatrix(geneExpressionFilePath, [tissueFiltering])
+        stage.addRecords(expressionMatrix.size)
+        means, valueCounts = getMaskedGeneExpressionMeans(expressionMatrix, getTissueFilteringMask(tissues, tissueFiltering))
+        writeRankedGeneExpression(genes, means, valueCounts, averageGeneExpressionFilePath,
+                                  {percentCutoff: filteredGenesFilePath})
+
+
+# Finds the highly expressed genes for every combination of the given tissue filterings and percent cutoffs, parsing
+# the gene expression file only once.  The means for every tissue filtering are computed in the same pass, and each
+# tissue filtering's genes are ranked once for all of the cutoffs.  The highly expressed genes file names include
+# their percent cutoff (see getHighlyExpressedGenesFilePaths).  The output files for each combination are otherwise
+# identical to those from findHighlyExpressedGenes.
+# Returns a dictionary of the highly expressed genes file paths, keyed by (tissue filtering, percent cutoff) pairs.
+def sweepHighlyExpressedGenes(geneExpressionFilePath, tissueFilterings: List[str], percentCutoffs: List[float]):
+
+    print("Sweeping",os.path.basename(geneExpressionFilePath),"with percent cutoffs:",', '.join(map(str, percentCutoffs)))
+    print("Tissue filterings:",', '.join(tissueFilterings))
+    print()
+
+    tissueFilterings = list(dict.fromkeys(tissueFilterings))
+    for tissueFiltering in tissueFilterings:
+        assert tissueFiltering in TISSUE_FILTERING_OPTIONS, "Unrecognized tissue filtering option: " + tissueFiltering
+
+    with instrumentStage("sweepHighlyExpressedGenes", geneExpressionFilePath = geneExpressionFilePath,
+                         tissueFilterings = tissueFilterings, percentCutoffs = percentCutoffs) as stage:
+
+        genes, tissues, expressionMatrix = loadGeneExpressionMatrix(geneExpressionFilePath, tissueFilterings)
+        stage.addRecords(expressionMatrix.size)
+        tissueFilteringMasks = [getTissueFilteringMask(tissues, tissueFiltering) for tissueFiltering in tissueFilterings]
+        means, valueCounts = getGroupedGeneExpressionMeans(expressionMatrix, tissueFilteringMasks)
+
+        filteredGenesFilePaths = dict()
+        for tissueIndex, tissueFiltering in enumerate(tissueFilterings):
+
+            filteredGenesFilePathsByCutoff = dict()
+            for percentCutoff in percentCutoffs:
+                averageGeneExpressionFilePath, filteredGenesFilePath = getHighlyExpressedGenesFilePaths(
+                    geneExpressionFilePath, tissueFiltering, percentCutoff)
+                filteredGenesFilePathsByCutoff[percentCutoff] = filteredGenesFilePath
+                filteredGenesFilePaths[(tissueFiltering, percentCutoff)] = filteredGenesFilePath
+
+            writeRankedGeneExpression(genes, means[tissueIndex], valueCounts[tissueIndex],
+                                      getHighlyExpressedGenesFilePaths(geneExpressionFilePath, tissueFiltering)[0],
+                                      filteredGenesFilePathsByCutoff)
+
+    return filteredGenesFilePaths
+
+
+# Runs findHighlyExpressedGenes non-interactively with the given command line arguments.
+def runFromCommandLine(arguments):
+
+    parser = argparse.ArgumentParser(description = "Find the most highly expressed genes in a gene expression file.")
+    parser.add_argument("geneExpressionFilePath", metavar = "gene_expression_file", help = "Gene expression file")
+    parser.add_argument("-t", "--tissue-filtering", nargs = '+', choices = TISSUE_FILTERING_OPTIONS, default = ["Any"],
+                        help = "Cell/tissue type filtering (default: Any)")
+    parser.add_argument("-p", "--percent-cutoff", nargs = '+', type = float, default = [25],
+                        help = "Percentage of genes to keep (default: 25)")
+    parser.add_argument("--expression-matrix", action = "store_true",
+                        help = "Average and rank the values in-process with a NumPy expression matrix")
+    parser.add_argument("--sweep", action = "store_true",
+                        help = "Run every combination of the given tissue filterings and percent cutoffs from a single "
+                               "parse of the file (implied when more than one combination is given)")
+    args = parser.parse_args(arguments)
+
+    if args.sweep or len(args.tissue_filtering)*len(args.percent_cutoff) > 1:
+        sweepHighlyExpressedGenes(args.geneExpressionFilePath, args.tissue_filtering, args.percent_cutoff)
+    else:
+        findHighlyExpressedGenes(args.geneExpressionFilePath, args.tissue_filtering[0], args.percent_cutoff[0],
+                                 args.expression_matrix)
+
+
 def main():
 
+    # Given any command line arguments, run without the UI.
+    if len(sys.argv) > 1: return runFromCommandLine(sys.argv[1:])
+
+    from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
+
     # Create a simple dialog for selecting the gene expression file.
     dialog = TkinterDialog(workingDirectory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
     dialog.createFileSelector("Gene Expression File", 0, ("Text File", ".txt"))
-    dialog.createDropdown("Cell/Tissue Type Filtering", 1, 0, ("Any","Sperm Only", "Oocyte Only", 
-                                                               "Germ Line Only", "Any Germ Line Association"))
+    dialog.createDropdown("Cell/Tissue Type Filtering", 1, 0, TISSUE_FILTERING_OPTIONS)
+    dialog.createCheckbox("Average and rank with an in-process expression matrix", 2, 0)
     dialog.mainloop()
 
     if dialog.selections is None: quit()
 
     # Retrieve the selections and pass the relevant arguments to the primary function.
-    findHighlyExpressedGenes(dialog.selections.getIndividualFilePaths()[0], dialog.selections.getDropdownSelections()[0])
+    findHighlyExpressedGenes(dialog.selections.getIndividualFilePaths()[0], dialog.selections.getDropdownSelections()[0],
+                             useExpressionMatrix = dialog.selections.getToggleStates()[0])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
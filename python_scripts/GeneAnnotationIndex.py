@@ -0,0 +1,326 @@
+# This script contains the GeneIntervalIndex, an array-based representation of a gene positions bed file
+# which can be used to assign mutations to transcribed or non-transcribed strands in bulk.
+# The index is cached next to the bed file it was built from so that repeated runs can skip parsing entirely.
+# It also contains the StrandAnnotationBitmap, a per-base form of the index's strand annotation which is shared with
+# the perl scripts.  (Run this script with a gene positions file path to build the bitmap for it.)
+# NOTE:  Like the CountsFileGenerator, this assumes the gene positions file is sorted by chromosome and then start position.
+
+import os, sys, hashlib, warnings
+import numpy as np
+from typing import Dict, List
+from BedSorting import countBedHeaderLines
+
+# Strand annotation values for each base in the genome.
+NO_GENE = 0
+TRANSCRIBED_PLUS = 1 # Only covered by genes whose transcribed strand is '+'
+TRANSCRIBED_MINUS = 2 # Only covered by genes whose transcribed strand is '-'
+AMBIGUOUS = 3 # Covered by genes transcribed on both strands
+
+# Increment this whenever the layout of the cache file changes so that old caches are rebuilt.
+CACHE_FORMAT_VERSION = 1
+
+# The extensions added to the gene positions file path for the strand annotation bitmap and its index.
+STRAND_BITMAP_EXTENSION = ".strand_bitmap"
+STRAND_BITMAP_INDEX_EXTENSION = ".strand_bitmap.idx"
+
+# The per-chromosome array dictionaries stored in the cache file.
+CACHED_ARRAY_NAMES = ("startPositions", "endPositions", "transcribedStrandIsPlus", "maxEndPositions",
+                      "annotationRunStarts", "annotationRunValues")
+
+
+# Returns the sha256 hash of the given file's contents.
+def getFileHash(filePath):
+
+    fileHash = hashlib.sha256()
+    with open(filePath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024*1024), b''): fileHash.update(chunk)
+    return fileHash.hexdigest()
+
+
+# Returns the number of header lines (e.g. column names, or "track" and "browser" lines) at the start of the given bed file.
+def getBedHeaderLineCount(bedFilePath):
+    with open(bedFilePath, 'r') as bedFile: return countBedHeaderLines(bedFile)
+
+
+# Stores the gene positions file as per-chromosome, sorted NumPy arrays so that mutations can be assigned
+# to genes in bulk using searchsorted instead of a line-by-line merge.
+# Also stores a run-length encoding of the strand annotation (see values above) for every base on each chromosome.
+# If gene position lines are given, they are indexed in place of the gene positions file's contents (so the file
+# doesn't need to exist), and nothing is cached.
+class GeneIntervalIndex:
+
+    def __init__(self, genePositionsFilePath, useCache = True, useStrandAnnotationBitmap = False,
+                 genePositionLines: List[str] = None):
+
+        self.genePositionsFilePath = genePositionsFilePath
+        self.genePositionLines = genePositionLines
+        if genePositionLines is not None:
+            if useStrandAnnotationBitmap: raise ValueError("The strand annotation bitmap needs a gene positions file.")
+            useCache = False
+        self.cacheFilePath = genePositionsFilePath + ".annotation_index.npz"
+
+        # If requested, getStrandAnnotations looks up each position directly in the strand annotation bitmap.
+        # (The bitmap is opened when it is first needed, so the index can still be cheaply passed between processes.)
+        self.strandAnnotationBitmapFilePath = None
+        self.strandAnnotationBitmap: StrandAnnotationBitmap = None
+
+        # Dictionaries of arrays with chromosomes as keys.
+        self.startPositions: Dict[str, np.ndarray] = dict() # 0 base
+        self.endPositions: Dict[str, np.ndarray] = dict() # Still 0 base
+        self.transcribedStrandIsPlus: Dict[str, np.ndarray] = dict()
+        # The running maximum of end positions, used to find the first gene that a mutation could fall within.
+        self.maxEndPositions: Dict[str, np.ndarray] = dict()
+        # The start positions of runs of bases with the same strand annotation, and their annotations.
+        # The first run always starts at position 0.
+        self.annotationRunStarts: Dict[str, np.ndarray] = dict()
+        self.annotationRunValues: Dict[str, np.ndarray] = dict()
+
+        # The merge-walk in CountsFileGenerator stops reading mutations as soon as it passes the last gene,
+        # so keep track of where that is.
+        self.lastChromosome = None
+        self.lastChromosomeMaxEndPos = None
+
+        if not (useCache and self.readCache()):
+            self.parseGenePositions()
+            if useCache: self.writeCache()
+
+        if useStrandAnnotationBitmap: self.strandAnnotationBitmapFilePath = self.updateStrandAnnotationBitmap()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["strandAnnotationBitmap"] = None
+        state["genePositionLines"] = None # Already indexed.
+        return state
+
+
+    # Reads the gene positions file into per-chromosome arrays and builds the strand annotation.
+    def parseGenePositions(self):
+
+        print("Indexing gene positions in",os.path.basename(self.genePositionsFilePath))
+
+        # Read in the relevant columns for every gene at once.
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message = "loadtxt: input contained no data")
+            if self.genePositionLines is None:
+                geneColumns = np.loadtxt(self.genePositionsFilePath, dtype = str, usecols = (0,1,2,5),
+                                         comments = None, ndmin = 2, 
+                                         skiprows = getBedHeaderLineCount(self.genePositionsFilePath))
+            else:
+                geneColumns = np.loadtxt(self.genePositionLines, dtype = str, usecols = (0,1,2,5), comments = None,
+                                         ndmin = 2, skiprows = countBedHeaderLines(self.genePositionLines))
+
+        geneChromosomes = geneColumns[:,0]
+        geneStartPositions = geneColumns[:,1].astype(np.int64)
+        geneEndPositions = geneColumns[:,2].astype(np.int64) - 1
+
+        # The transcribed strand (reversed because the coding strand is given)
+        if not np.all(np.isin(geneColumns[:,3], ('+','-'))):
+            raise ValueError("Unrecognized strand designation in " + self.genePositionsFilePath)
+        geneTranscribedStrandIsPlus = geneColumns[:,3] == '-'
+
+        for chromosome in np.unique(geneChromosomes).tolist():
+
+            chromosomeGenes = geneChromosomes == chromosome
+            self.startPositions[chromosome] = geneStartPositions[chromosomeGenes]
+            self.endPositions[chromosome] = geneEndPositions[chromosomeGenes]
+            self.transcribedStrandIsPlus[chromosome] = geneTranscribedStrandIsPlus[chromosomeGenes]
+            self.maxEndPositions[chromosome] = np.maximum.accumulate(self.endPositions[chromosome])
+            self.annotateChromosome(chromosome)
+
+        if len(geneChromosomes) > 0:
+            self.lastChromosome = str(geneChromosomes[-1])
+            self.lastChromosomeMaxEndPos = int(self.maxEndPositions[self.lastChromosome][-1])
+
+
+    # Returns a boolean array denoting which of the given positions fall within any of the given genes.
+    # (The genes must be sorted by start position.)
+    @staticmethod
+    def isCoveredByGenes(startPositions: np.ndarray, endPositions: np.ndarray, positions: np.ndarray):
+
+        if len(startPositions) == 0: return np.zeros(len(positions), dtype = bool)
+
+        lastGeneStartingBefore = np.searchsorted(startPositions, positions, side = "right") - 1
+        return ((lastGeneStartingBefore >= 0) &
+                (np.maximum.accumulate(endPositions)[lastGeneStartingBefore] >= positions))
+
+
+    # Builds the run-length encoded strand annotation for the given chromosome.
+    def annotateChromosome(self, chromosome):
+
+        startPositions = self.startPositions[chromosome]
+        endPositions = self.endPositions[chromosome]
+        transcribedStrandIsPlus = self.transcribedStrandIsPlus[chromosome]
+
+        # The annotation can only change where a gene starts or just after one ends.
+        boundaries = np.unique(np.concatenate(((0,), startPositions, endPositions + 1)))
+
+        boundaryAnnotations = np.zeros(len(boundaries), dtype = np.uint8)
+        for isPlus, annotation in ((True, TRANSCRIBED_PLUS), (False, TRANSCRIBED_MINUS)):
+            strandGenes = transcribedStrandIsPlus == isPlus
+            covered = self.isCoveredByGenes(startPositions[strandGenes], endPositions[strandGenes], boundaries)
+            boundaryAnnotations[covered] |= annotation
+
+        # Collapse adjacent runs with the same annotation.
+        runStartsHere = np.ones(len(boundaries), dtype = bool)
+        runStartsHere[1:] = boundaryAnnotations[1:] != boundaryAnnotations[:-1]
+        self.annotationRunStarts[chromosome] = boundaries[runStartsHere]
+        self.annotationRunValues[chromosome] = boundaryAnnotations[runStartsHere]
+
+
+    # Returns the strand annotation for each of the given positions on the given chromosome.
+    def getStrandAnnotations(self, chromosome, positions: np.ndarray):
+
+        if self.strandAnnotationBitmapFilePath is not None:
+            if self.strandAnnotationBitmap is None:
+                self.strandAnnotationBitmap = StrandAnnotationBitmap(self.strandAnnotationBitmapFilePath)
+            return self.strandAnnotationBitmap.getStrandAnnotations(chromosome, positions)
+
+        if chromosome not in self.annotationRunStarts: return np.full(len(positions), NO_GENE, dtype = np.uint8)
+        runIndices = np.searchsorted(self.annotationRunStarts[chromosome], positions, side = "right") - 1
+        return self.annotationRunValues[chromosome][runIndices]
+
+
+    # Attempts to read the index from the cache file.  Returns True if the cache exists and matches the
+    # gene positions file (first by size and modification time, then by content hash), and False otherwise.
+    def readCache(self):
+
+        if not os.path.exists(self.cacheFilePath): return False
+
+        genePositionsFileStats = os.stat(self.genePositionsFilePath)
+        cachedArrays: Dict[str, Dict[str, np.ndarray]] = dict()
+        try:
+            with np.load(self.cacheFilePath, allow_pickle = False) as cache:
+
+                if int(cache["formatVersion"]) != CACHE_FORMAT_VERSION: return False
+                statsMatch = (int(cache["sourceSize"]) == genePositionsFileStats.st_size and
+                              int(cache["sourceMTime"]) == genePositionsFileStats.st_mtime_ns)
+                if not statsMatch and str(cache["sourceHash"]) != getFileHash(self.genePositionsFilePath): return False
+
+                for arrayName in CACHED_ARRAY_NAMES:
+                    cachedArrays[arrayName] = {chromosome: cache[arrayName + '_' + chromosome]
+                                               for chromosome in cache["chromosomes"].tolist()}
+                lastChromosome = str(cache["lastChromosome"])
+
+        except (OSError, KeyError, ValueError):
+            warnings.warn("Unable to read gene index cache at " + self.cacheFilePath + ".  Rebuilding it.")
+            return False
+
+        for arrayName in CACHED_ARRAY_NAMES: setattr(self, arrayName, cachedArrays[arrayName])
+        if len(self.startPositions) > 0:
+            self.lastChromosome = lastChromosome
+            self.lastChromosomeMaxEndPos = int(self.maxEndPositions[self.lastChromosome][-1])
+
+        # If the file was only touched, refresh the cache so the hash doesn't need to be checked next time.
+        if not statsMatch: self.writeCache()
+
+        return True
+
+
+    # Writes the index to the cache file, keyed by the gene positions file's size, modification time, and hash.
+    def writeCache(self):
+
+        genePositionsFileStats = os.stat(self.genePositionsFilePath)
+        cacheArrays = {"formatVersion": CACHE_FORMAT_VERSION, "sourceSize": genePositionsFileStats.st_size,
+                       "sourceMTime": genePositionsFileStats.st_mtime_ns,
+                       "sourceHash": getFileHash(self.genePositionsFilePath),
+                       "chromosomes": np.array(list(self.startPositions), dtype = str),
+                       "lastChromosome": '' if self.lastChromosome is None else self.lastChromosome}
+        for arrayName in CACHED_ARRAY_NAMES:
+            for chromosome, array in getattr(self, arrayName).items():
+                cacheArrays[arrayName + '_' + chromosome] = array
+
+        # Write to a temporary file first so that an interrupted run never leaves a partial cache behind.
+        temporaryCacheFilePath = self.cacheFilePath + ".tmp"
+        try:
+            with open(temporaryCacheFilePath, 'wb') as temporaryCacheFile:
+                np.savez(temporaryCacheFile, **cacheArrays)
+            os.replace(temporaryCacheFilePath, self.cacheFilePath)
+        except OSError:
+            warnings.warn("Unable to write gene index cache to " + self.cacheFilePath)
+
+
+    # Returns the strand annotation for every base on the given chromosome, from position 0 up to the end of its last gene.
+    def getPerBaseStrandAnnotation(self, chromosome):
+
+        annotationRunStarts = self.annotationRunStarts[chromosome]
+        return np.repeat(self.annotationRunValues[chromosome][:-1], np.diff(annotationRunStarts))
+
+
+    # Makes sure the strand annotation bitmap for the gene positions file exists and is up to date, writing it if necessary.
+    # Returns the path to the bitmap.
+    def updateStrandAnnotationBitmap(self):
+
+        bitmapFilePath = self.genePositionsFilePath + STRAND_BITMAP_EXTENSION
+        bitmapIndexFilePath = self.genePositionsFilePath + STRAND_BITMAP_INDEX_EXTENSION
+        genePositionsMTime = os.path.getmtime(self.genePositionsFilePath)
+
+        if (not os.path.exists(bitmapFilePath) or not os.path.exists(bitmapIndexFilePath) or
+            os.path.getmtime(bitmapFilePath) < genePositionsMTime or os.path.getmtime(bitmapIndexFilePath) < genePositionsMTime):
+            writeStrandAnnotationBitmap(self, bitmapFilePath, bitmapIndexFilePath)
+
+        return bitmapFilePath
+
+
+# Writes the strand annotation from the given index as a bitmap with 2 bits per base.  Each chromosome's bases are
+# packed 4 to a byte, starting from the lowest-order bits (the layout read by perl's vec($bitmap, $position, 2)).
+# The bitmap index is a tab-separated text file giving each chromosome's name, byte offset in the bitmap, 
+# length in bytes, and length in bases.  (Positions past the end of a chromosome's bitmap are not in any gene.)
+def writeStrandAnnotationBitmap(geneIntervalIndex: GeneIntervalIndex, bitmapFilePath, bitmapIndexFilePath):
+
+    print("Writing strand annotation bitmap for",os.path.basename(geneIntervalIndex.genePositionsFilePath))
+
+    with open(bitmapFilePath, 'wb') as bitmapFile, open(bitmapIndexFilePath, 'w') as bitmapIndexFile:
+
+        offset = 0
+        for chromosome in geneIntervalIndex.annotationRunStarts:
+
+            perBaseAnnotation = geneIntervalIndex.getPerBaseStrandAnnotation(chromosome)
+            paddedAnnotation = np.zeros(-(-len(perBaseAnnotation)//4)*4, dtype = np.uint8)
+            paddedAnnotation[:len(perBaseAnnotation)] = perBaseAnnotation
+            bitmapBytes = np.bitwise_or.reduce(paddedAnnotation.reshape(-1,4) << np.array((0,2,4,6), dtype = np.uint8),
+                                               axis = 1).astype(np.uint8)
+
+            bitmapFile.write(bitmapBytes.tobytes())
+            bitmapIndexFile.write('\t'.join((chromosome, str(offset), str(len(bitmapBytes)),
+                                             str(len(perBaseAnnotation)))) + '\n')
+            offset += len(bitmapBytes)
+
+
+# Gives access to a strand annotation bitmap (see writeStrandAnnotationBitmap) through a memory map.
+class StrandAnnotationBitmap:
+
+    def __init__(self, bitmapFilePath):
+
+        # Byte offsets and base counts for each chromosome.
+        self.offsets: Dict[str, int] = dict()
+        self.baseCounts: Dict[str, int] = dict()
+        with open(bitmapFilePath[:-len(STRAND_BITMAP_EXTENSION)] + STRAND_BITMAP_INDEX_EXTENSION, 'r') as bitmapIndexFile:
+            for line in bitmapIndexFile:
+                chromosome, offset, _, baseCount = line.split('\t')
+                self.offsets[chromosome] = int(offset)
+                self.baseCounts[chromosome] = int(baseCount)
+
+        if os.path.getsize(bitmapFilePath) > 0: self.bitmap = np.memmap(bitmapFilePath, dtype = np.uint8, mode = 'r')
+        else: self.bitmap = np.zeros(0, dtype = np.uint8)
+
+
+    # Returns the strand annotation for each of the given positions on the given chromosome.
+    def getStrandAnnotations(self, chromosome, positions: np.ndarray):
+
+        strandAnnotations = np.full(len(positions), NO_GENE, dtype = np.uint8)
+        if chromosome not in self.offsets: return strandAnnotations
+
+        inBitmap = positions < self.baseCounts[chromosome]
+        bitmapPositions = positions[inBitmap]
+        bitmapBytes = self.bitmap[self.offsets[chromosome] + (bitmapPositions >> 2)]
+        strandAnnotations[inBitmap] = (bitmapBytes >> ((bitmapPositions & 3) << 1).astype(np.uint8)) & 3
+        return strandAnnotations
+
+
+def main():
+
+    if len(sys.argv) != 2: sys.exit("Usage: python GeneAnnotationIndex.py <gene positions bed file>")
+    print("Strand annotation bitmap at", GeneIntervalIndex(sys.argv[1], useStrandAnnotationBitmap = True).strandAnnotationBitmapFilePath)
+
+if __name__ == "__main__": main()
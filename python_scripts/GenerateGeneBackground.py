@@ -1,12 +1,323 @@
-from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
-from mutperiodpy.helper_scripts.UsefulBioinformaticsFunctions import bedToFasta, reverseCompliment, FastaFileIterator, isPurine
-from typing import List
-import os
+from IndexedFasta import IndexedFasta
+from StageInstrumentation import instrumentStage
+from typing import List, Dict, Tuple, Iterable
+import os, sys, argparse, warnings
+import numpy as np
+
+# Lookup tables for vectorized trinucleotide counting.  Each base is encoded in 3 bits, so a trinucleotide's code is
+# (first << 6) | (middle << 3) | last.  Only the upper case bases A, C, G, T, and N are encoded.  Anything else
+# (e.g. soft-masked or IUPAC bases) is encoded as INVALID_BASE_ENCODING, since the substring counter keeps those
+# bases as written and they can't be counted the same way here.
+ENCODED_BASES = "ACGTN"
+COMPLEMENTARY_BASES = "TGCAN"
+INVALID_BASE_ENCODING = 7
+BASE_ENCODINGS = np.full(256, INVALID_BASE_ENCODING, dtype = np.uint16)
+for i, base in enumerate(ENCODED_BASES): BASE_ENCODINGS[ord(base)] = i
+TRINUCLEOTIDE_CODE_COUNT = 512
+
+# The trinucleotide for each code (None for codes that don't correspond to a trinucleotide),
+# the code of its reverse complement, and whether or not its middle base is a purine.
+TRINUCLEOTIDES_BY_CODE = [None]*TRINUCLEOTIDE_CODE_COUNT
+REVERSE_COMPLEMENT_CODES = np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = np.uint16)
+PURINE_CENTERED_CODES = np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = bool)
+for first in range(len(ENCODED_BASES)):
+    for middle in range(len(ENCODED_BASES)):
+        for last in range(len(ENCODED_BASES)):
+            code = (first << 6) | (middle << 3) | last
+            TRINUCLEOTIDES_BY_CODE[code] = ENCODED_BASES[first] + ENCODED_BASES[middle] + ENCODED_BASES[last]
+            complements = [ENCODED_BASES.index(COMPLEMENTARY_BASES[base]) for base in (last, middle, first)]
+            REVERSE_COMPLEMENT_CODES[code] = (complements[0] << 6) | (complements[1] << 3) | complements[2]
+            PURINE_CENTERED_CODES[code] = ENCODED_BASES[middle] in "AG"
+
+
+# Returns the given sequence (a string or an array of ASCII codes) as an array of ASCII codes.
+def getSequenceArray(sequence) -> np.ndarray:
+    if isinstance(sequence, str): return np.frombuffer(sequence.encode(), dtype = np.uint8)
+    else: return sequence
+
+
+# Returns whether or not every base in the given sequence can be encoded for vectorized counting (see BASE_ENCODINGS).
+def hasOnlyEncodedBases(sequence):
+    return not (BASE_ENCODINGS[getSequenceArray(sequence)] == INVALID_BASE_ENCODING).any()
+
+
+# Raises a ValueError for a sequence with bases that can't be encoded for vectorized counting.
+def raiseInvalidBasesError(sequenceDescription):
+    raise ValueError(sequenceDescription + " contains bases other than upper case A, C, G, T, and N, which can only be "
+                     "counted from a fasta file without vectorized counting.")
+
+
+# Returns an array with the number of occurrences of every trinucleotide code in the given sequence.
+# (The sequence may be given as a string or as an array of ASCII codes.)
+# Raises a ValueError if the sequence has any bases that can't be encoded.
+def countEncodedTrinucleotides(sequence):
+
+    encodedSequence = BASE_ENCODINGS[getSequenceArray(sequence)]
+    if len(encodedSequence) < 3: return np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = np.int64)
+    if (encodedSequence == INVALID_BASE_ENCODING).any(): raiseInvalidBasesError("Sequence")
+
+    trinucleotideCodes = (encodedSequence[:-2] << 6) | (encodedSequence[1:-1] << 3) | encodedSequence[2:]
+    return np.bincount(trinucleotideCodes, minlength = TRINUCLEOTIDE_CODE_COUNT)
+
+
+# Converts counts for trinucleotide codes from one strand into counts for the codes on the opposite strand.
+def reverseComplementCodeCounts(trinucleotideCodeCounts: np.ndarray):
+
+    reverseComplementCounts = np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = np.int64)
+    np.add.at(reverseComplementCounts, REVERSE_COMPLEMENT_CODES, trinucleotideCodeCounts)
+    return reverseComplementCounts
+
+
+# Counts the trinucleotide codes in each of the ranges in the given bed file by reading them straight from the given 
+# indexed genome.  Just like bedToFasta, ranges on the '-' strand are read as their reverse complement, and ranges
+# which fall outside of the genome are skipped.
+def countTrinucleotideCodesInRanges(bedFilePath, genome: IndexedFasta):
+    with open(bedFilePath, 'r') as bedFile: return countTrinucleotideCodesInRangeLines(bedFile, genome)
+
+
+# The same as countTrinucleotideCodesInRanges, but for ranges given as bed lines.
+def countTrinucleotideCodesInRangeLines(bedLines: Iterable[str], genome: IndexedFasta):
+
+    trinucleotideCodeCounts = np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = np.int64)
+
+    for line in bedLines:
+
+        choppedUpLine = line.strip().split('\t')
+        chromosome = choppedUpLine[0]
+        rangeStart = int(choppedUpLine[1])
+        rangeEnd = int(choppedUpLine[2])
+        strand = choppedUpLine[5]
+
+        if (chromosome not in genome.indexEntries or rangeStart < 0 or 
+            rangeEnd > genome.getSequenceLength(chromosome)):
+            warnings.warn("Range " + chromosome + ':' + str(rangeStart) + '-' + str(rangeEnd) + 
+                          " is not within the genome.  Skipping.")
+            continue
+
+        rangeSequence = genome.getSequenceArray(chromosome, rangeStart, rangeEnd)
+        if len(rangeSequence) >= 3 and not hasOnlyEncodedBases(rangeSequence):
+            raiseInvalidBasesError("Range " + chromosome + ':' + str(rangeStart) + '-' + str(rangeEnd))
+        rangeCodeCounts = countEncodedTrinucleotides(rangeSequence)
+        if strand == '-': rangeCodeCounts = reverseComplementCodeCounts(rangeCodeCounts)
+        trinucleotideCodeCounts += rangeCodeCounts
+
+    return trinucleotideCodeCounts
+
+
+# Splits the given trinucleotide code counts into NTS and TS count dictionaries.  Purine-centered trinucleotides are
+# reverse complemented and counted as TS, and all others are counted as NTS.
+def foldTrinucleotideCodeCounts(trinucleotideCodeCounts: np.ndarray):
+
+    trinucleotideCountsNTS = dict()
+    trinucleotideCountsTS = dict()
+
+    for code in np.flatnonzero(trinucleotideCodeCounts).tolist():
+        if PURINE_CENTERED_CODES[code]:
+            trinucleotide = TRINUCLEOTIDES_BY_CODE[REVERSE_COMPLEMENT_CODES[code]]
+            trinucleotideCountsTS[trinucleotide] = (trinucleotideCountsTS.setdefault(trinucleotide, 0) + 
+                                                    int(trinucleotideCodeCounts[code]))
+        else:
+            trinucleotide = TRINUCLEOTIDES_BY_CODE[code]
+            trinucleotideCountsNTS[trinucleotide] = (trinucleotideCountsNTS.setdefault(trinucleotide, 0) + 
+                                                     int(trinucleotideCodeCounts[code]))
+
+    return trinucleotideCountsNTS, trinucleotideCountsTS
+
+
+# Writes the given NTS and TS trinucleotide counts to the given background counts file.
+def writeTrinucleotideBackgroundCounts(trinucleotideBackgroundCountsFilePath, trinucleotideCountsNTS, trinucleotideCountsTS):
+
+    with open(trinucleotideBackgroundCountsFilePath, 'w') as trinucleotideBackgroundCountsFile:
+
+        # Write the header
+        trinucleotideBackgroundCountsFile.write('\t'.join(("Trinucleotide", "NTS_Counts", "TS_Counts")) + '\n')
+
+        # Write the counts.
+
+        for trinucleotide in sorted(trinucleotideCountsNTS.keys() | trinucleotideCountsTS.keys(), key = lambda x: x[1] + x):
+
+            trinucleotideBackgroundCountsFile.write('\t'.join((trinucleotide, str(trinucleotideCountsNTS.setdefault(trinucleotide, 0)),
+                                                               str(trinucleotideCountsTS.setdefault(trinucleotide, 0)))) + '\n')
+
+
+# Returns the path to the clear gene ranges file for the given gene designations file.
+def getClearGeneRangesFilePath(geneDesignationsFilePath):
+    return geneDesignationsFilePath.rsplit("gene_designations.bed", 1)[0] + "clear_gene_ranges.bed"
+
+
+# Returns the path to the background trinucleotide counts file for the given clear gene ranges file.
+def getTrinucleotideBackgroundCountsFilePath(clearGeneRangesFilePath):
+    return clearGeneRangesFilePath.rsplit("clear_gene_ranges.bed",1)[0] + "background_gene_trinuc_counts.tsv"
+
+
+# Condenses all overlapping gene regions in the given (sorted) gene designation lines and removes any ambiguous regions
+# (any mixing of '+' and '-' regions), yielding a bed line for each clear gene range.
+def getClearGeneRanges(geneDesignationLines: Iterable[str]):
+
+    currentGeneRangeChromosome = None
+    currentGeneRangeStart = None
+    currentGeneRangeEnd = None
+    currentGeneRangeStrand = None
+
+    for line in geneDesignationLines:
+
+        # Parse out the gene range info from the current line.
+        choppedUpLine = line.strip().split('\t')
+        lineChromosome = choppedUpLine[0]
+        lineGeneStart = int(choppedUpLine[1])
+        lineGeneEnd = int(choppedUpLine[2])
+        lineStrand = choppedUpLine[5]
+
+        # Unless we are starting a new gene range, check to see if the gene region on this line overlaps with the current one.
+        if currentGeneRangeChromosome is not None:
+
+            # If they overlap, expand the current range and check to make sure the strands match.
+            if currentGeneRangeChromosome == lineChromosome and lineGeneStart < currentGeneRangeEnd:
+                
+                currentGeneRangeEnd = lineGeneEnd
+                if currentGeneRangeStrand is not None and currentGeneRangeStrand != lineStrand: currentGeneRangeStrand = None
+
+            # If the don't overlap, check to make sure the strand designation for this region is unambiguous, then write it.
+            # Also, keep in mind to expand the ranges by one bp on either side for trinucleotide context at the borders.
+            else:
+
+                if currentGeneRangeStrand is not None:
+                    yield '\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart - 1),
+                                     str(currentGeneRangeEnd + 1), '.', '.', currentGeneRangeStrand)) + '\n'
+                
+                # Don't forget to reset the chromosome variable to flag the rest for reassignment!
+                currentGeneRangeChromosome = None
+
+
+        # If we are starting to look at a new gene range, assign all the values from this line.
+        if currentGeneRangeChromosome is None:
+            currentGeneRangeChromosome = lineChromosome
+            currentGeneRangeStart = lineGeneStart
+            currentGeneRangeEnd = lineGeneEnd
+            currentGeneRangeStrand = lineStrand
+
+    # Do one last check so we don't miss the last gene range.
+    if currentGeneRangeStrand is not None:
+        yield '\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart - 1), 
+                         str(currentGeneRangeEnd + 1), '.', '.', currentGeneRangeStrand)) + '\n'
+
+
+# Writes the clear gene ranges (see getClearGeneRanges) for the given gene designations file to a clear gene ranges file.
+# Returns the path to that file.
+def writeClearGeneRanges(geneDesignationsFilePath):
+
+    clearGeneRangesFilePath = getClearGeneRangesFilePath(geneDesignationsFilePath)
+
+    with open(geneDesignationsFilePath, 'r') as geneDesignationsFile:
+        with open(clearGeneRangesFilePath, 'w') as clearGeneRangesFile:
+            clearGeneRangesFile.writelines(getClearGeneRanges(geneDesignationsFile))
+
+    return clearGeneRangesFilePath
+
+
+# Returns the number of the given ranges which fully contain the trinucleotide starting at each position in a sequence
+# with the given number of trinucleotides.  (Computed as a prefix sum over the changes in coverage at range boundaries.)
+def getTrinucleotideCoverage(rangeStarts: np.ndarray, rangeEnds: np.ndarray, trinucleotideCount):
+
+    coverageChanges = np.zeros(trinucleotideCount + 1, dtype = np.int32)
+    containsTrinucleotides = rangeEnds - rangeStarts >= 3
+    np.add.at(coverageChanges, rangeStarts[containsTrinucleotides], 1)
+    np.add.at(coverageChanges, rangeEnds[containsTrinucleotides] - 2, -1)
+    return np.cumsum(coverageChanges[:-1])
+
+
+# Generates the same background counts as generateGeneBackground for every given set of gene designations, but with only
+# one pass through the genome.  Trinucleotide codes are computed once per chromosome, and then each set's TS and NTS counts
+# are obtained by weighting those codes by the set's clear range coverage on each strand.
+def generateGeneBackgroundsInOnePass(geneDesignationsFilePaths: List[str], genomeFilePath):
+
+    clearGeneRangesFilePaths = list()
+    for geneDesignationsFilePath in geneDesignationsFilePaths:
+
+        print("Parsing clear ranges for",geneDesignationsFilePath)
+        assert geneDesignationsFilePath.endswith("gene_designations.bed"), ("Unexpected file path.  Expected file ending in " +
+                                                                            "gene_designations.bed")
+        clearGeneRangesFilePaths.append(writeClearGeneRanges(geneDesignationsFilePath))
+
+    with IndexedFasta(genomeFilePath) as genome:
+
+        # Read in the clear ranges for each set, grouped by chromosome and strand (as lists of start and end positions).
+        # Just like bedToFasta, ranges which fall outside of the genome are skipped.
+        clearRangesBySet: List[Dict[str, Dict[str, Tuple[List, List]]]] = list()
+        for clearGeneRangesFilePath in clearGeneRangesFilePaths:
+
+            clearRanges = dict()
+            with open(clearGeneRangesFilePath, 'r') as clearGeneRangesFile:
+                for line in clearGeneRangesFile:
+
+                    choppedUpLine = line.strip().split('\t')
+                    chromosome = choppedUpLine[0]
+                    rangeStart = int(choppedUpLine[1])
+                    rangeEnd = int(choppedUpLine[2])
+                    strand = choppedUpLine[5]
+
+                    if (chromosome not in genome.indexEntries or rangeStart < 0 or 
+                        rangeEnd > genome.getSequenceLength(chromosome)):
+                        warnings.warn("Range " + chromosome + ':' + str(rangeStart) + '-' + str(rangeEnd) + 
+                                      " is not within the genome.  Skipping.")
+                        continue
+
+                    rangeStarts, rangeEnds = clearRanges.setdefault(chromosome, dict()).setdefault(strand, (list(), list()))
+                    rangeStarts.append(rangeStart)
+                    rangeEnds.append(rangeEnd)
+
+            clearRangesBySet.append(clearRanges)
+
+        # Count the trinucleotides for every set, one chromosome at a time.
+        trinucleotideCodeCountsBySet = [np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = np.int64) for _ in clearRangesBySet]
+        for chromosome in genome.indexEntries:
+
+            if not any(chromosome in clearRanges for clearRanges in clearRangesBySet): continue
+            print("Counting trinucleotides in",chromosome)
+
+            encodedSequence = BASE_ENCODINGS[genome.getSequenceArray(chromosome, 0, genome.getSequenceLength(chromosome))]
+            if len(encodedSequence) < 3: continue
+            trinucleotideCodes = (encodedSequence[:-2] << 6) | (encodedSequence[1:-1] << 3) | encodedSequence[2:]
+            invalidBases = encodedSequence == INVALID_BASE_ENCODING
+            invalidTrinucleotides = invalidBases[:-2] | invalidBases[1:-1] | invalidBases[2:] if invalidBases.any() else None
+            del encodedSequence, invalidBases
+
+            for clearRanges, trinucleotideCodeCounts in zip(clearRangesBySet, trinucleotideCodeCountsBySet):
+                for strand, (rangeStarts, rangeEnds) in clearRanges.get(chromosome, dict()).items():
+
+                    coverage = getTrinucleotideCoverage(np.array(rangeStarts), np.array(rangeEnds), len(trinucleotideCodes))
+                    if invalidTrinucleotides is not None and coverage[invalidTrinucleotides].any():
+                        raiseInvalidBasesError("A clear gene range on " + chromosome)
+                    strandCodeCounts = np.rint(np.bincount(trinucleotideCodes, weights = coverage, 
+                                                           minlength = TRINUCLEOTIDE_CODE_COUNT)).astype(np.int64)
+
+                    # Just like bedToFasta, ranges on the '-' strand are read as their reverse complement.
+                    if strand == '-': strandCodeCounts = reverseComplementCodeCounts(strandCodeCounts)
+                    trinucleotideCodeCounts += strandCodeCounts
+
+    # Write the background trinucleotide counts for each set.
+    for clearGeneRangesFilePath, trinucleotideCodeCounts in zip(clearGeneRangesFilePaths, trinucleotideCodeCountsBySet):
+        trinucleotideBackgroundCountsFilePath = getTrinucleotideBackgroundCountsFilePath(clearGeneRangesFilePath)
+        print("Writing",trinucleotideBackgroundCountsFilePath)
+        writeTrinucleotideBackgroundCounts(trinucleotideBackgroundCountsFilePath, *foldTrinucleotideCodeCounts(trinucleotideCodeCounts))
+
 
 # Given a genome fasta file path, generates background counts for every trinucleotide sequence for each of the given 
 # sets of gene designations.  TS and NTS trinucleotides are counted separately, and ambiguous gene regions (any 
 # mixing of '+' and '-' regions) are not counted.
-def generateGeneBackground(geneDesignationsFilePaths: List[str], genomeFilePath):
+# If useVectorizedCounting is True, trinucleotides are counted with NumPy instead of one position at a time.
+# (Sequences with bases other than upper case A, C, G, T, and N are still counted one position at a time.)
+# If useGenomeIndex is True, the clear gene ranges are read straight from the memory-mapped, indexed genome 
+# instead of through an intermediate fasta file.  (This implies vectorized counting, and raises a ValueError if any
+# clear gene range has bases other than upper case A, C, G, T, and N.)
+# If useSingleGenomePass is True, all the sets of gene designations are counted together with 
+# generateGeneBackgroundsInOnePass.  (This implies both of the above.)
+def generateGeneBackground(geneDesignationsFilePaths: List[str], genomeFilePath, useVectorizedCounting = False,
+                           useGenomeIndex = False, useSingleGenomePass = False):
+
+    if useSingleGenomePass: 
+        generateGeneBackgroundsInOnePass(geneDesignationsFilePaths, genomeFilePath)
+        return
 
     for geneDesignationsFilePath in geneDesignationsFilePaths:
 
@@ -18,111 +329,109 @@ def generateGeneBackground(geneDesignationsFilePaths: List[str], genomeFilePath)
         print("Parsing clear ranges...")
 
         # First, condense all overlapping gene regions and remove any ambiguous regions.
-        clearGeneRangesFilePath = geneDesignationsFilePath.rsplit("gene_designations.bed", 1)[0] + "clear_gene_ranges.bed"
-
-        currentGeneRangeChromosome = None
-        currentGeneRangeStart = None
-        currentGeneRangeEnd = None
-        currentGeneRangeStrand = None
-
-        with open(geneDesignationsFilePath, 'r') as geneDesignationsFile:
-            with open(clearGeneRangesFilePath, 'w') as clearGeneRangesFile:
-                for line in geneDesignationsFile:
-
-                    # Parse out the gene range info from the current line.
-                    choppedUpLine = line.strip().split('\t')
-                    lineChromosome = choppedUpLine[0]
-                    lineGeneStart = int(choppedUpLine[1])
-                    lineGeneEnd = int(choppedUpLine[2])
-                    lineStrand = choppedUpLine[5]
-
-                    # Unless we are starting a new gene range, check to see if the gene region on this line overlaps with the current one.
-                    if currentGeneRangeChromosome is not None:
-
-                        # If they overlap, expand the current range and check to make sure the strands match.
-                        if currentGeneRangeChromosome == lineChromosome and lineGeneStart < currentGeneRangeEnd:
-                            
-                            currentGeneRangeEnd = lineGeneEnd
-                            if currentGeneRangeStrand is not None and currentGeneRangeStrand != lineStrand: currentGeneRangeStrand = None
-
-                        # If the don't overlap, check to make sure the strand designation for this region is unambiguous, then write it.
-                        # Also, keep in mind to expand the ranges by one bp on either side for trinucleotide context at the borders.
-                        else:
-
-                            if currentGeneRangeStrand is not None:
-                                clearGeneRangesFile.write('\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart - 1),
-                                                                     str(currentGeneRangeEnd + 1), '.', '.', currentGeneRangeStrand)) + '\n')
-                            
-                            # Don't forget to reset the chromosome variable to flag the rest for reassignment!
-                            currentGeneRangeChromosome = None
-
-
-                    # If we are starting to look at a new gene range, assign all the values from this line.
-                    if currentGeneRangeChromosome is None:
-                        currentGeneRangeChromosome = lineChromosome
-                        currentGeneRangeStart = lineGeneStart
-                        currentGeneRangeEnd = lineGeneEnd
-                        currentGeneRangeStrand = lineStrand
-
-                # Do one last check so we don't miss the last gene range.
-                if currentGeneRangeStrand is not None:
-                    clearGeneRangesFile.write('\t'.join((currentGeneRangeChromosome, str(currentGeneRangeStart - 1), 
-                                                         str(currentGeneRangeEnd + 1), '.', '.', currentGeneRangeStrand)) + '\n')
-
+        clearGeneRangesFilePath = writeClearGeneRanges(geneDesignationsFilePath)
 
         # Obtain trinucleotide counts for all the gene ranges.
 
-        # Generate the fasta file...
-        print("Generating fasta file...")
-        clearGeneRangeFastaFilePath = clearGeneRangesFilePath.rsplit('.',1)[0] + ".fa"
-        bedToFasta(clearGeneRangesFilePath, genomeFilePath, clearGeneRangeFastaFilePath)
-
-        # Iterate through the fasta file, counting trinucleotides.
-        print("Counting and writing trinucleotides...")
-        trinucleotideCountsNTS = dict()
-        trinucleotideCountsTS = dict()
-        with open(clearGeneRangeFastaFilePath, 'r') as clearGeneRangesFastaFile:
-            for fastaEntry in FastaFileIterator(clearGeneRangesFastaFile):
-
-                for i in range(0, len(fastaEntry.sequence) - 2):
-
-                    trinucleotide = fastaEntry.sequence[i:i+3]
-                    if isPurine(trinucleotide[1]):
-                        trinucleotide = reverseCompliment(trinucleotide)
-                        trinucleotideCountsTS[trinucleotide] = trinucleotideCountsTS.setdefault(trinucleotide, 0) + 1
-                    else: 
-                        trinucleotideCountsNTS[trinucleotide] = trinucleotideCountsNTS.setdefault(trinucleotide, 0) + 1
+        # Read the clear gene ranges directly from the genome...
+        if useGenomeIndex:
+            print("Counting and writing trinucleotides from the indexed genome...")
+            with instrumentStage("countTrinucleotideCodesInRanges", bedFilePath = clearGeneRangesFilePath,
+                                 genomeFilePath = genomeFilePath) as stage:
+                with IndexedFasta(genomeFilePath) as genome:
+                    trinucleotideCodeCounts = countTrinucleotideCodesInRanges(clearGeneRangesFilePath, genome)
+                stage.addRecords(int(trinucleotideCodeCounts.sum()))
+            trinucleotideCountsNTS, trinucleotideCountsTS = foldTrinucleotideCodeCounts(trinucleotideCodeCounts)
+
+        # Or generate the fasta file...
+        else:
+            # Only needed here, so that reading from the indexed genome doesn't depend on mutperiod.
+            from mutperiodpy.helper_scripts.UsefulBioinformaticsFunctions import (bedToFasta, reverseCompliment,
+                                                                                  FastaFileIterator, isPurine)
+            print("Generating fasta file...")
+            clearGeneRangeFastaFilePath = clearGeneRangesFilePath.rsplit('.',1)[0] + ".fa"
+            with instrumentStage("bedToFasta", bedFilePath = clearGeneRangesFilePath,
+                                 genomeFilePath = genomeFilePath) as stage:
+                bedToFasta(clearGeneRangesFilePath, genomeFilePath, clearGeneRangeFastaFilePath)
+                if stage.enabled:
+                    with open(clearGeneRangesFilePath, 'r') as clearGeneRangesFile:
+                        stage.addRecords(sum(1 for _ in clearGeneRangesFile))
+
+            # Iterate through the fasta file, counting trinucleotides.
+            print("Counting and writing trinucleotides...")
+            trinucleotideCountsNTS = dict()
+            trinucleotideCountsTS = dict()
+            with open(clearGeneRangeFastaFilePath, 'r') as clearGeneRangesFastaFile:
+
+                # With vectorized counting, sequences with bases that can't be encoded (e.g. soft-masked or IUPAC
+                # bases) are still counted one position at a time, so the counts are the same either way.
+                trinucleotideCodeCounts = np.zeros(TRINUCLEOTIDE_CODE_COUNT, dtype = np.int64)
+                for fastaEntry in FastaFileIterator(clearGeneRangesFastaFile):
+
+                    if useVectorizedCounting and hasOnlyEncodedBases(fastaEntry.sequence):
+                        trinucleotideCodeCounts += countEncodedTrinucleotides(fastaEntry.sequence)
+                        continue
+
+                    for i in range(0, len(fastaEntry.sequence) - 2):
+
+                        trinucleotide = fastaEntry.sequence[i:i+3]
+                        if isPurine(trinucleotide[1]):
+                            trinucleotide = reverseCompliment(trinucleotide)
+                            trinucleotideCountsTS[trinucleotide] = trinucleotideCountsTS.setdefault(trinucleotide, 0) + 1
+                        else: 
+                            trinucleotideCountsNTS[trinucleotide] = trinucleotideCountsNTS.setdefault(trinucleotide, 0) + 1
+
+                for countsByTrinucleotide, encodedCountsByTrinucleotide in zip(
+                    (trinucleotideCountsNTS, trinucleotideCountsTS), foldTrinucleotideCodeCounts(trinucleotideCodeCounts)):
+                    for trinucleotide, count in encodedCountsByTrinucleotide.items():
+                        countsByTrinucleotide[trinucleotide] = countsByTrinucleotide.setdefault(trinucleotide, 0) + count
 
         # Write the background trinucleotide counts to a separate file.
-        trinucleotideBackgroundCountsFilePath = clearGeneRangesFilePath.rsplit("clear_gene_ranges.bed",1)[0] + "background_gene_trinuc_counts.tsv"
-        
-        with open(trinucleotideBackgroundCountsFilePath, 'w') as trinucleotideBackgroundCountsFile:
+        trinucleotideBackgroundCountsFilePath = getTrinucleotideBackgroundCountsFilePath(clearGeneRangesFilePath)
+        writeTrinucleotideBackgroundCounts(trinucleotideBackgroundCountsFilePath, trinucleotideCountsNTS, trinucleotideCountsTS)
 
-            # Write the header
-            trinucleotideBackgroundCountsFile.write('\t'.join(("Trinucleotide", "NTS_Counts", "TS_Counts")) + '\n')
+        print()
 
-            # Write the counts.
 
-            for trinucleotide in sorted(trinucleotideCountsNTS.keys() | trinucleotideCountsTS.keys(), key = lambda x: x[1] + x):
+# Runs generateGeneBackground non-interactively with the given command line arguments.
+def runFromCommandLine(arguments):
 
-                trinucleotideBackgroundCountsFile.write('\t'.join((trinucleotide, str(trinucleotideCountsNTS.setdefault(trinucleotide, 0)),
-                                                                   str(trinucleotideCountsTS.setdefault(trinucleotide, 0)))) + '\n')
+    parser = argparse.ArgumentParser(description = "Count background trinucleotides in the given sets of gene designations.")
+    parser.add_argument("geneDesignationsFilePaths", nargs = '+', metavar = "gene_designations_file",
+                        help = "Gene designations bed files (ending in gene_designations.bed)")
+    parser.add_argument("-G", "--genome", required = True, dest = "genomeFilePath", metavar = "FILE",
+                        help = "Genome fasta file")
+    parser.add_argument("--vectorized", action = "store_true", help = "Use vectorized trinucleotide counting")
+    parser.add_argument("--genome-index", action = "store_true", help = "Read gene ranges directly from indexed genome")
+    parser.add_argument("--single-genome-pass", action = "store_true",
+                        help = "Count all gene designation sets in a single genome pass")
+    args = parser.parse_args(arguments)
 
-        print()
+    generateGeneBackground(args.geneDesignationsFilePaths, args.genomeFilePath, args.vectorized,
+                           args.genome_index, args.single_genome_pass)
 
 
 def main():
 
+    # Given any command line arguments, run without the UI.
+    if len(sys.argv) > 1: return runFromCommandLine(sys.argv[1:])
+
+    from mutperiodpy.Tkinter_scripts.TkinterDialog import TkinterDialog
+
     # Create a simple dialog for selecting the gene expression file.
     dialog = TkinterDialog(workingDirectory=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
     dialog.createMultipleFileSelector("Gene Designations Files", 0, "gene_designations.bed", ("Text File", ".bed"))
     dialog.createFileSelector("Genome Fasta File", 1, ("Fasta File", ".fa"))
+    dialog.createCheckbox("Use vectorized trinucleotide counting", 2, 0)
+    dialog.createCheckbox("Read gene ranges directly from indexed genome", 3, 0)
+    dialog.createCheckbox("Count all gene designation sets in a single genome pass", 4, 0)
     dialog.mainloop()
 
     if dialog.selections is None: quit()
 
     # Retrieve the selections and pass the relevant arguments to the primary function.
-    generateGeneBackground(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0])
+    generateGeneBackground(dialog.selections.getFilePathGroups()[0], dialog.selections.getIndividualFilePaths()[0],
+                           *dialog.selections.getToggleStates()[:3])
 
 
 if __name__ == "__main__": main()
\ No newline at end of file
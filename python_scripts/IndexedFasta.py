@@ -0,0 +1,116 @@
+# This script provides random access to the sequences in a fasta file (e.g. a genome) through a memory map and a
+# ".fai" index in the same format used by samtools and bedtools.  The index is built if it doesn't already exist.
+
+import os, mmap
+import numpy as np
+from typing import Dict
+
+
+# Stores the information for a single sequence in a fasta index.
+class FastaIndexEntry:
+
+    def __init__(self, name, length, offset, lineBases, lineWidth):
+
+        self.name = name
+        self.length = length # The number of bases in the sequence.
+        self.offset = offset # The byte offset of the sequence's first base.
+        self.lineBases = lineBases # The number of bases on each line.
+        self.lineWidth = lineWidth # The number of bytes on each line, including the newline character(s).
+
+
+# Reads through the given fasta file and writes a ".fai" index for it.
+def buildFastaIndex(fastaFilePath, fastaIndexFilePath):
+
+    print("Indexing",os.path.basename(fastaFilePath))
+
+    indexEntries = list()
+    currentEntry: FastaIndexEntry = None
+    lastLineWasShort = False # Only the last line of a sequence may have fewer bases than the rest.
+
+    with open(fastaFilePath, 'rb') as fastaFile:
+
+        offset = 0
+        for line in fastaFile:
+
+            if line.startswith(b'>'):
+                currentEntry = FastaIndexEntry(line[1:].split()[0].decode(), 0, offset + len(line), None, None)
+                indexEntries.append(currentEntry)
+                lastLineWasShort = False
+
+            elif currentEntry is not None and len(line.strip()) > 0:
+
+                lineBases = len(line.rstrip(b'\r\n'))
+                if currentEntry.lineBases is None:
+                    currentEntry.lineBases = lineBases
+                    currentEntry.lineWidth = len(line)
+                elif lastLineWasShort or lineBases > currentEntry.lineBases or len(line) - lineBases != currentEntry.lineWidth - currentEntry.lineBases:
+                    raise ValueError("Inconsistent line lengths in sequence " + currentEntry.name + " of " + fastaFilePath)
+
+                lastLineWasShort = lineBases < currentEntry.lineBases
+                currentEntry.length += lineBases
+
+            offset += len(line)
+
+    with open(fastaIndexFilePath, 'w') as fastaIndexFile:
+        for indexEntry in indexEntries:
+            fastaIndexFile.write('\t'.join((indexEntry.name, str(indexEntry.length), str(indexEntry.offset),
+                                            str(indexEntry.lineBases or 0), str(indexEntry.lineWidth or 0))) + '\n')
+
+
+# Opens a fasta file for random access to its sequences.  Use as a context manager so the memory map is closed.
+class IndexedFasta:
+
+    def __init__(self, fastaFilePath):
+
+        self.fastaFilePath = fastaFilePath
+        fastaIndexFilePath = fastaFilePath + ".fai"
+
+        # Build the index if it is missing or out of date.
+        if (not os.path.exists(fastaIndexFilePath) or
+            os.path.getmtime(fastaIndexFilePath) < os.path.getmtime(fastaFilePath)):
+            buildFastaIndex(fastaFilePath, fastaIndexFilePath)
+
+        self.indexEntries: Dict[str, FastaIndexEntry] = dict()
+        with open(fastaIndexFilePath, 'r') as fastaIndexFile:
+            for line in fastaIndexFile:
+                choppedUpLine = line.strip().split('\t')
+                self.indexEntries[choppedUpLine[0]] = FastaIndexEntry(choppedUpLine[0], *(int(field) for field in choppedUpLine[1:5]))
+
+        self.fastaFile = open(fastaFilePath, 'rb')
+        self.fastaMap = mmap.mmap(self.fastaFile.fileno(), 0, access = mmap.ACCESS_READ)
+
+
+    def __enter__(self): return self
+
+    def __exit__(self, type, value, traceback): self.close()
+
+    def close(self):
+        # The memory map can't be closed while arrays from getSequenceArray still point into it.
+        # In that case, it is closed when those arrays are garbage collected.
+        try: self.fastaMap.close()
+        except BufferError: pass
+        self.fastaFile.close()
+
+
+    # Returns the length of the given sequence.
+    def getSequenceLength(self, sequenceName):
+        return self.indexEntries[sequenceName].length
+
+
+    # Returns the bases from the given 0-based, half-open range of the given sequence as an array of ASCII codes.
+    # The range is read straight out of the memory map, and a copy is only made to drop line breaks
+    # when the range spans more than one line.
+    def getSequenceArray(self, sequenceName, start, end) -> np.ndarray:
+
+        indexEntry = self.indexEntries[sequenceName]
+        if start < 0 or end > indexEntry.length or start > end:
+            raise ValueError("Range " + str(start) + '-' + str(end) + " is outside of " + sequenceName +
+                             " (length " + str(indexEntry.length) + ')')
+        if start == end: return np.empty(0, dtype = np.uint8)
+
+        byteStart = indexEntry.offset + (start // indexEntry.lineBases)*indexEntry.lineWidth + start % indexEntry.lineBases
+        byteEnd = indexEntry.offset + ((end - 1) // indexEntry.lineBases)*indexEntry.lineWidth + (end - 1) % indexEntry.lineBases + 1
+        sequenceBytes = np.frombuffer(self.fastaMap, dtype = np.uint8, count = byteEnd - byteStart, offset = byteStart)
+
+        if byteEnd - byteStart == end - start: return sequenceBytes
+        else: return sequenceBytes[(sequenceBytes != ord('\n')) & (sequenceBytes != ord('\r'))]
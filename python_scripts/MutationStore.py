@@ -0,0 +1,196 @@
+# This script contains the MutationStore, a columnar, binary form of a sorted mutation bed file which can be
+# memory-mapped with NumPy instead of being parsed line by line.
+# A store is a directory holding one .npy file per column and a metadata.json file:
+#   chromosomes.npy:  Small integer codes for each mutation's chromosome
+#   positions.npy:  The 0-based position of each mutation (int32)
+#   contexts.npy:  Small integer codes for each mutation's context (the reference and alternate bases, "ref>alt")
+#   strands.npy:  Small integer codes for each mutation's strand
+#   cohorts.npy:  Small integer codes for each mutation's cohort (e.g. genotype), if the bed file has a cohort column
+# Each set of codes indexes into the corresponding list of names in metadata.json.  Names are listed in sorted order,
+# so the chromosome codes of a sorted bed file are sorted as well.
+# NOTE:  Only single base mutations (end position = start position + 1) can be stored.
+
+import os, json, shutil
+import numpy as np
+from typing import List
+from BgzfFiles import openTextFileForReading
+from GeneAnnotationIndex import getFileHash
+
+# Increment this whenever the layout of the store changes so that old stores are rebuilt.
+STORE_FORMAT_VERSION = 1
+
+MUTATION_STORE_EXTENSION = ".mutation_store"
+
+# The names of the columns whose values are stored as codes, paired with the names of their lists in the metadata.
+CODED_COLUMN_NAMES = (("chromosomes", "chromosomeNames"), ("contexts", "contextNames"),
+                      ("strands", "strandNames"), ("cohorts", "cohortNames"))
+
+
+# Returns the smallest unsigned integer type that can hold the given number of distinct codes.
+def getCodeType(codeCount):
+    for codeType in (np.uint8, np.uint16, np.uint32):
+        if codeCount <= np.iinfo(codeType).max + 1: return codeType
+    raise ValueError("Too many distinct values to encode: " + str(codeCount))
+
+
+# Returns the sorted, distinct values in the given list of strings and the code for each string.
+def encodeValues(values: List[str]):
+    names, codes = np.unique(np.array(values, dtype = str), return_inverse = True)
+    return names.tolist(), codes.astype(getCodeType(len(names)))
+
+
+# Returns the path to the mutation store kept alongside the given bed file.
+def getMutationStorePath(bedFilePath):
+    if bedFilePath.endswith(".gz"): bedFilePath = bedFilePath[:-3]
+    return os.path.splitext(bedFilePath)[0] + MUTATION_STORE_EXTENSION
+
+
+# Returns whether or not the given path is a mutation store.
+def isMutationStore(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, "metadata.json"))
+
+
+# Writes the given mutation columns to a new mutation store at the given directory, replacing any existing store.
+# Any extra metadata (e.g. information on the source file) can be passed as a dictionary.
+def writeMutationStore(storeDirectory, chromosomes: List[str], positions, contexts: List[str], strands: List[str],
+                       cohorts: List[str] = None, extraMetadata = None):
+
+    positions = np.asarray(positions, dtype = np.int64)
+    if len(positions) > 0 and (positions.min() < 0 or positions.max() > np.iinfo(np.int32).max):
+        raise ValueError("Mutation positions must fit in 32 bits to be stored.")
+
+    metadata = {"formatVersion": STORE_FORMAT_VERSION, "mutationCount": len(positions)}
+    if extraMetadata is not None: metadata.update(extraMetadata)
+    columns = {"positions": positions.astype(np.int32)}
+
+    for (columnName, namesKey), values in zip(CODED_COLUMN_NAMES, (chromosomes, contexts, strands, cohorts)):
+        if values is None: metadata[namesKey] = None
+        else:
+            if len(values) != len(positions): raise ValueError("Mismatched lengths for " + columnName + " column.")
+            metadata[namesKey], columns[columnName] = encodeValues(values)
+
+    # Write to a temporary directory first so that an interrupted run never leaves a partial store behind.
+    temporaryStoreDirectory = storeDirectory + ".tmp"
+    if os.path.exists(temporaryStoreDirectory): shutil.rmtree(temporaryStoreDirectory)
+    os.makedirs(temporaryStoreDirectory)
+
+    for columnName, column in columns.items():
+        np.save(os.path.join(temporaryStoreDirectory, columnName + ".npy"), column)
+    with open(os.path.join(temporaryStoreDirectory, "metadata.json"), 'w') as metadataFile:
+        json.dump(metadata, metadataFile)
+
+    if os.path.exists(storeDirectory): shutil.rmtree(storeDirectory)
+    os.replace(temporaryStoreDirectory, storeDirectory)
+
+
+# Reads the given sorted mutation bed file (plain text or gzipped) and writes its contents to the given mutation store.
+# The source file's size, modification time, and hash are recorded so that outdated stores can be found later.
+def convertBedToMutationStore(bedFilePath, storeDirectory):
+
+    print("Converting",os.path.basename(bedFilePath),"to a mutation store")
+
+    chromosomes = list(); positions = list(); contexts = list(); strands = list(); cohorts = list()
+    with openTextFileForReading(bedFilePath) as bedFile:
+        for line in bedFile:
+
+            choppedUpLine = line.split()
+            if int(choppedUpLine[2]) != int(choppedUpLine[1]) + 1:
+                raise ValueError("Only single base mutations can be stored, but found " + line.strip() +
+                                 " in " + bedFilePath)
+
+            chromosomes.append(choppedUpLine[0])
+            positions.append(int(choppedUpLine[1]))
+            contexts.append(choppedUpLine[3] + '>' + choppedUpLine[4])
+            strands.append(choppedUpLine[5])
+            if len(choppedUpLine) > 6: cohorts.append(choppedUpLine[6])
+
+    if len(cohorts) != len(positions):
+        if len(cohorts) > 0: raise ValueError("Some, but not all, mutations have a cohort in " + bedFilePath)
+        cohorts = None
+
+    bedFileStats = os.stat(bedFilePath)
+    writeMutationStore(storeDirectory, chromosomes, positions, contexts, strands, cohorts,
+                       {"sourceSize": bedFileStats.st_size, "sourceMTime": bedFileStats.st_mtime_ns,
+                        "sourceHash": getFileHash(bedFilePath)})
+
+
+# Makes sure the mutation store alongside the given bed file exists and is up to date with it,
+# converting the bed file if necessary.  Returns the path to the store.
+def updateMutationStore(bedFilePath):
+
+    storeDirectory = getMutationStorePath(bedFilePath)
+
+    if isMutationStore(storeDirectory):
+        with open(os.path.join(storeDirectory, "metadata.json"), 'r') as metadataFile: metadata = json.load(metadataFile)
+        bedFileStats = os.stat(bedFilePath)
+        if (metadata.get("formatVersion") == STORE_FORMAT_VERSION and metadata.get("sourceSize") == bedFileStats.st_size and
+            (metadata.get("sourceMTime") == bedFileStats.st_mtime_ns or
+             metadata.get("sourceHash") == getFileHash(bedFilePath))):
+            return storeDirectory
+
+    convertBedToMutationStore(bedFilePath, storeDirectory)
+    return storeDirectory
+
+
+# Opens a mutation store, memory-mapping each of its columns.
+class MutationStore:
+
+    def __init__(self, storeDirectory):
+
+        self.storeDirectory = storeDirectory
+
+        with open(os.path.join(storeDirectory, "metadata.json"), 'r') as metadataFile: self.metadata = json.load(metadataFile)
+        if self.metadata.get("formatVersion") != STORE_FORMAT_VERSION:
+            raise ValueError("Unsupported mutation store format in " + storeDirectory)
+
+        self.positions: np.ndarray = self.loadColumn("positions")
+        self.chromosomeNames: List[str] = self.metadata["chromosomeNames"]
+        self.chromosomeCodes: np.ndarray = self.loadColumn("chromosomes")
+        self.contextNames: List[str] = self.metadata["contextNames"]
+        self.contextCodes: np.ndarray = self.loadColumn("contexts")
+        self.strandNames: List[str] = self.metadata["strandNames"]
+        self.strandCodes: np.ndarray = self.loadColumn("strands")
+        self.cohortNames: List[str] = self.metadata["cohortNames"] # None if there are no cohorts
+        self.cohortCodes: np.ndarray = None if self.cohortNames is None else self.loadColumn("cohorts")
+
+
+    # Memory-maps the given column.
+    def loadColumn(self, columnName):
+        return np.load(os.path.join(self.storeDirectory, columnName + ".npy"), mmap_mode = 'r')
+
+    def __len__(self): return len(self.positions)
+
+
+    # Returns the given coded values (optionally only those in the given range of mutations) as an array of strings.
+    @staticmethod
+    def decodeValues(names: List[str], codes: np.ndarray, rowRange = None):
+        if rowRange is not None: codes = codes[rowRange[0]:rowRange[1]]
+        return np.array(names, dtype = str)[codes]
+
+    def getChromosomes(self, rowRange = None): return self.decodeValues(self.chromosomeNames, self.chromosomeCodes, rowRange)
+    def getContexts(self, rowRange = None): return self.decodeValues(self.contextNames, self.contextCodes, rowRange)
+    def getStrands(self, rowRange = None): return self.decodeValues(self.strandNames, self.strandCodes, rowRange)
+    def getCohorts(self, rowRange = None):
+        if self.cohortNames is None: return None
+        return self.decodeValues(self.cohortNames, self.cohortCodes, rowRange)
+
+
+    # Splits the store into ranges of rows, one for each of the given chromosomes, just like getChromosomeByteRanges
+    # in CountInTranscribedRegions does for bed files.  (Relies on the store being sorted.)
+    def getChromosomeRowRanges(self, chromosomes):
+
+        firstCodes = np.searchsorted(np.array(self.chromosomeNames, dtype = str), sorted(chromosomes))
+        boundaries = [0] + np.searchsorted(self.chromosomeCodes, firstCodes, side = "left").tolist() + [len(self)]
+        return [(start, end) for start, end in zip(boundaries[:-1], boundaries[1:]) if start < end]
+
+
+    # Writes the mutations in the store back out as a bed file.
+    def writeBedFile(self, bedFilePath):
+
+        columns = [self.getChromosomes(), self.positions.astype(str), (self.positions.astype(np.int64) + 1).astype(str),
+                   *np.char.partition(self.getContexts(), '>')[:,(0,2)].T, self.getStrands()]
+        if self.cohortNames is not None: columns.append(self.getCohorts())
+
+        with open(bedFilePath, 'w') as bedFile:
+            for choppedUpLine in zip(*(column.tolist() for column in columns)):
+                bedFile.write('\t'.join(choppedUpLine) + '\n')
@@ -1,35 +1,146 @@
-import os, subprocess
+import os
+import numpy as np
+from typing import List, Iterable
+from BedSorting import sortBedLines
 
-# Get the relevant paths for the input and output files.
-dataDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"data")
-geneDesignationsToParseFilePath = os.path.join(dataDirectory,"C_elegans_gene_designations.tsv")
-geneDesignationsParsedFilePath = os.path.join(dataDirectory,"C_elegans_gene_designations.bed")
-geneNamesFilePath = os.path.join(dataDirectory, "C_elegans_gene_names.txt")
+# Increment this whenever the layout of the gene name index changes so that old indices are ignored.
+GENE_NAME_INDEX_FORMAT_VERSION = 1
 
-# Iterate through the file, recording gene position, names (there are 2), and strand.
-with open(geneDesignationsToParseFilePath, 'r') as geneDesignationsToParseFile:
+# The columns of the parsed gene designations bed file holding each gene's names.
+NAME_COLUMN = 3
+OTHER_NAME_COLUMN = 4
+
+
+# Reads the given gene designations table and returns a bed line for each gene's position, names (there are 2),
+# and strand, along with the list of each gene's other name.  (The bed lines are in the same order as the table.)
+def readGeneDesignationsToParse(geneDesignationsToParseFilePath):
+
+    geneDesignationLines: List[str] = list()
+    geneNames: List[str] = list()
+
+    # Iterate through the file, recording gene position, names (there are 2), and strand.
+    with open(geneDesignationsToParseFilePath, 'r') as geneDesignationsToParseFile:
+
+        geneDesignationsToParseFile.readline()
+
+        for line in geneDesignationsToParseFile:
+
+            choppedUpLine = line.strip().split('\t')
+
+            chromosome = choppedUpLine[2]
+            # I'm not actually sure if the designations in this file are 0- or 1-based.
+            # I'm just assuming they are 1-based for now.,
+            startPos0Based = str(int(choppedUpLine[4]) - 1)
+            EndPos1Based = choppedUpLine[5]
+            name = choppedUpLine[1]
+            otherName = choppedUpLine[12]
+            strand = choppedUpLine[3]
+
+            geneDesignationLines.append('\t'.join((chromosome,startPos0Based,EndPos1Based,
+                                                   name, otherName, strand)) + '\n')
+            geneNames.append(otherName)
+
+    return geneDesignationLines, geneNames
+
+
+# Returns the path to the gene name index for the given parsed gene designations bed file.
+def getGeneNameIndexFilePath(geneDesignationsParsedFilePath):
+    return geneDesignationsParsedFilePath + ".name_index.npz"
+
+
+# Writes an index of the byte offset of each line in the given parsed gene designations bed file, keyed by both of
+# the gene's names, so that lines can be read for specific genes without scanning the whole file.
+# The index records the bed file's size and modification time so that readers can tell when it is out of date.
+def writeGeneNameIndex(geneDesignationsParsedFilePath):
+
+    names = list()
+    nameColumns = list()
+    lineOffsets = list()
+
+    with open(geneDesignationsParsedFilePath, 'rb') as geneDesignationsParsedFile:
+        lineOffset = 0
+        for line in geneDesignationsParsedFile:
+            choppedUpLine = line.strip().split(b'\t')
+            for nameColumn in (NAME_COLUMN, OTHER_NAME_COLUMN):
+                if len(choppedUpLine) <= nameColumn: continue
+                names.append(choppedUpLine[nameColumn].decode())
+                nameColumns.append(nameColumn)
+                lineOffsets.append(lineOffset)
+            lineOffset += len(line)
+
+    # Sort the index by name so that readers can binary search it.
+    names = np.array(names, dtype = str)
+    nameOrder = np.argsort(names, kind = "stable")
+    geneDesignationsFileStats = os.stat(geneDesignationsParsedFilePath)
+
+    # Write to a temporary file first so that an interrupted run never leaves a partial index behind.
+    geneNameIndexFilePath = getGeneNameIndexFilePath(geneDesignationsParsedFilePath)
+    temporaryIndexFilePath = geneNameIndexFilePath + ".tmp"
+    with open(temporaryIndexFilePath, 'wb') as temporaryIndexFile:
+        np.savez(temporaryIndexFile, formatVersion = GENE_NAME_INDEX_FORMAT_VERSION,
+                 sourceSize = geneDesignationsFileStats.st_size, sourceMTime = geneDesignationsFileStats.st_mtime_ns,
+                 names = names[nameOrder], nameColumns = np.array(nameColumns, dtype = np.uint8)[nameOrder],
+                 lineOffsets = np.array(lineOffsets, dtype = np.int64)[nameOrder])
+    os.replace(temporaryIndexFilePath, geneNameIndexFilePath)
+
+
+# Returns the lines from the given parsed gene designations bed file for the given gene names, in file order, using
+# its gene name index.  Names are matched against the given name column (NAME_COLUMN or OTHER_NAME_COLUMN),
+# or either column if nameColumn is None.
+# Returns None if there is no index, or if the bed file has changed since it was written.
+def readIndexedGeneDesignationLines(geneDesignationsParsedFilePath, geneNames: Iterable[str], nameColumn = None):
+
+    geneNameIndexFilePath = getGeneNameIndexFilePath(geneDesignationsParsedFilePath)
+    if not os.path.exists(geneNameIndexFilePath): return None
+
+    geneDesignationsFileStats = os.stat(geneDesignationsParsedFilePath)
+    with np.load(geneNameIndexFilePath, allow_pickle = False) as geneNameIndex:
+        if (int(geneNameIndex["formatVersion"]) != GENE_NAME_INDEX_FORMAT_VERSION or
+            int(geneNameIndex["sourceSize"]) != geneDesignationsFileStats.st_size or
+            int(geneNameIndex["sourceMTime"]) != geneDesignationsFileStats.st_mtime_ns): return None
+        names, nameColumns, lineOffsets = (geneNameIndex["names"], geneNameIndex["nameColumns"],
+                                           geneNameIndex["lineOffsets"])
+
+    # Find the (sorted) index entries for each of the given names.
+    geneNames = np.unique(np.array(list(geneNames), dtype = str))
+    firstEntries = np.searchsorted(names, geneNames, side = "left")
+    entryCounts = np.searchsorted(names, geneNames, side = "right") - firstEntries
+    matchingEntries = (np.repeat(firstEntries - np.cumsum(entryCounts) + entryCounts, entryCounts) +
+                       np.arange(entryCounts.sum()))
+    if nameColumn is not None: matchingEntries = matchingEntries[nameColumns[matchingEntries] == nameColumn]
+
+    lines = list()
+    with open(geneDesignationsParsedFilePath, 'rb') as geneDesignationsParsedFile:
+        for lineOffset in np.unique(lineOffsets[matchingEntries]).tolist():
+            geneDesignationsParsedFile.seek(lineOffset)
+            lines.append(geneDesignationsParsedFile.readline().decode())
+    return lines
+
+
+# Parses the given gene designations table into a gene designations bed file, sorted by chromosome and then start
+# position, along with a file of gene names and an index of the bed file's lines by gene name.
+def parseGeneDesignations(geneDesignationsToParseFilePath, geneDesignationsParsedFilePath, geneNamesFilePath):
+
+    geneDesignationLines, geneNames = readGeneDesignationsToParse(geneDesignationsToParseFilePath)
+
+    # NOTE: sortBedLines gives the same order as "sort -k1,1 -k2,3n" in the C locale.
     with open(geneDesignationsParsedFilePath, 'w') as geneDesignationsParsedFile:
-        with open(geneNamesFilePath, 'w') as geneNamesFile:
+        geneDesignationsParsedFile.writelines(sortBedLines(geneDesignationLines))
+    with open(geneNamesFilePath, 'w') as geneNamesFile:
+        for geneName in geneNames: geneNamesFile.write(geneName + '\n')
+
+    writeGeneNameIndex(geneDesignationsParsedFilePath)
 
-            geneDesignationsToParseFile.readline()
 
-            for line in geneDesignationsToParseFile:
+def main():
 
-                choppedUpLine = line.strip().split('\t')
+    # Get the relevant paths for the input and output files.
+    dataDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"data")
+    geneDesignationsToParseFilePath = os.path.join(dataDirectory,"C_elegans_gene_designations.tsv")
+    geneDesignationsParsedFilePath = os.path.join(dataDirectory,"C_elegans_gene_designations.bed")
+    geneNamesFilePath = os.path.join(dataDirectory, "C_elegans_gene_names.txt")
 
-                chromosome = choppedUpLine[2]
-                # I'm not actually sure if the designations in this file are 0- or 1-based.  
-                # I'm just assuming they are 1-based for now.,
-                startPos0Based = str(int(choppedUpLine[4]) - 1)
-                EndPos1Based = choppedUpLine[5]
-                name = choppedUpLine[1]
-                otherName = choppedUpLine[12]
-                strand = choppedUpLine[3]
+    parseGeneDesignations(geneDesignationsToParseFilePath, geneDesignationsParsedFilePath, geneNamesFilePath)
 
-                geneDesignationsParsedFile.write('\t'.join((chromosome,startPos0Based,EndPos1Based,
-                                                            name, otherName, strand)) + '\n')
-                geneNamesFile.write(otherName + '\n')
 
-# Sort the resulting output file on 
-subprocess.run(" ".join(("sort","-k1,1","-k2,3n",geneDesignationsParsedFilePath,
-                         "-o",geneDesignationsParsedFilePath)), shell = True, check = True)
\ No newline at end of file
+if __name__ == "__main__": main()
@@ -1,18 +1,25 @@
-import os, subprocess
+import os, sys, json, argparse, tempfile, warnings
+from contextlib import nullcontext
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+from BedSorting import sortBedLines, mergeSortedBedFiles, DEFAULT_MAX_CHUNK_SIZE
+from BgzfFiles import openTextFileForReading, openBgzfFileForWriting, DEFAULT_THREADS
+from GeneAnnotationIndex import getFileHash
+from MutationStore import updateMutationStore
+from StageInstrumentation import instrumentStage
 
-def main():
-    
-    # Specify relevant paths to be accessed later.
-    dataDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"data")
-    SNVDirectory = os.path.join(dataDirectory, "Filtered_VCFS_all_text", "SNV")
-    sampleInfoFilePath = os.path.join(dataDirectory, "sample_info.csv")
+# Increment this whenever the layout of the ingestion manifest changes so that samples are re-ingested.
+MANIFEST_FORMAT_VERSION = 1
+
+
+# Reads the sample info csv file and returns two dictionaries with sample IDs as keys:
+# one for each sample's genotype and one for each sample's mutagen.
+def readSampleInfo(sampleInfoFilePath):
 
-    genotypes = set() # A hash to keep track of all unique genotypes.
     genotypesBySample = dict() # A dictionary of genotypes with sample IDs as keys.
-    mutagens = set() # A hash to keep track of all unique mutagens used.
     mutagensBySample = dict() # A dictionary of mutagens with sample IDs as keys
 
-
     # Get information on samples from the csv file.
     with open(sampleInfoFilePath, 'r') as sampleInfoFile:
 
@@ -32,67 +39,263 @@ def main():
             genotype = genotype.replace(' ','').replace('(','_').replace(')','')
             mutagen = choppedUpLine[4]
             mutagen = mutagen.replace('/','+')
-            
+
 
             assert sample not in genotypesBySample, "Duplicate sample found: " + sample
             genotypesBySample[sample] = genotype
-            genotypes.add(genotype)
             mutagensBySample[sample] = mutagen
-            mutagens.add(mutagen)
+
+    return genotypesBySample, mutagensBySample
+
+
+# Reads through the given VCF file (plain text, gzipped, or BGZF compressed) and returns every mutation as a bed line,
+# sorted and joined into a single string (which is cheap to pass back from a worker process).
+# Genotype information is stored in each mutation line as the "cohort"
+# (This section could be modified in the future to retrieve more specific information on mutations if need be.)
+def parseVCFSample(VCFFilePath, genotype, decompressionThreads = DEFAULT_THREADS) -> str:
+
+    bedLines = list()
+
+    with openTextFileForReading(VCFFilePath, decompressionThreads) as VCFFile:
+
+        for line in VCFFile:
+
+            # Skip header lines.
+            if line.startswith('#'): continue
+
+            # Format the mutation for bed file format.
+            choppedUpLine = line.strip().split('\t')
+            chromosome = "chr"+choppedUpLine[0]
+            mutationPos0Based = str(int(choppedUpLine[1]) - 1)
+            mutationPos1Based = choppedUpLine[1]
+            referenceBase = choppedUpLine[3]
+            alternateBase = choppedUpLine[4]
+            strand = '+'
+
+            bedLines.append('\t'.join( (chromosome,mutationPos0Based,mutationPos1Based,
+                                        referenceBase, alternateBase, strand, genotype) ) + '\n' )
+
+    return ''.join(sortBedLines(bedLines))
+
+
+# Returns a manifest with no samples or output files in it.
+def getEmptyIngestionManifest():
+    return {"formatVersion": MANIFEST_FORMAT_VERSION, "samples": dict(), "outputFiles": dict()}
+
+
+# Returns a manifest of the samples ingested on a previous run (an empty one if there is no usable manifest).
+def readIngestionManifest(manifestFilePath):
+
+    emptyManifest = getEmptyIngestionManifest()
+    if not os.path.exists(manifestFilePath): return emptyManifest
+
+    try:
+        with open(manifestFilePath, 'r') as manifestFile: manifest = json.load(manifestFile)
+    except (OSError, ValueError):
+        warnings.warn("Unable to read ingestion manifest at " + manifestFilePath + ".  Re-ingesting all samples.")
+        return emptyManifest
+
+    if manifest.get("formatVersion") != MANIFEST_FORMAT_VERSION: return emptyManifest
+    return manifest
+
+
+# Writes the given manifest, replacing any previous one only once it has been written completely.
+def writeIngestionManifest(manifest, manifestFilePath):
+
+    with open(manifestFilePath + ".tmp", 'w') as manifestFile: json.dump(manifest, manifestFile, indent = 1)
+    os.replace(manifestFilePath + ".tmp", manifestFilePath)
+
+
+# Returns whether or not the given sample's sorted shard from a previous run can be reused as is.
+# The VCF file's size and modification time are checked first, followed by its content hash if they differ.
+# (In the latter case, the sample entry is given the previous hash so the check is quick next time.)
+def isSampleShardCurrent(previousSampleEntry, sampleEntry, VCFFilePath, shardFilePath):
+
+    if previousSampleEntry is None or not os.path.exists(shardFilePath): return False
+    if (previousSampleEntry["genotype"] != sampleEntry["genotype"] or
+        previousSampleEntry["mutagen"] != sampleEntry["mutagen"]): return False
+
+    if (previousSampleEntry["size"] == sampleEntry["size"] and
+        previousSampleEntry["mTime"] == sampleEntry["mTime"]):
+        sampleEntry["hash"] = previousSampleEntry["hash"]
+        return True
+
+    if previousSampleEntry["size"] != sampleEntry["size"]: return False
+    sampleEntry["hash"] = getFileHash(VCFFilePath)
+    return sampleEntry["hash"] == previousSampleEntry["hash"]
 
 
-    mutagenFilePathsByGenotype = dict() # A dictionary of bed file paths with genotypes as keys.
-    mutagenFilesByGenotype = dict() # A dictionary of bed files with genotypes as keys.
+# Converts every VCF file in the SNV directory to bed format and combines them into one sorted file per mutagen.
+# Each sample is sorted in memory into a sorted run, and the runs for each mutagen are then heap merged straight into
+# that mutagen's output file.  Runs are kept in memory for the merge until they total more than maxInMemoryRunSize
+# bytes of text, after which any further runs are written to disk and read back for the merge.
+# Returns a dictionary of output file paths with mutagens as keys.
+# If more than one worker is requested, samples are parsed and sorted in parallel worker processes, 
+# while the sorted runs are still stored and merged from this process.
+# If compressOutput is True, the output files are BGZF compressed (and given a ".gz" extension).
+# If incremental is True, each sample's sorted run is kept in the output directory as a shard, along with a manifest
+# of the VCF files and sample info they came from.  Then, only new or changed samples are parsed on later runs, 
+# and only the mutagens they (or any removed samples) belong to are merged again.  (Unchanged samples' shards are
+# read back for the merge, but newly parsed samples are still merged from memory when they fit.)
+# If writeMutationStores is True, a memory-mappable mutation store is also kept up to date alongside each output file.
+def parseVCFsForMutperiod(SNVDirectory, sampleInfoFilePath, outputDirectory, workers = 1,
+                          compressOutput = False, incremental = False, writeMutationStores = False,
+                          maxInMemoryRunSize = DEFAULT_MAX_CHUNK_SIZE) -> Dict[str, str]:
 
-    # For every mutagen, create a file to store mutations in.
-    # Genotype information is stored in each mutation line as the "cohort"
-    for mutagen in mutagens:
+    genotypesBySample, mutagensBySample = readSampleInfo(sampleInfoFilePath)
 
-        mutagenFileDirectory = os.path.join(dataDirectory, "C_elegans_bed_SNVs_for_mutperiod", mutagen)
+    if not os.path.exists(outputDirectory): os.makedirs(outputDirectory)
+
+    mutagenFilePathsByMutagen = dict() # A dictionary of bed file paths with mutagens as keys.
+    runFilePathsByMutagen: Dict[str, List[str]] = dict() # A dictionary of sorted sample runs with mutagens as keys.
+    inMemoryRunsByFilePath: Dict[str, str] = dict() # The sorted runs held in memory, keyed by the run file path they replace.
+
+    # For every mutagen, prepare a file to store mutations in.
+    for mutagen in set(mutagensBySample.values()):
+
+        mutagenFileDirectory = os.path.join(outputDirectory, mutagen)
         if not os.path.exists(mutagenFileDirectory): os.makedirs(mutagenFileDirectory)
-        mutagenFilePath = os.path.join(mutagenFileDirectory, mutagen+"_custom_input.bed")
-        mutagenFile = open(mutagenFilePath, 'w')
-        mutagenFilePathsByGenotype[mutagen] = mutagenFilePath
-        mutagenFilesByGenotype[mutagen] = mutagenFile
-        
-
-    # Loop through the SNV directory for each of the vcf files within.
-    for VCFFileName in os.listdir(SNVDirectory):
-
-        # Make sure this file has an acceptable sample ID.  (If not, something is wrong...)
-        sampleName = VCFFileName.split('_')[0]
-        assert sampleName in mutagensBySample, "Unknown sample: " + sampleName + " found."
-        print("Writing mutations for sample:", sampleName)
-
-        # Read through the VCF file, counting every mutation line.  
-        # (This section could be modified in the future to retrieve more specific information on mutations if need be.)
-        with open(os.path.join(SNVDirectory,VCFFileName), 'r') as VCFFile:
-
-            mutagen = mutagensBySample[sampleName]
-            genotype = genotypesBySample[sampleName]
-
-            for line in VCFFile:
-
-                # Skip header lines.
-                if line.startswith('#'): continue
-
-                # Format the mutation for bed file format, and output it to the respective bed file.
-                choppedUpLine = line.strip().split('\t')
-                chromosome = "chr"+choppedUpLine[0]
-                mutationPos0Based = str(int(choppedUpLine[1]) - 1)
-                mutationPos1Based = choppedUpLine[1]
-                referenceBase = choppedUpLine[3]
-                alternateBase = choppedUpLine[4]
-                strand = '+'
-
-                mutagenFilesByGenotype[mutagen].write('\t'.join( (chromosome,mutationPos0Based,mutationPos1Based,
-                                                                    referenceBase, alternateBase, strand, genotype) ) + '\n' )
-
-    # Close and sort the bed mutation files
-    for mutagen in mutagens:
-        mutagenFilesByGenotype[mutagen].close()
-        subprocess.run(" ".join(("sort","-k1,1","-k2,2n",mutagenFilePathsByGenotype[mutagen],
-                                "-o",mutagenFilePathsByGenotype[mutagen])), 
-                       shell = True, check = True)
-
-if __name__ == "__main__": main()
\ No newline at end of file
+        mutagenFilePathsByMutagen[mutagen] = os.path.join(mutagenFileDirectory, mutagen+"_custom_input.bed")
+        if compressOutput: mutagenFilePathsByMutagen[mutagen] += ".gz"
+        runFilePathsByMutagen[mutagen] = list()
+
+    # Keep the shards from incremental runs in the output directory.  Otherwise, use a temporary directory
+    # (for any runs that don't fit in memory).
+    if incremental:
+        manifestFilePath = os.path.join(outputDirectory, "ingestion_manifest.json")
+        previousManifest = readIngestionManifest(manifestFilePath)
+        runDirectory = os.path.join(outputDirectory, "sample_shards")
+        if not os.path.exists(runDirectory): os.makedirs(runDirectory)
+        runDirectoryContext = nullcontext(runDirectory)
+    else:
+        previousManifest = getEmptyIngestionManifest()
+        runDirectoryContext = tempfile.TemporaryDirectory(dir = outputDirectory)
+    manifest = getEmptyIngestionManifest()
+
+    with runDirectoryContext as runDirectory:
+
+        # Loop through the SNV directory for each of the vcf files within, finding the ones that need to be parsed.
+        VCFFileNamesToParse = list()
+        sampleNamesToParse = list()
+        changedMutagens = set()
+        for VCFFileName in sorted(os.listdir(SNVDirectory)):
+
+            # Make sure this file has an acceptable sample ID.  (If not, something is wrong...)
+            sampleName = VCFFileName.split('_')[0]
+            assert sampleName in mutagensBySample, "Unknown sample: " + sampleName + " found."
+
+            VCFFilePath = os.path.join(SNVDirectory,VCFFileName)
+            runFilePath = os.path.join(runDirectory, VCFFileName + ".bed")
+            VCFFileStats = os.stat(VCFFilePath)
+            sampleEntry = {"sample": sampleName, "genotype": genotypesBySample[sampleName],
+                           "mutagen": mutagensBySample[sampleName], "size": VCFFileStats.st_size,
+                           "mTime": VCFFileStats.st_mtime_ns, "hash": None}
+            previousSampleEntry = previousManifest["samples"].get(VCFFileName)
+
+            if not isSampleShardCurrent(previousSampleEntry, sampleEntry, VCFFilePath, runFilePath):
+                VCFFileNamesToParse.append(VCFFileName)
+                sampleNamesToParse.append(sampleName)
+                changedMutagens.add(sampleEntry["mutagen"])
+                if previousSampleEntry is not None: changedMutagens.add(previousSampleEntry["mutagen"])
+                if incremental and sampleEntry["hash"] is None: sampleEntry["hash"] = getFileHash(VCFFilePath)
+
+            manifest["samples"][VCFFileName] = sampleEntry
+            runFilePathsByMutagen[sampleEntry["mutagen"]].append(runFilePath)
+
+        # Remove the shards for any samples which are gone, and make sure their mutagens are merged again.
+        for VCFFileName, previousSampleEntry in previousManifest["samples"].items():
+            if VCFFileName not in manifest["samples"]:
+                changedMutagens.add(previousSampleEntry["mutagen"])
+                runFilePath = os.path.join(runDirectory, VCFFileName + ".bed")
+                if os.path.exists(runFilePath): os.remove(runFilePath)
+
+        print("Parsing",len(VCFFileNamesToParse),"of",len(manifest["samples"]),"samples")
+        VCFFilePaths = [os.path.join(SNVDirectory,VCFFileName) for VCFFileName in VCFFileNamesToParse]
+        sampleGenotypes = [genotypesBySample[sampleName] for sampleName in sampleNamesToParse]
+
+        with instrumentStage("parseVCFs", SNVDirectory = SNVDirectory, samples = len(VCFFilePaths),
+                             workers = workers) as stage:
+
+            # Stores each parsed sample's sorted run, in order: in memory if it fits, and on disk if it doesn't
+            # (or if it is needed as a shard for later incremental runs).
+            def storeSortedRuns(sampleBedTexts):
+                inMemoryRunSize = 0
+                for VCFFileName, sampleName, sampleBedText in zip(VCFFileNamesToParse, sampleNamesToParse, sampleBedTexts):
+                    print("Storing mutations for sample:", sampleName)
+                    runFilePath = os.path.join(runDirectory, VCFFileName + ".bed")
+                    if inMemoryRunSize + len(sampleBedText) <= maxInMemoryRunSize:
+                        inMemoryRunsByFilePath[runFilePath] = sampleBedText
+                        inMemoryRunSize += len(sampleBedText)
+                    if incremental or runFilePath not in inMemoryRunsByFilePath:
+                        with open(runFilePath, 'w') as runFile: runFile.write(sampleBedText)
+                    stage.addRecords(sampleBedText.count('\n'))
+
+            if workers > 1:
+                print("Using",workers,"workers")
+                with ProcessPoolExecutor(max_workers = workers) as executor:
+                    # Each process already has its own sample to work on, so don't decompress with extra threads.
+                    storeSortedRuns(executor.map(parseVCFSample, VCFFilePaths, sampleGenotypes, repeat(1),
+                                                 chunksize = max(1, len(VCFFilePaths)//(workers*8))))
+            else: storeSortedRuns(map(parseVCFSample, VCFFilePaths, sampleGenotypes))
+
+        # Merge the sorted runs into the bed mutation files for every mutagen that has changed
+        # (or whose output file is missing or was written differently).
+        for mutagen in mutagenFilePathsByMutagen:
+
+            manifest["outputFiles"][mutagen] = mutagenFilePathsByMutagen[mutagen]
+            if (mutagen not in changedMutagens and os.path.exists(mutagenFilePathsByMutagen[mutagen]) and
+                previousManifest["outputFiles"].get(mutagen) == mutagenFilePathsByMutagen[mutagen]): continue
+
+            print("Merging mutations for mutagen:", mutagen)
+            with instrumentStage("mergeSortedBedFiles", mutagen = mutagen, runs = len(runFilePathsByMutagen[mutagen]),
+                                 outputFilePath = mutagenFilePathsByMutagen[mutagen]):
+                if compressOutput: mutagenFile = openBgzfFileForWriting(mutagenFilePathsByMutagen[mutagen])
+                else: mutagenFile = open(mutagenFilePathsByMutagen[mutagen], 'w')
+                with mutagenFile:
+                    mergeSortedBedFiles([runFilePath for runFilePath in runFilePathsByMutagen[mutagen]
+                                         if runFilePath not in inMemoryRunsByFilePath], mutagenFile,
+                                        inMemoryRuns = [inMemoryRunsByFilePath.pop(runFilePath)
+                                                        for runFilePath in runFilePathsByMutagen[mutagen]
+                                                        if runFilePath in inMemoryRunsByFilePath])
+
+    if writeMutationStores:
+        for mutagenFilePath in mutagenFilePathsByMutagen.values(): updateMutationStore(mutagenFilePath)
+
+    # Only record the new state once all the output files are up to date.
+    if incremental: writeIngestionManifest(manifest, manifestFilePath)
+
+    return mutagenFilePathsByMutagen
+
+
+# Runs parseVCFsForMutperiod with the given command line arguments.  Without any, the VCF files and sample info in the
+# repository's data directory are parsed incrementally into its "C_elegans_bed_SNVs_for_mutperiod" directory.
+def runFromCommandLine(arguments):
+
+    # Specify relevant paths to be accessed later.
+    dataDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"data")
+
+    parser = argparse.ArgumentParser(description = "Convert VCF files to sorted mutation bed files for each mutagen.")
+    parser.add_argument("--snv-directory", dest = "SNVDirectory", metavar = "DIRECTORY",
+                        default = os.path.join(dataDirectory, "Filtered_VCFS_all_text", "SNV"),
+                        help = "Directory of VCF files (plain text, gzipped, or BGZF compressed)")
+    parser.add_argument("--sample-info", dest = "sampleInfoFilePath", metavar = "FILE",
+                        default = os.path.join(dataDirectory, "sample_info.csv"), help = "Sample info csv file")
+    parser.add_argument("-o", "--output-directory", dest = "outputDirectory", metavar = "DIRECTORY",
+                        default = os.path.join(dataDirectory, "C_elegans_bed_SNVs_for_mutperiod"),
+                        help = "Directory to write the mutation bed files for each mutagen to")
+    parser.add_argument("--workers", type = int, default = 1, help = "Number of worker processes (default: 1)")
+    parser.add_argument("--compress", action = "store_true", help = "Write BGZF compressed output (.bed.gz)")
+    parser.add_argument("--mutation-store", action = "store_true",
+                        help = "Also write a memory-mapped mutation store alongside each output file")
+    parser.add_argument("--no-incremental", action = "store_true",
+                        help = "Parse every sample again instead of only new or changed ones (and keep no sample shards)")
+    args = parser.parse_args(arguments)
+
+    parseVCFsForMutperiod(args.SNVDirectory, args.sampleInfoFilePath, args.outputDirectory, workers = args.workers,
+                          compressOutput = args.compress, incremental = not args.no_incremental,
+                          writeMutationStores = args.mutation_store)
+
+
+def main(): runFromCommandLine(sys.argv[1:])
+
+if __name__ == "__main__": main()
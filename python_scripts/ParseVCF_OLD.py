@@ -1,4 +1,5 @@
 import os, subprocess
+from BgzfFiles import openTextFileForReading
 
 def main():
     
@@ -54,9 +55,9 @@ def main():
         sampleName = VCFFileName.split('_')[0]
         if sampleName not in genotypesBySample: continue
 
-        # Read through the VCF file, counting every mutation line.  
+        # Read through the VCF file (plain text or gzipped), counting every mutation line.  
         # (This section could be modified in the future to retrieve more specific information on mutations if need be.)
-        with open(os.path.join(SNVDirectory,VCFFileName), 'r') as VCFFile:
+        with openTextFileForReading(os.path.join(SNVDirectory,VCFFileName)) as VCFFile:
             mutationCounts = 0
 
             genotype = genotypesBySample[sampleName]
@@ -0,0 +1,355 @@
+# This script chains the stages of the pipeline (parsing gene designations, finding highly expressed genes, filtering
+# the gene designations by expression, generating the trinucleotide background, and counting mutations in transcribed
+# regions) in a single process.  Each stage declares the artifacts it takes and produces, and artifacts are handed from
+# stage to stage in memory, so only the files that are actually requested get written.
+# Like make, a requested file is only regenerated when it is missing or older than any file it depends on (directly,
+# or through artifacts which were only ever kept in memory).  When a stage needs an artifact whose file is already
+# up to date, the file is read back instead of regenerating it.
+
+import os, sys, argparse
+from typing import Callable, Dict, List, Iterable, Set
+from StageInstrumentation import instrumentStage
+
+
+# A named piece of data passed between stages.  If it has a file path, it can be written to that file (and possibly
+# read back from it) with the given functions:  writeFile(value, filePath) and readFile(filePath) -> value.
+# The value of a source artifact is just the path to its (existing) file.
+class PipelineArtifact:
+
+    def __init__(self, name, filePath = None, writeFile: Callable = None, readFile: Callable = None, isSource = False):
+
+        self.name = name
+        self.filePath = filePath
+        self.writeFile = writeFile
+        self.readFile = readFile
+        self.isSource = isSource
+
+
+# A stage of the pipeline.  The values of its input artifacts are passed to its function in order, and the function
+# returns the values of its output artifacts (as a tuple if there is more than one).
+class PipelineStage:
+
+    def __init__(self, name, inputNames: List[str], outputNames: List[str], function: Callable):
+
+        self.name = name
+        self.inputNames = inputNames
+        self.outputNames = outputNames
+        self.function = function
+
+
+# Holds a graph of stages and artifacts, and runs the stages needed to bring the requested artifacts up to date.
+class PipelineRunner:
+
+    def __init__(self):
+
+        self.artifacts: Dict[str, PipelineArtifact] = dict()
+        self.stages: Dict[str, PipelineStage] = dict()
+        self.producers: Dict[str, PipelineStage] = dict() # The stage which produces each artifact.
+
+        # The state of the current run.
+        self.values = dict() # The values of artifacts obtained so far (in memory).
+        self.upToDate: Dict[str, bool] = dict() # Whether each artifact's file is up to date, as of the start of the run.
+        self.targetNames = set()
+        self.force = False
+        self.stagesRun: List[str] = list()
+
+
+    def addSource(self, name, filePath):
+        self.addArtifact(name, filePath, isSource = True)
+
+    def addArtifact(self, name, filePath = None, writeFile: Callable = None, readFile: Callable = None, isSource = False):
+        if name in self.artifacts: raise ValueError("Duplicate artifact: " + name)
+        self.artifacts[name] = PipelineArtifact(name, filePath, writeFile, readFile, isSource)
+
+    def addStage(self, name, inputNames: List[str], outputNames: List[str], function: Callable):
+
+        if name in self.stages: raise ValueError("Duplicate stage: " + name)
+        for artifactName in inputNames + outputNames:
+            if artifactName not in self.artifacts: raise ValueError("Unknown artifact: " + artifactName)
+        for outputName in outputNames:
+            if self.artifacts[outputName].isSource: raise ValueError("Source artifacts can't be produced: " + outputName)
+            if outputName in self.producers: raise ValueError("Artifact produced by more than one stage: " + outputName)
+
+        self.stages[name] = PipelineStage(name, inputNames, outputNames, function)
+        for outputName in outputNames: self.producers[outputName] = self.stages[name]
+
+
+    # Returns whether or not the given artifact's file exists and is at least as new as everything it depends on.
+    # Source artifacts are always up to date (but must exist).
+    def isUpToDate(self, name):
+
+        if name in self.upToDate: return self.upToDate[name]
+        artifact = self.artifacts[name]
+
+        if artifact.isSource:
+            if not os.path.exists(artifact.filePath): raise FileNotFoundError("Missing input file: " + artifact.filePath)
+            self.upToDate[name] = True
+        elif self.force or artifact.filePath is None or not os.path.exists(artifact.filePath):
+            self.upToDate[name] = False
+        else:
+            self.upToDate[name] = os.path.getmtime(artifact.filePath) >= self.getNewestDependencyTime(self.producers[name])
+
+        return self.upToDate[name]
+
+
+    # Returns the newest modification time of the files that the given stage's inputs come from.
+    # Inputs without up to date files are looked through to the files they would be generated from.
+    def getNewestDependencyTime(self, stage: PipelineStage):
+
+        newestTime = 0
+        for inputName in stage.inputNames:
+            inputArtifact = self.artifacts[inputName]
+            if self.isUpToDate(inputName): newestTime = max(newestTime, os.path.getmtime(inputArtifact.filePath))
+            else: newestTime = max(newestTime, self.getNewestDependencyTime(self.producers[inputName]))
+        return newestTime
+
+
+    # Returns whether or not the given artifact is generated (directly or indirectly) from any of the given artifacts.
+    def dependsOn(self, name, otherNames: Set[str]):
+        if name not in self.producers: return False
+        return any(inputName in otherNames or self.dependsOn(inputName, otherNames)
+                   for inputName in self.producers[name].inputNames)
+
+
+    # Returns the value of the given artifact, reading it from its file if it is up to date and can be read,
+    # or running the stage which produces it otherwise.
+    def getValue(self, name):
+
+        if name in self.values: return self.values[name]
+        artifact = self.artifacts[name]
+
+        if artifact.isSource: self.values[name] = artifact.filePath
+        elif self.isUpToDate(name) and artifact.readFile is not None:
+            print("Reading",name,"from",artifact.filePath)
+            self.values[name] = artifact.readFile(artifact.filePath)
+        else: self.runStage(self.producers[name])
+
+        return self.values[name]
+
+
+    # Runs the given stage, keeping all of its outputs in memory and writing any that were requested to their files.
+    def runStage(self, stage: PipelineStage):
+
+        inputValues = [self.getValue(inputName) for inputName in stage.inputNames]
+
+        print("Running stage:",stage.name)
+        with instrumentStage("PipelineRunner." + stage.name):
+            outputValues = stage.function(*inputValues)
+        if len(stage.outputNames) == 1: outputValues = (outputValues,)
+        self.stagesRun.append(stage.name)
+
+        for outputName, outputValue in zip(stage.outputNames, outputValues):
+            self.values[outputName] = outputValue
+            artifact = self.artifacts[outputName]
+            if outputName in self.targetNames and artifact.writeFile is not None:
+                print("Writing",artifact.filePath)
+                artifact.writeFile(outputValue, artifact.filePath)
+
+
+    # Brings the files for all the given artifacts up to date, running only the stages needed to do so.
+    # If force is True, every file is treated as out of date.  Returns the names of the stages that were run.
+    def run(self, targetNames: Iterable[str], force = False):
+
+        self.targetNames = set(targetNames)
+        for targetName in self.targetNames:
+            if targetName not in self.artifacts: raise ValueError("Unknown artifact: " + targetName)
+            if self.artifacts[targetName].filePath is None: raise ValueError(targetName + " can't be written to a file.")
+        self.values = dict()
+        self.upToDate = dict()
+        self.force = force
+        self.stagesRun = list()
+
+        # Check every target before anything is written so that writing one doesn't make another look out of date.
+        # Targets generated from rewritten targets are rewritten too, so that they don't look out of date next time.
+        outOfDateTargetNames = [targetName for targetName in sorted(self.targetNames) if not self.isUpToDate(targetName)]
+        outOfDateTargetNames += [targetName for targetName in sorted(self.targetNames)
+                                 if targetName not in outOfDateTargetNames
+                                 and self.dependsOn(targetName, set(outOfDateTargetNames))]
+        for targetName in outOfDateTargetNames:
+            if targetName not in self.values: self.runStage(self.producers[targetName])
+
+        if not outOfDateTargetNames: print("Everything is up to date.")
+        return self.stagesRun
+
+
+# Functions for writing and reading artifacts which are lists of text lines, or of tab separated fields.
+def writeLines(lines: List[str], filePath):
+    with open(filePath, 'w') as file: file.writelines(lines)
+
+def readLines(filePath):
+    with open(filePath, 'r') as file: return file.readlines()
+
+def writeTabSeparatedRows(rows: List[tuple], filePath):
+    with open(filePath, 'w') as file:
+        for row in rows: file.write('\t'.join(row) + '\n')
+
+def readTabSeparatedRows(filePath):
+    with open(filePath, 'r') as file: return [tuple(line.rstrip('\n').split('\t')) for line in file]
+
+
+# Returns a pipeline running from the raw gene designations table and gene expression file to background trinucleotide
+# counts for the highly expressed genes and transcriptional asymmetry counts in each of the given mutation files.
+# Artifacts are named:
+#   geneDesignationsTable, geneExpressionTable, genome:  The input files
+#   mutations_<file name>:  Each of the input mutation files
+#   geneDesignations, geneNames:  The parsed gene designations (ParseGeneDesignations)
+#   averageGeneExpression, highlyExpressedGenes:  Ranked average expression and the top genes (FindHighlyExpressedGenes)
+#   filteredGeneDesignations:  The gene designations for the highly expressed genes (FilterGeneDesignationsByExpression)
+#   clearGeneRanges, trinucleotideBackgroundCounts:  Unambiguous gene ranges and their trinucleotide counts
+#                                                    (GenerateGeneBackground, reading the genome through its index)
+#   clearGeneRangesIndex:  A GeneIntervalIndex of the clear gene ranges (in memory only)
+#   counts_<file name>:  The transcriptional asymmetry counts for each mutation file (CountInTranscribedRegions, named
+#                        like its own counts files, with the filtered gene set's name added)
+def buildGeneExpressionPipeline(geneDesignationsTableFilePath, geneExpressionFilePath, genomeFilePath,
+                                mutationFilePaths: List[str] = (), tissueFiltering = "Any", percentCutoff = 25):
+
+    # Imported here so that building other pipelines doesn't require every stage's dependencies.
+    from BedSorting import sortBedLines
+    from ParseGeneDesignations import readGeneDesignationsToParse
+    from FindHighlyExpressedGenes import (getHighlyExpressedGenesFilePaths, getAverageGeneExpression,
+                                          rankAverageGeneExpression, getGeneCountCutoff)
+    from FilterGeneDesignationsByExpression import (getFilteredGeneDesignationsFilePath, getFilteredGenes,
+                                                    filterGeneDesignationLines)
+    from GenerateGeneBackground import (getClearGeneRangesFilePath, getTrinucleotideBackgroundCountsFilePath,
+                                        getClearGeneRanges, countTrinucleotideCodesInRangeLines,
+                                        foldTrinucleotideCodeCounts, writeTrinucleotideBackgroundCounts)
+    from IndexedFasta import IndexedFasta
+    from GeneAnnotationIndex import GeneIntervalIndex
+    from CountInTranscribedRegions import IntervalIndexCountsFileGenerator, getCountsFilePath, ACCEPTABLE_CHROMOSOMES
+
+    assert geneDesignationsTableFilePath.endswith("gene_designations.tsv"), ("Unexpected file path.  Expected file " +
+                                                                             "ending in gene_designations.tsv")
+
+    runner = PipelineRunner()
+    runner.addSource("geneDesignationsTable", geneDesignationsTableFilePath)
+    runner.addSource("geneExpressionTable", geneExpressionFilePath)
+    runner.addSource("genome", genomeFilePath)
+
+    # Parse the gene designations.
+    geneDesignationsFilePath = geneDesignationsTableFilePath.rsplit(".tsv", 1)[0] + ".bed"
+    geneNamesFilePath = geneDesignationsTableFilePath.rsplit("gene_designations.tsv", 1)[0] + "gene_names.txt"
+    runner.addArtifact("geneDesignations", geneDesignationsFilePath, writeLines, readLines)
+    runner.addArtifact("geneNames", geneNamesFilePath,
+                       lambda geneNames, filePath: writeLines([geneName + '\n' for geneName in geneNames], filePath),
+                       lambda filePath: [line.rstrip('\n') for line in readLines(filePath)])
+
+    def parseGeneDesignations(geneDesignationsTableFilePath):
+        # NOTE: This is the same order as ParseGeneDesignations writes (see sortBedLines).
+        geneDesignationLines, geneNames = readGeneDesignationsToParse(geneDesignationsTableFilePath)
+        return sortBedLines(geneDesignationLines), geneNames
+
+    runner.addStage("parseGeneDesignations", ["geneDesignationsTable"], ["geneDesignations", "geneNames"],
+                    parseGeneDesignations)
+
+    # Find the highly expressed genes.
+    averageGeneExpressionFilePath, highlyExpressedGenesFilePath = getHighlyExpressedGenesFilePaths(geneExpressionFilePath,
+                                                                                                   tissueFiltering)
+    runner.addArtifact("averageGeneExpression", averageGeneExpressionFilePath, writeTabSeparatedRows, readTabSeparatedRows)
+    runner.addArtifact("highlyExpressedGenes", highlyExpressedGenesFilePath, writeTabSeparatedRows, readTabSeparatedRows)
+
+    def findHighlyExpressedGenes(geneExpressionFilePath):
+        rankedGeneExpression = rankAverageGeneExpression(getAverageGeneExpression(geneExpressionFilePath, tissueFiltering))
+        return rankedGeneExpression, rankedGeneExpression[:getGeneCountCutoff(len(rankedGeneExpression), percentCutoff)]
+
+    runner.addStage("findHighlyExpressedGenes", ["geneExpressionTable"], ["averageGeneExpression", "highlyExpressedGenes"],
+                    findHighlyExpressedGenes)
+
+    # Filter the gene designations down to the highly expressed genes.
+    filteredGeneDesignationsFilePath = getFilteredGeneDesignationsFilePath(highlyExpressedGenesFilePath)
+    runner.addArtifact("filteredGeneDesignations", filteredGeneDesignationsFilePath, writeLines, readLines)
+
+    def filterGeneDesignations(highlyExpressedGenes, geneDesignationLines):
+        filteredGenes = getFilteredGenes('\t'.join(row) for row in highlyExpressedGenes)
+        return list(filterGeneDesignationLines(filteredGenes, geneDesignationLines))
+
+    runner.addStage("filterGeneDesignationsByExpression", ["highlyExpressedGenes", "geneDesignations"],
+                    ["filteredGeneDesignations"], filterGeneDesignations)
+
+    # Generate the trinucleotide background for the clear gene ranges.
+    clearGeneRangesFilePath = getClearGeneRangesFilePath(filteredGeneDesignationsFilePath)
+    runner.addArtifact("clearGeneRanges", clearGeneRangesFilePath, writeLines, readLines)
+    runner.addArtifact("trinucleotideBackgroundCounts", getTrinucleotideBackgroundCountsFilePath(clearGeneRangesFilePath),
+                       lambda trinucleotideCounts, filePath:
+                           writeTrinucleotideBackgroundCounts(filePath, *trinucleotideCounts))
+
+    def generateGeneBackground(filteredGeneDesignationLines, genomeFilePath):
+        clearGeneRangeLines = list(getClearGeneRanges(filteredGeneDesignationLines))
+        with IndexedFasta(genomeFilePath) as genome:
+            trinucleotideCodeCounts = countTrinucleotideCodesInRangeLines(clearGeneRangeLines, genome)
+        return clearGeneRangeLines, foldTrinucleotideCodeCounts(trinucleotideCodeCounts)
+
+    runner.addStage("generateGeneBackground", ["filteredGeneDesignations", "genome"],
+                    ["clearGeneRanges", "trinucleotideBackgroundCounts"], generateGeneBackground)
+
+    # Count mutations in the clear gene ranges.
+    if mutationFilePaths:
+
+        runner.addArtifact("clearGeneRangesIndex")
+        runner.addStage("indexClearGeneRanges", ["clearGeneRanges"], ["clearGeneRangesIndex"],
+                        lambda clearGeneRangeLines: GeneIntervalIndex(clearGeneRangesFilePath,
+                                                                      genePositionLines = clearGeneRangeLines))
+
+        geneSetName = os.path.basename(filteredGeneDesignationsFilePath).rsplit("_gene_designations.bed", 1)[0]
+        for mutationFilePath in mutationFilePaths:
+
+            mutationFileName = os.path.basename(mutationFilePath)
+            countsFilePath = getCountsFilePath(mutationFilePath, geneSetName = geneSetName)
+            runner.addSource("mutations_" + mutationFileName, mutationFilePath)
+            # The counter writes its own results to the counts file path it was given.
+            runner.addArtifact("counts_" + mutationFileName, countsFilePath,
+                               lambda counter, filePath: counter.writeResults())
+
+            def countMutations(geneIntervalIndex, mutationFilePath, countsFilePath = countsFilePath):
+                counter = IntervalIndexCountsFileGenerator(mutationFilePath, geneIntervalIndex, countsFilePath,
+                                                           ACCEPTABLE_CHROMOSOMES)
+                counter.count()
+                return counter
+
+            runner.addStage("countInTranscribedRegions_" + mutationFileName,
+                            ["clearGeneRangesIndex", "mutations_" + mutationFileName], ["counts_" + mutationFileName],
+                            countMutations)
+
+    return runner
+
+
+def main():
+
+    dataDirectory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+    parser = argparse.ArgumentParser(description = "Run the gene expression pipeline, only regenerating out of date files.")
+    parser.add_argument("-e", "--gene-expression", required = True, dest = "geneExpressionFilePath", metavar = "FILE",
+                        help = "Gene expression file (ending in _gene_expression.txt)")
+    parser.add_argument("-G", "--genome", required = True, dest = "genomeFilePath", metavar = "FILE",
+                        help = "Genome fasta file")
+    parser.add_argument("-d", "--gene-designations-table", dest = "geneDesignationsTableFilePath", metavar = "FILE",
+                        default = os.path.join(dataDirectory, "C_elegans_gene_designations.tsv"),
+                        help = "Raw gene designations table (default: data/C_elegans_gene_designations.tsv)")
+    parser.add_argument("-m", "--mutation-files", nargs = '+', default = list(), dest = "mutationFilePaths",
+                        metavar = "FILE", help = "Trinucleotide context mutation bed files to count")
+    parser.add_argument("-t", "--tissue-filtering", default = "Any", help = "Cell/tissue type filtering (default: Any)")
+    parser.add_argument("-p", "--percent-cutoff", type = float, default = 25,
+                        help = "Percentage of genes to keep (default: 25)")
+    parser.add_argument("--targets", nargs = '+', metavar = "ARTIFACT",
+                        help = "Artifacts to write (default: the background counts and any mutation counts)")
+    parser.add_argument("--force", action = "store_true", help = "Regenerate the targets even if they are up to date")
+    parser.add_argument("--list", action = "store_true", help = "List the artifacts and whether they are up to date")
+    args = parser.parse_args()
+
+    runner = buildGeneExpressionPipeline(args.geneDesignationsTableFilePath, args.geneExpressionFilePath,
+                                         args.genomeFilePath, args.mutationFilePaths, args.tissue_filtering, args.percent_cutoff)
+
+    if args.list:
+        for artifact in runner.artifacts.values():
+            if artifact.filePath is None: status = "in memory only"
+            elif runner.isUpToDate(artifact.name): status = "up to date"
+            else: status = "out of date"
+            print(artifact.name + '\t' + status + '\t' + (artifact.filePath or ''))
+        return
+
+    targetNames = args.targets
+    if targetNames is None:
+        targetNames = ["trinucleotideBackgroundCounts"] + [name for name in runner.artifacts if name.startswith("counts_")]
+    runner.run(targetNames, args.force)
+
+
+if __name__ == "__main__": main()
@@ -0,0 +1,162 @@
+# This script contains an opt-in instrumentation layer for timing the stages of the pipeline.
+# Instrumentation is off unless the PIPELINE_INSTRUMENTATION_LOG environment variable is set to a file path
+# (or to '-' for stderr).  When it is on, each instrumented stage appends one JSON line to the log when it finishes with:
+#   stage, pid, startTime, wallSeconds, CPUSeconds, records, recordsPerSecond, bytesRead, bytesWritten, peakRSSMegabytes,
+#   failed, and any extra details given by the stage (e.g. input file paths).
+# bytesRead and bytesWritten come from /proc/self/io (so they are None where that isn't available), and peakRSSMegabytes
+# is the peak resident memory of the process so far (not just of the stage).
+# Setting PIPELINE_PROFILE to a comma separated list including "cprofile" and/or "tracemalloc" also captures:
+#   cprofile:  A cProfile of the stage, dumped to a .prof file (in PIPELINE_PROFILE_DIRECTORY, or the log's directory)
+#   tracemalloc:  The peak traced memory of the stage and its top allocation sites
+# Profiling is only done for the outermost instrumented stage, since nested profilers can't run at once.
+
+import os, sys, json, time, resource, cProfile, tracemalloc
+
+INSTRUMENTATION_LOG_VARIABLE = "PIPELINE_INSTRUMENTATION_LOG"
+PROFILE_VARIABLE = "PIPELINE_PROFILE"
+PROFILE_DIRECTORY_VARIABLE = "PIPELINE_PROFILE_DIRECTORY"
+
+TOP_ALLOCATION_COUNT = 10
+
+# How many instrumented stages are currently running in this process.
+activeStageCount = 0
+
+
+# Returns whether or not instrumentation has been turned on.
+def isInstrumentationEnabled():
+    return bool(os.environ.get(INSTRUMENTATION_LOG_VARIABLE))
+
+
+# Returns the total bytes read and written by this process so far (or Nones if they can't be found).
+def getIOCounters():
+    try:
+        with open("/proc/self/io", 'r') as IOFile:
+            counters = dict(line.split(':') for line in IOFile)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError): return None, None
+
+
+# Returns the peak resident memory of this process so far, in megabytes.
+def getPeakRSSMegabytes():
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else.
+    if sys.platform == "darwin": return peakRSS/1024/1024
+    else: return peakRSS/1024
+
+
+# Writes the given record to the instrumentation log as a single JSON line.
+def writeInstrumentationRecord(record):
+
+    logFilePath = os.environ.get(INSTRUMENTATION_LOG_VARIABLE)
+    line = json.dumps(record, default = str) + '\n'
+    if logFilePath == '-': sys.stderr.write(line)
+    else:
+        # Open and close the log for every record so that lines from parallel worker processes don't interleave.
+        with open(logFilePath, 'a') as logFile: logFile.write(line)
+
+
+# Stands in for an InstrumentedStage when instrumentation is off, so instrumented code doesn't need to check.
+class NullStage:
+
+    enabled = False
+
+    def __enter__(self): return self
+    def __exit__(self, excType, excValue, traceback): return False
+    def addRecords(self, records): pass
+    def addDetails(self, **details): pass
+
+
+# Measures a single stage of the pipeline.  Use through instrumentStage.
+class InstrumentedStage:
+
+    enabled = True
+
+    def __init__(self, stageName, details):
+
+        self.stageName = stageName
+        self.details = details
+        self.records = None
+
+        profileOptions = {option.strip().lower() for option in os.environ.get(PROFILE_VARIABLE, '').split(',')}
+        self.useCProfile = "cprofile" in profileOptions
+        self.useTracemalloc = "tracemalloc" in profileOptions
+        self.profiler: cProfile.Profile = None
+        self.startedTracemalloc = False
+
+
+    # Adds to the number of records (mutations, genes, etc.) processed by the stage.
+    def addRecords(self, records):
+        if self.records is None: self.records = 0
+        self.records += records
+
+    # Adds extra details to the stage's record.
+    def addDetails(self, **details):
+        self.details.update(details)
+
+
+    def __enter__(self):
+
+        global activeStageCount
+        self.isOutermostStage = activeStageCount == 0
+        activeStageCount += 1
+
+        if self.isOutermostStage and self.useTracemalloc:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.startedTracemalloc = True
+            tracemalloc.reset_peak()
+        if self.isOutermostStage and self.useCProfile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.startTime = time.time()
+        self.startCPUTime = time.process_time()
+        self.startBytesRead, self.startBytesWritten = getIOCounters()
+        self.startPerfCounter = time.perf_counter()
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+
+        global activeStageCount
+        wallSeconds = time.perf_counter() - self.startPerfCounter
+        CPUSeconds = time.process_time() - self.startCPUTime
+        bytesRead, bytesWritten = getIOCounters()
+        activeStageCount -= 1
+
+        record = {"stage": self.stageName, "pid": os.getpid(), "startTime": self.startTime,
+                  "wallSeconds": wallSeconds, "CPUSeconds": CPUSeconds, "records": self.records,
+                  "recordsPerSecond": self.records/wallSeconds if self.records is not None and wallSeconds > 0 else None,
+                  "bytesRead": None if bytesRead is None else bytesRead - self.startBytesRead,
+                  "bytesWritten": None if bytesWritten is None else bytesWritten - self.startBytesWritten,
+                  "peakRSSMegabytes": getPeakRSSMegabytes(), "failed": excType is not None}
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            profileDirectory = os.environ.get(PROFILE_DIRECTORY_VARIABLE)
+            if profileDirectory is None:
+                logFilePath = os.environ.get(INSTRUMENTATION_LOG_VARIABLE)
+                profileDirectory = os.getcwd() if logFilePath == '-' else os.path.dirname(os.path.abspath(logFilePath))
+            record["profileFilePath"] = os.path.join(profileDirectory, "{}_{}_{}.prof".format(
+                self.stageName, os.getpid(), int(self.startTime*1000)))
+            self.profiler.dump_stats(record["profileFilePath"])
+
+        if self.isOutermostStage and self.useTracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            record["tracemallocPeakMegabytes"] = tracemalloc.get_traced_memory()[1]/1024/1024
+            record["topAllocations"] = [{"site": str(statistic.traceback), "megabytes": statistic.size/1024/1024,
+                                         "count": statistic.count}
+                                        for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATION_COUNT]]
+            if self.startedTracemalloc: tracemalloc.stop()
+
+        record.update(self.details)
+        writeInstrumentationRecord(record)
+        return False
+
+
+# Returns a context manager which measures the code run inside it as the given stage and logs the results
+# (or does nothing at all, if instrumentation is off).  Any keyword arguments are added to the stage's record.
+# The object returned on entering has an addRecords method for reporting how many records the stage processed.
+def instrumentStage(stageName, **details):
+    if isInstrumentationEnabled(): return InstrumentedStage(stageName, details)
+    else: return NullStage()
@@ -0,0 +1,4 @@
+import os, sys
+
+# The scripts import each other by bare module name, so make them importable the same way here.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python_scripts"))
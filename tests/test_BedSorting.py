@@ -0,0 +1,126 @@
+import os, gzip, random, subprocess
+import pytest
+from BedSorting import sortBedLines, sortBedFile, isBedFileSorted, countBedHeaderLines
+from CountInTranscribedRegions import (CountsFileGenerator, IntervalIndexCountsFileGenerator, GeneIntervalIndex,
+                                       getSortedInputFilePath, getSortedCopyFilePath, ACCEPTABLE_CHROMOSOMES)
+
+HEADER_LINES = ("track name=genes\n", "chrom\tstart\tend\tname\tother_name\tstrand\n")
+
+
+# Returns random bed lines (with plenty of ties in chromosome and start position), in no particular order.
+def getShuffledBedLines(rng: random.Random, lineCount):
+    return ['\t'.join((rng.choice(("chrI", "chrII", "chrX", "chrM")), str(rng.randint(0, 300)), str(rng.randint(300, 400)),
+                       "gene-" + str(rng.randint(0, 50)), ".", rng.choice("+-"))) + '\n' for _ in range(lineCount)]
+
+
+def writeLines(filePath, lines):
+    with open(filePath, 'w') as file: file.writelines(lines)
+    return str(filePath)
+
+
+def readFile(filePath):
+    with open(filePath, 'r') as file: return file.read()
+
+
+def test_sortBedLinesMatchesSort():
+    lines = getShuffledBedLines(random.Random(0), 2000)
+    sortedLines = subprocess.run(["sort", "-k1,1", "-k2,2n"], input = ''.join(lines), capture_output = True, text = True,
+                                 check = True, env = dict(os.environ, LC_ALL = 'C')).stdout
+    assert ''.join(sortBedLines(lines)) == sortedLines
+
+
+@pytest.mark.parametrize("maxChunkSize", (1, 1000, 10**9))
+@pytest.mark.parametrize("headerLines", ((), HEADER_LINES))
+def test_sortBedFileInMemoryAndExternally(tmp_path, maxChunkSize, headerLines):
+
+    lines = getShuffledBedLines(random.Random(1), 500)
+    bedFilePath = writeLines(tmp_path / "unsorted.bed", list(headerLines) + lines)
+    assert not isBedFileSorted(bedFilePath)
+
+    sortedBedFilePath = str(tmp_path / "sorted.bed")
+    sortBedFile(bedFilePath, sortedBedFilePath, maxChunkSize = maxChunkSize)
+    assert readFile(sortedBedFilePath) == ''.join(headerLines) + ''.join(sortBedLines(lines))
+    assert isBedFileSorted(sortedBedFilePath)
+
+
+def test_headerLinesAreNotData(tmp_path):
+    assert countBedHeaderLines(HEADER_LINES + ("chrI\t5\t10\n", "chrI\t1\t2\n")) == len(HEADER_LINES)
+    assert isBedFileSorted(writeLines(tmp_path / "sorted.bed", HEADER_LINES + ("chrI\t1\t2\n", "chrI\t5\t10\n")))
+    assert isBedFileSorted(writeLines(tmp_path / "empty.bed", HEADER_LINES))
+
+
+# Unsorted gene positions (with a header) and mutation files should give the same counts once sorted by
+# getSortedInputFilePath as the sorted files do, with both the merge-walk and the interval index.
+@pytest.mark.parametrize("useIntervalIndex", (False, True))
+def test_countingSortedCopiesOfUnsortedInputs(tmp_path, useIntervalIndex):
+
+    rng = random.Random(2)
+    geneLines = list()
+    for chromosome in ("chrI", "chrII", "chrX"):
+        for _ in range(30):
+            start = rng.randint(0, 5000)
+            geneLines.append('\t'.join((chromosome, str(start), str(start + rng.randint(1, 400)), "n", "m",
+                                        rng.choice("+-"))) + '\n')
+    mutationLines = list()
+    for chromosome in ("chrI", "chrII", "chrIII", "chrX"):
+        for _ in range(300):
+            position = rng.randint(0, 5500)
+            mutationLines.append('\t'.join((chromosome, str(position), str(position + 1), rng.choice(("ACA", "TCG")),
+                                            rng.choice("ACGT"), rng.choice("+-"))) + '\n')
+
+    (tmp_path / "sorted").mkdir()
+    (tmp_path / "unsorted").mkdir()
+    countsFilePaths = list()
+    for directory, order in (("sorted", sortBedLines), ("unsorted", lambda lines: rng.sample(lines, len(lines)))):
+
+        genePositionsFilePath = writeLines(tmp_path / directory / "genes.bed", list(HEADER_LINES) + order(geneLines))
+        mutationFilePath = writeLines(tmp_path / directory / "test_trinuc_context_mutations.bed", order(mutationLines))
+
+        sortedGenePositionsFilePath = getSortedInputFilePath(genePositionsFilePath)
+        sortedMutationFilePath = getSortedInputFilePath(mutationFilePath)
+        assert (sortedGenePositionsFilePath == genePositionsFilePath) == (directory == "sorted")
+        assert (sortedMutationFilePath == mutationFilePath) == (directory == "sorted")
+        genePositionsFilePath, mutationFilePath = sortedGenePositionsFilePath, sortedMutationFilePath
+
+        countsFilePaths.append(str(tmp_path / directory / "counts.tsv"))
+        if useIntervalIndex:
+            counter = IntervalIndexCountsFileGenerator(mutationFilePath, GeneIntervalIndex(genePositionsFilePath, useCache = False),
+                                                       countsFilePaths[-1], ACCEPTABLE_CHROMOSOMES)
+        else: counter = CountsFileGenerator(mutationFilePath, genePositionsFilePath, countsFilePaths[-1], ACCEPTABLE_CHROMOSOMES)
+        counter.count()
+        counter.writeResults()
+
+    assert readFile(countsFilePaths[0]) == readFile(countsFilePaths[1])
+
+
+# The sorted copy of an unsorted file (and the gene interval index cached alongside it) should be reused on later runs,
+# until the original file changes.
+def test_sortedCopiesAreReused(tmp_path):
+
+    lines = getShuffledBedLines(random.Random(3), 200)
+    bedFilePath = writeLines(tmp_path / "genes.bed", lines)
+    sortedBedFilePath = getSortedInputFilePath(bedFilePath)
+    assert sortedBedFilePath == getSortedCopyFilePath(bedFilePath) == str(tmp_path / "genes_sorted.bed")
+    assert readFile(sortedBedFilePath) == ''.join(sortBedLines(lines))
+    assert not os.path.exists(sortedBedFilePath + ".tmp")
+
+    GeneIntervalIndex(sortedBedFilePath)
+    sortedMTime = os.stat(sortedBedFilePath).st_mtime_ns
+    cacheMTime = os.stat(sortedBedFilePath + ".annotation_index.npz").st_mtime_ns
+    assert getSortedInputFilePath(bedFilePath) == sortedBedFilePath
+    GeneIntervalIndex(sortedBedFilePath)
+    assert os.stat(sortedBedFilePath).st_mtime_ns == sortedMTime
+    assert os.stat(sortedBedFilePath + ".annotation_index.npz").st_mtime_ns == cacheMTime
+
+    # Once the original is newer than its sorted copy, it is sorted again.
+    lines = getShuffledBedLines(random.Random(4), 200)
+    writeLines(bedFilePath, lines)
+    os.utime(bedFilePath, ns = (sortedMTime + 10**9, sortedMTime + 10**9))
+    assert getSortedInputFilePath(bedFilePath) == sortedBedFilePath
+    assert readFile(sortedBedFilePath) == ''.join(sortBedLines(lines))
+
+    # Sorted files are used as they are, and sorted copies of gzipped files are plain text.
+    assert getSortedInputFilePath(sortedBedFilePath) == sortedBedFilePath
+    with gzip.open(tmp_path / "mutations.bed.gz", 'wt') as gzipFile: gzipFile.writelines(lines)
+    assert getSortedInputFilePath(str(tmp_path / "mutations.bed.gz")) == str(tmp_path / "mutations_sorted.bed")
+    assert readFile(tmp_path / "mutations_sorted.bed") == ''.join(sortBedLines(lines))
@@ -0,0 +1,65 @@
+import gzip, random
+import pytest
+from BgzfFiles import (openTextFileForReading, openBgzfFileForWriting, isBgzfHeader, isGzipFile,
+                       BGZF_EOF_BLOCK, BGZF_HEADER_SIZE, MAX_BGZF_BLOCK_INPUT_SIZE)
+
+
+# Returns random bed-like text spanning several BGZF blocks (and ending partway through one).
+def getText(seed = 0, lineCount = 20000):
+    rng = random.Random(seed)
+    return ''.join('\t'.join((rng.choice(("chrI", "chrII", "chrX")), str(position), str(position + 1),
+                              rng.choice(("ACA", "TCG", "GAT")), rng.choice("ACGT"), rng.choice("+-"))) + '\n'
+                   for position in sorted(rng.randint(0, 10**6) for _ in range(lineCount)))
+
+
+def readText(filePath, threads):
+    with openTextFileForReading(filePath, threads) as file: return file.read()
+
+
+@pytest.mark.parametrize("readThreads", (1, 3))
+@pytest.mark.parametrize("writeThreads", (1, 3))
+def test_bgzfRoundTrip(tmp_path, writeThreads, readThreads):
+
+    text = getText()
+    assert len(text) > MAX_BGZF_BLOCK_INPUT_SIZE*4
+    filePath = str(tmp_path / "mutations.bed.gz")
+    with openBgzfFileForWriting(filePath, writeThreads) as bgzfFile: bgzfFile.write(text)
+
+    with open(filePath, 'rb') as bgzfFile: compressedData = bgzfFile.read()
+    assert isBgzfHeader(compressedData[:BGZF_HEADER_SIZE]) and compressedData.endswith(BGZF_EOF_BLOCK)
+    assert isGzipFile(filePath)
+
+    # The file should read back the same as a BGZF file, as an ordinary gzip file, and line by line.
+    assert readText(filePath, readThreads) == text
+    with gzip.open(filePath, 'rt') as gzipFile: assert gzipFile.read() == text
+    with openTextFileForReading(filePath, readThreads) as bgzfFile: assert list(bgzfFile) == text.splitlines(True)
+
+
+def test_emptyBgzfFile(tmp_path):
+    filePath = str(tmp_path / "empty.bed.gz")
+    with openBgzfFileForWriting(filePath): pass
+    assert readText(filePath, 1) == ''
+
+
+def test_plainTextAndGzipFiles(tmp_path):
+
+    text = getText(1, 1000)
+    plainFilePath = str(tmp_path / "mutations.bed")
+    with open(plainFilePath, 'w') as plainFile: plainFile.write(text)
+    gzipFilePath = str(tmp_path / "mutations.bed.gz")
+    with gzip.open(gzipFilePath, 'wt') as gzipFile: gzipFile.write(text)
+
+    assert not isGzipFile(plainFilePath) and isGzipFile(gzipFilePath)
+    assert readText(plainFilePath, 1) == text
+    assert readText(gzipFilePath, 1) == text
+
+
+def test_corruptBgzfBlock(tmp_path):
+
+    filePath = str(tmp_path / "mutations.bed.gz")
+    with openBgzfFileForWriting(filePath, 1) as bgzfFile: bgzfFile.write(getText(2, 1000))
+    with open(filePath, 'r+b') as bgzfFile:
+        bgzfFile.seek(-len(BGZF_EOF_BLOCK) - 8, 2) # The last data block's CRC32
+        bgzfFile.write(b"\x00\x00\x00\x00")
+
+    with pytest.raises(ValueError, match = "integrity check"): readText(filePath, 1)
@@ -0,0 +1,105 @@
+import os, re, random
+import numpy as np
+import pytest
+from CheckOverlap import checkOverlap, getOverlapMatrixFilePaths, readPackedGeneSets, countPackedGenes
+
+
+# Writes gene sets drawn from a small pool of gene names (so they overlap plenty, and some genes are repeated within a
+# set), along with an empty set and a copy of the first set.  Returns the gene set file paths.
+def writeGeneSets(directory, seed, geneSetCount = 5):
+
+    rng = random.Random(seed)
+    genePool = ["WBGene" + str(geneNumber).zfill(8) for geneNumber in range(60)]
+    geneSets = [[rng.choice(genePool) for _ in range(rng.randint(1, 50))] for _ in range(geneSetCount)]
+    geneSets.insert(rng.randint(1, len(geneSets)), list())
+    geneSets.append(list(geneSets[0]))
+
+    geneSetFilePaths = list()
+    for geneSetIndex, geneSet in enumerate(geneSets):
+        geneSetFilePaths.append(os.path.join(directory, "set_" + str(geneSetIndex) + "_highly_expressed_genes.tsv"))
+        with open(geneSetFilePaths[-1], 'w') as geneSetFile:
+            for gene in geneSet: geneSetFile.write(gene + '\t' + str(rng.random()) + '\n')
+
+    return geneSetFilePaths
+
+
+# Reads an overlap matrix file back into its labels and rows of values (with None for "NA").
+def readOverlapMatrix(matrixFilePath):
+    with open(matrixFilePath, 'r') as matrixFile:
+        labels = matrixFile.readline().rstrip('\n').split('\t')[1:]
+        rows = [line.rstrip('\n').split('\t') for line in matrixFile]
+    assert [row[0] for row in rows] == labels
+    return labels, [[None if value == "NA" else float(value) for value in row[1:]] for row in rows]
+
+
+def readFile(filePath):
+    with open(filePath, 'r') as file: return file.read()
+
+
+# The bitset overlap matrices should match the pairwise overlaps printed by the original dict-based checkOverlap
+# (and the gene set sizes on the diagonal), and both should write the same intersection and union files.
+@pytest.mark.parametrize("seed", range(4))
+def test_bitsetMatricesMatchDictOverlap(tmp_path, capsys, seed):
+
+    geneSetFilePaths = writeGeneSets(str(tmp_path), seed)
+    fileNames = [os.path.basename(geneSetFilePath) for geneSetFilePath in geneSetFilePaths]
+
+    checkOverlap(geneSetFilePaths, str(tmp_path / "dict_intersection.tsv"), str(tmp_path / "dict_union.tsv"))
+    dictOutput = capsys.readouterr().out
+    geneSetSizes = {fileName: int(geneCount)
+                    for geneCount, fileName in re.findall(r"^(\d+) genes found in (\S+)$", dictOutput, re.MULTILINE)}
+    pairOverlaps = {(fileName1, fileName2): (int(intersectionSize), int(unionSize)) for fileName1, fileName2,
+                    intersectionSize, unionSize in re.findall(r"^Overlap between (\S+) and (\S+)\n\t(\d+)/(\d+)$",
+                                                              dictOutput, re.MULTILINE)}
+    assert len(geneSetSizes) == len(fileNames) and 0 in geneSetSizes.values()
+    assert len(pairOverlaps) == len(fileNames)*(len(fileNames) - 1)//2
+
+    overlapMatrixFilePathPrefix = str(tmp_path / "bitset")
+    checkOverlap(geneSetFilePaths, str(tmp_path / "bitset_intersection.tsv"), str(tmp_path / "bitset_union.tsv"),
+                 overlapMatrixFilePathPrefix)
+    (intersectionLabels, intersectionSizes), (unionLabels, unionSizes), (jaccardLabels, jaccardIndices) = (
+        readOverlapMatrix(matrixFilePath) for matrixFilePath in getOverlapMatrixFilePaths(overlapMatrixFilePathPrefix))
+    assert intersectionLabels == unionLabels == jaccardLabels == fileNames
+
+    for i, fileName1 in enumerate(fileNames):
+        for j, fileName2 in enumerate(fileNames):
+
+            if i == j: expectedIntersectionSize = expectedUnionSize = geneSetSizes[fileName1]
+            else: expectedIntersectionSize, expectedUnionSize = pairOverlaps[(fileName1, fileName2) if i < j
+                                                                              else (fileName2, fileName1)]
+
+            assert intersectionSizes[i][j] == expectedIntersectionSize, (fileName1, fileName2)
+            assert unionSizes[i][j] == expectedUnionSize, (fileName1, fileName2)
+            if expectedUnionSize == 0: assert jaccardIndices[i][j] is None
+            else: assert jaccardIndices[i][j] == pytest.approx(expectedIntersectionSize/expectedUnionSize)
+
+    # The first set and its copy are identical, so they overlap completely.
+    assert intersectionSizes[0][-1] == unionSizes[0][-1] == geneSetSizes[fileNames[0]] and jaccardIndices[0][-1] == 1
+
+    assert readFile(tmp_path / "bitset_intersection.tsv") == readFile(tmp_path / "dict_intersection.tsv")
+    assert readFile(tmp_path / "bitset_union.tsv") == readFile(tmp_path / "dict_union.tsv")
+
+
+# Without an empty set, the total intersection can be non-empty, and should still match.
+def test_bitsetTotalsMatchDictOverlap(tmp_path):
+
+    geneSetFilePaths = [geneSetFilePath for geneSetFilePath in writeGeneSets(str(tmp_path), 5, geneSetCount = 2)
+                        if os.path.getsize(geneSetFilePath) > 0]
+    geneSetFilePaths += [geneSetFilePaths[0]]*2
+
+    checkOverlap(geneSetFilePaths, str(tmp_path / "dict_intersection.tsv"), str(tmp_path / "dict_union.tsv"))
+    checkOverlap(geneSetFilePaths, str(tmp_path / "bitset_intersection.tsv"), str(tmp_path / "bitset_union.tsv"),
+                 useBitsets = True)
+
+    assert readFile(tmp_path / "bitset_intersection.tsv") == readFile(tmp_path / "dict_intersection.tsv") != ''
+    assert readFile(tmp_path / "bitset_union.tsv") == readFile(tmp_path / "dict_union.tsv")
+
+
+# The lookup table used for older NumPy versions should count the same genes as the popcount ufunc.
+def test_popcountLookupTable(tmp_path, monkeypatch):
+
+    _, packedGeneSets = readPackedGeneSets(writeGeneSets(str(tmp_path), 6))
+    expectedGeneCounts = np.unpackbits(packedGeneSets, axis = 1).sum(axis = 1)
+    assert countPackedGenes(packedGeneSets).tolist() == expectedGeneCounts.tolist()
+    monkeypatch.delattr(np, "bitwise_count", raising = False)
+    assert countPackedGenes(packedGeneSets).tolist() == expectedGeneCounts.tolist()
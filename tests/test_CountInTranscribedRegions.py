@@ -0,0 +1,244 @@
+import os, gzip, random
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from CountInTranscribedRegions import (CountsFileGenerator, IntervalIndexCountsFileGenerator, GeneIntervalIndex,
+                                       MetageneHistogram, countMutationFile, countMutationFileShard, getChromosomeByteRanges,
+                                       getMutationShardRanges, ACCEPTABLE_CHROMOSOMES)
+from BgzfFiles import openBgzfFileForWriting
+from MutationStore import updateMutationStore
+
+SEEDS = range(8)
+
+
+# Writes a random, sorted gene positions file and trinucleotide context mutation file to the given directory.
+# Genes may overlap (on the same or opposite strands) unless nonOverlapping is True, and some chromosomes with
+# mutations are missing from the gene positions file entirely.
+def writeCountingInputs(directory, seed, nonOverlapping = False):
+
+    rng = random.Random(seed)
+    geneChromosomes = [chromosome for chromosome in ACCEPTABLE_CHROMOSOMES if rng.random() < 0.6] or ["chrII"]
+
+    genes = list()
+    for chromosome in geneChromosomes:
+        endPos = 0
+        for _ in range(rng.randint(0, 40)):
+            if nonOverlapping: startPos = endPos + rng.randint(1, 200)
+            else: startPos = rng.randint(0, 5000)
+            endPos = startPos + rng.randint(1, 600)
+            genes.append((chromosome, startPos, endPos, rng.choice("+-")))
+    genes.sort(key = lambda gene: (gene[0], gene[1], gene[2]))
+
+    mutations = list()
+    for chromosome in ACCEPTABLE_CHROMOSOMES:
+        for _ in range(rng.randint(0, 300)):
+            mutations.append((chromosome, rng.randint(0, 6500), rng.choice(("ACA", "TCG", "GAT", "CCC")),
+                              rng.choice("ACGT"), rng.choice("+-")))
+    mutations.sort(key = lambda mutation: (mutation[0], mutation[1]))
+
+    genePositionsFilePath = os.path.join(directory, "test_clear_gene_ranges.bed")
+    with open(genePositionsFilePath, 'w') as genePositionsFile:
+        for gene in genes: genePositionsFile.write("{}\t{}\t{}\tname\tother_name\t{}\n".format(*gene))
+    mutationFilePath = os.path.join(directory, "test_trinuc_context_mutations.bed")
+    with open(mutationFilePath, 'w') as mutationFile:
+        for chromosome, position, context, mutantBase, strand in mutations:
+            mutationFile.write('\t'.join((chromosome, str(position), str(position + 1), context, mutantBase, strand)) + '\n')
+
+    return mutationFilePath, genePositionsFilePath
+
+
+def readFile(filePath):
+    with open(filePath, 'r') as file: return file.read()
+
+
+# Counts the given mutation file with the IntervalIndexCountsFileGenerator split into shards (as with multiple workers),
+# counting the shards with the given executor if there is one.  (Files which can't be split are counted whole.)
+def countInShards(mutationFilePath, geneIntervalIndex, countsFilePath, mutationGenePosFilePath,
+                  mutationStorePath = None, metageneHistogram = None, executor = None):
+
+    mutationRanges = getMutationShardRanges(mutationFilePath, mutationStorePath, ACCEPTABLE_CHROMOSOMES)
+    if mutationRanges is None:
+        return countMutationFile(mutationFilePath, None, geneIntervalIndex, countsFilePath, ACCEPTABLE_CHROMOSOMES,
+                                 mutationGenePosFilePath, mutationStorePath, metageneHistogram = metageneHistogram)
+
+    shardArguments = [(mutationFilePath, geneIntervalIndex, ACCEPTABLE_CHROMOSOMES, mutationGenePosFilePath, mutationRange,
+                       mutationStorePath, None if metageneHistogram is None else metageneHistogram.getEmptyCopy())
+                      for mutationRange in mutationRanges]
+    if executor is None: shardCounts = [countMutationFileShard(*arguments) for arguments in shardArguments]
+    else: shardCounts = [future.result() for future in [executor.submit(countMutationFileShard, *arguments)
+                                                         for arguments in shardArguments]]
+
+    counter = IntervalIndexCountsFileGenerator(mutationFilePath, geneIntervalIndex, countsFilePath, ACCEPTABLE_CHROMOSOMES,
+                                               mutationGenePosFilePath, mutationStorePath = mutationStorePath,
+                                               metageneHistogram = metageneHistogram)
+    for counts in shardCounts: counter.addShardCounts(counts)
+    counter.countFirstUncountedMutation()
+    counter.writeResults()
+
+
+# Counts the given inputs with every counting engine and returns each engine's output files' contents.
+# (Mutation gene positions are only recorded when nonOverlapping is True, since the merge-walk requires it.)
+def countWithEveryEngine(directory, mutationFilePath, genePositionsFilePath, nonOverlapping, executor = None,
+                         metageneBins = None):
+
+    outputs = dict()
+    for engine in ("mergeWalk", "intervalIndex", "cachedIntervalIndex", "strandAnnotationBitmap", "mutationStore",
+                   "shards", "mutationStoreShards") + (() if executor is None else ("workerShards",)):
+
+        countsFilePath = os.path.join(directory, engine + "_counts.tsv")
+        mutationGenePosFilePath = os.path.join(directory, engine + "_gene_pos.tsv") if nonOverlapping else None
+        metageneHistogram = None if metageneBins is None else MetageneHistogram(*metageneBins)
+
+        if engine == "mergeWalk":
+            counter = CountsFileGenerator(mutationFilePath, genePositionsFilePath, countsFilePath, ACCEPTABLE_CHROMOSOMES,
+                                          mutationGenePosFilePath, metageneHistogram = metageneHistogram)
+        else:
+
+            if engine == "cachedIntervalIndex":
+                GeneIntervalIndex(genePositionsFilePath)
+                assert os.path.exists(genePositionsFilePath + ".annotation_index.npz")
+            geneIntervalIndex = GeneIntervalIndex(genePositionsFilePath, useCache = engine == "cachedIntervalIndex",
+                                                  useStrandAnnotationBitmap = engine == "strandAnnotationBitmap")
+            if engine.startswith("mutationStore"): mutationStorePath = updateMutationStore(mutationFilePath)
+            else: mutationStorePath = None
+
+            if engine.endswith("hards"):
+                countInShards(mutationFilePath, geneIntervalIndex, countsFilePath, mutationGenePosFilePath,
+                              mutationStorePath, metageneHistogram, executor if engine == "workerShards" else None)
+                counter = None
+            else:
+                counter = IntervalIndexCountsFileGenerator(mutationFilePath, geneIntervalIndex, countsFilePath,
+                                                           ACCEPTABLE_CHROMOSOMES, mutationGenePosFilePath,
+                                                           mutationStorePath = mutationStorePath,
+                                                           metageneHistogram = metageneHistogram)
+
+        if counter is not None:
+            counter.count()
+            counter.writeResults()
+
+        outputs[engine] = (readFile(countsFilePath), None if mutationGenePosFilePath is None
+                                                     else readFile(mutationGenePosFilePath))
+
+    return outputs
+
+
+@pytest.mark.parametrize("nonOverlapping", (False, True))
+@pytest.mark.parametrize("seed", SEEDS)
+def test_enginesMatchMergeWalk(tmp_path, seed, nonOverlapping):
+
+    mutationFilePath, genePositionsFilePath = writeCountingInputs(str(tmp_path), seed, nonOverlapping)
+    outputs = countWithEveryEngine(str(tmp_path), mutationFilePath, genePositionsFilePath, nonOverlapping)
+
+    for engine, output in outputs.items(): assert output == outputs["mergeWalk"], engine
+
+
+def test_metageneHistogramsMatchMergeWalk(tmp_path):
+
+    mutationFilePath, genePositionsFilePath = writeCountingInputs(str(tmp_path), 0, nonOverlapping = True)
+    outputs = countWithEveryEngine(str(tmp_path), mutationFilePath, genePositionsFilePath, True,
+                                   metageneBins = (100, 4, 5))
+
+    for engine, output in outputs.items(): assert output == outputs["mergeWalk"], engine
+    assert outputs["mergeWalk"][1].startswith("Bin_Type\tBin_Start\tBin_End\tTS_Counts\tNTS_Counts\nAbsolute\t1\t100\t")
+
+
+def test_workerShardsMatchMergeWalk(tmp_path):
+
+    mutationFilePath, genePositionsFilePath = writeCountingInputs(str(tmp_path), 1, nonOverlapping = True)
+    with ProcessPoolExecutor(max_workers = 2) as executor:
+        outputs = countWithEveryEngine(str(tmp_path), mutationFilePath, genePositionsFilePath, True, executor)
+
+    assert "workerShards" in outputs
+    for engine, output in outputs.items(): assert output == outputs["mergeWalk"], engine
+
+
+# The interval index writes mutation gene positions out as it counts (rather than holding them until writeResults),
+# and shards' temporary gene position files are removed once they are combined.
+def test_mutationGenePosAreWrittenWhileCounting(tmp_path):
+
+    mutationFilePath, genePositionsFilePath = writeCountingInputs(str(tmp_path), 2, nonOverlapping = True)
+    outputs = countWithEveryEngine(str(tmp_path), mutationFilePath, genePositionsFilePath, True)
+    assert outputs["mergeWalk"][1].count('\n') > 1
+    assert not [fileName for fileName in os.listdir(tmp_path) if fileName.endswith(".tmp")]
+
+    mutationGenePosFilePath = str(tmp_path / "counting_gene_pos.tsv")
+    counter = IntervalIndexCountsFileGenerator(mutationFilePath, GeneIntervalIndex(genePositionsFilePath),
+                                               str(tmp_path / "counting_counts.tsv"), ACCEPTABLE_CHROMOSOMES,
+                                               mutationGenePosFilePath)
+    counter.count()
+    assert readFile(mutationGenePosFilePath) == outputs["mergeWalk"][1]
+    counter.writeResults()
+    assert readFile(mutationGenePosFilePath) == outputs["mergeWalk"][1]
+
+
+# Gzipped and BGZF compressed mutation files should be counted the same as plain text ones by every engine.
+# (They can't be split into byte ranges, so their shards are counted from the whole file.)
+@pytest.mark.parametrize("compression", ("gzip", "bgzf"))
+def test_compressedMutationFilesMatchPlainText(tmp_path, compression):
+
+    mutationFilePath, genePositionsFilePath = writeCountingInputs(str(tmp_path), 3, nonOverlapping = True)
+    plainTextOutputs = countWithEveryEngine(str(tmp_path), mutationFilePath, genePositionsFilePath, True)
+
+    compressedDirectory = tmp_path / compression
+    compressedDirectory.mkdir()
+    compressedMutationFilePath = str(compressedDirectory / (os.path.basename(mutationFilePath) + ".gz"))
+    if compression == "gzip": compressedMutationFile = gzip.open(compressedMutationFilePath, 'wt')
+    else: compressedMutationFile = openBgzfFileForWriting(compressedMutationFilePath, 1)
+    with compressedMutationFile: compressedMutationFile.write(readFile(mutationFilePath))
+
+    assert getMutationShardRanges(compressedMutationFilePath, None, ACCEPTABLE_CHROMOSOMES) is None
+    with pytest.raises(ValueError): getChromosomeByteRanges(compressedMutationFilePath, ACCEPTABLE_CHROMOSOMES)
+
+    compressedOutputs = countWithEveryEngine(str(compressedDirectory), compressedMutationFilePath,
+                                             genePositionsFilePath, True)
+    assert compressedOutputs == plainTextOutputs
+
+
+# Copies the given mutation file with a random cohort (from the given cohorts) added as a 7th column.
+def writeMutationFileWithCohorts(mutationFilePath, cohortMutationFilePath, seed, cohorts):
+    rng = random.Random(seed)
+    with open(mutationFilePath, 'r') as mutationFile, open(cohortMutationFilePath, 'w') as cohortMutationFile:
+        for line in mutationFile: cohortMutationFile.write(line.rstrip('\n') + '\t' + rng.choice(cohorts) + '\n')
+
+
+# Reads the rows of a counts (or cohort counts) file into a dictionary of count tuples (TS, NTS, and intergenic/ambiguous)
+# and NTS to TS ratios, with the other leading columns as keys.
+def readCountRows(countsFilePath):
+    with open(countsFilePath, 'r') as countsFile:
+        countsFile.readline()
+        rows = [line.rstrip('\n').split('\t') for line in countsFile]
+    return {tuple(row[:-4]): (tuple(int(count) for count in row[-4:-1]), row[-1]) for row in rows}
+
+
+# Summing the rows for each cohort should give back the counts from the same merge-walk without cohorts (which should be
+# unaffected by the cohort column), and a single cohort's rows should match those counts exactly.
+@pytest.mark.parametrize("cohorts", (("mlh-1", "xpc-1", "polh-1"), ("N2",)))
+@pytest.mark.parametrize("seed", SEEDS)
+def test_cohortCountsSumToAggregateCounts(tmp_path, seed, cohorts):
+
+    mutationFilePath, genePositionsFilePath = writeCountingInputs(str(tmp_path), seed)
+    cohortMutationFilePath = str(tmp_path / "cohort_trinuc_context_mutations.bed")
+    writeMutationFileWithCohorts(mutationFilePath, cohortMutationFilePath, seed, cohorts)
+
+    countsFilePath, cohortCountsFilePath = str(tmp_path / "counts.tsv"), str(tmp_path / "cohort_counts.tsv")
+    counter = CountsFileGenerator(cohortMutationFilePath, genePositionsFilePath, countsFilePath, ACCEPTABLE_CHROMOSOMES,
+                                  cohortCountsFilePath = cohortCountsFilePath)
+    counter.count()
+    counter.writeResults()
+
+    plainCountsFilePath = str(tmp_path / "plain_counts.tsv")
+    counter = CountsFileGenerator(mutationFilePath, genePositionsFilePath, plainCountsFilePath, ACCEPTABLE_CHROMOSOMES)
+    counter.count()
+    counter.writeResults()
+    assert readFile(countsFilePath) == readFile(plainCountsFilePath)
+
+    aggregateRows = readCountRows(countsFilePath)
+    cohortRows = readCountRows(cohortCountsFilePath)
+    assert {cohortContext[0] for cohortContext in cohortRows} <= set(cohorts)
+
+    summedCounts = dict()
+    for (_, *context), (counts, _) in cohortRows.items():
+        summedCounts[tuple(context)] = tuple(map(sum, zip(summedCounts.get(tuple(context), (0, 0, 0)), counts)))
+    assert summedCounts == {context: counts for context, (counts, _) in aggregateRows.items()}
+
+    if len(cohorts) == 1:
+        assert {tuple(context): row for (_, *context), row in cohortRows.items()} == aggregateRows
@@ -0,0 +1,53 @@
+import os, random
+import pytest
+from FilterGeneDesignationsByExpression import (filterGeneDesignationsByExpression,
+                                                filterGeneDesignationsByExpressionInBatch,
+                                                getFilteredGeneDesignationsFilePath)
+from ParseGeneDesignations import writeGeneNameIndex, getGeneNameIndexFilePath
+
+
+# Writes a small gene designations bed file and a few filtered genes files which share some of their genes
+# (including genes given under several names, and genes which aren't in the designations at all).
+@pytest.fixture
+def filteredGenesFiles(tmp_path):
+
+    rng = random.Random(0)
+    geneDesignationsFilePath = str(tmp_path / "test_gene_designations.bed")
+    with open(geneDesignationsFilePath, 'w') as geneDesignationsFile:
+        for i in range(200):
+            start = rng.randint(0, 10000)
+            geneDesignationsFile.write('\t'.join(("chrI", str(start), str(start + rng.randint(1, 500)),
+                                                  "WBGene{}".format(i), "gene-{}".format(i), rng.choice("+-"))) + '\n')
+
+    filteredGenesFilePaths = list()
+    for fileIndex in range(4):
+        filteredGenesFilePaths.append(str(tmp_path / "test_{}_highly_expressed_genes.tsv".format(fileIndex)))
+        with open(filteredGenesFilePaths[-1], 'w') as filteredGenesFile:
+            for i in rng.sample(range(250), 60):
+                filteredGenesFile.write("gene-{}__alias-{}\t{}\n".format(i, i, rng.random()))
+
+    return filteredGenesFilePaths, geneDesignationsFilePath
+
+
+def readFile(filePath):
+    with open(filePath, 'r') as file: return file.read()
+
+
+@pytest.mark.parametrize("useGeneNameIndex", (False, True))
+def test_batchMatchesSingleFiles(filteredGenesFiles, useGeneNameIndex):
+
+    filteredGenesFilePaths, geneDesignationsFilePath = filteredGenesFiles
+
+    expectedOutput = list()
+    for filteredGenesFilePath in filteredGenesFilePaths:
+        filterGeneDesignationsByExpression(filteredGenesFilePath, geneDesignationsFilePath)
+        expectedOutput.append(readFile(getFilteredGeneDesignationsFilePath(filteredGenesFilePath)))
+        os.remove(getFilteredGeneDesignationsFilePath(filteredGenesFilePath))
+
+    if useGeneNameIndex: writeGeneNameIndex(geneDesignationsFilePath)
+    assert os.path.exists(getGeneNameIndexFilePath(geneDesignationsFilePath)) == useGeneNameIndex
+
+    filterGeneDesignationsByExpressionInBatch(filteredGenesFilePaths, geneDesignationsFilePath)
+    assert [readFile(getFilteredGeneDesignationsFilePath(filteredGenesFilePath))
+            for filteredGenesFilePath in filteredGenesFilePaths] == expectedOutput
+    assert all(expectedOutput)
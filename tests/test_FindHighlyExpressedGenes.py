@@ -0,0 +1,63 @@
+import random
+import pytest
+import FindHighlyExpressedGenes as F
+
+TISSUES = ("Sperm", "Oocyte", "Germ line", "Germline tissue", "Muscle")
+
+
+# Writes a small gene expression file whose values span many orders of magnitude (so that the averages depend on
+# summation order) with blank, "N.A." and missing trailing values, and a few tied genes.
+@pytest.fixture
+def geneExpressionFilePath(tmp_path):
+
+    rng = random.Random(0)
+    geneCount = 60
+    geneExpressionFilePath = tmp_path / "test_gene_expression.txt"
+    with open(geneExpressionFilePath, 'w') as geneExpressionFile:
+        geneExpressionFile.write("Test gene expression data\n")
+        geneExpressionFile.write('\t'.join(["ID", "Study", "Strain", "Stage", "Tissue", "Method", "Notes"] +
+                                           ["Gene (gene-{}, alias-{})".format(i, i) for i in range(geneCount)]) + '\n')
+        for dataSet in range(40):
+            values = [rng.choice(('', "N.A.", "1.5", repr(rng.random()*10**rng.randint(-4, 6))))
+                      for _ in range(geneCount - rng.randint(0, 3))]
+            values[:3] = ("2.5", "2.5", "2.5")
+            geneExpressionFile.write('\t'.join([str(dataSet), "S", "N2", "L4", rng.choice(TISSUES), "RNA-seq", ""] +
+                                               values) + '\n')
+    return str(geneExpressionFilePath)
+
+
+def readFile(filePath):
+    with open(filePath, 'r') as file: return file.read()
+
+
+@pytest.mark.parametrize("tissueFiltering", F.TISSUE_FILTERING_OPTIONS)
+def test_matrixMeansMatchAverageGeneExpression(geneExpressionFilePath, tissueFiltering):
+
+    genes, averages = zip(*F.getAverageGeneExpression(geneExpressionFilePath, tissueFiltering))
+    matrixGenes, tissues, expressionMatrix = F.loadGeneExpressionMatrix(geneExpressionFilePath)
+    means, valueCounts = F.getMaskedGeneExpressionMeans(expressionMatrix, F.getTissueFilteringMask(tissues, tissueFiltering))
+
+    assert list(genes) == matrixGenes
+    assert list(averages) == F.formatGeneExpressionMeans(means, valueCounts)
+
+
+def test_matrixAndSweepMatchSortAndHead(geneExpressionFilePath):
+
+    percentCutoffs = (5, 25, 100)
+    expectedOutput = dict()
+    for tissueFiltering in F.TISSUE_FILTERING_OPTIONS:
+        for percentCutoff in percentCutoffs:
+            F.findHighlyExpressedGenes(geneExpressionFilePath, tissueFiltering, percentCutoff)
+            expectedOutput[(tissueFiltering, percentCutoff)] = tuple(
+                readFile(filePath) for filePath in F.getHighlyExpressedGenesFilePaths(geneExpressionFilePath, tissueFiltering))
+
+            F.findHighlyExpressedGenes(geneExpressionFilePath, tissueFiltering, percentCutoff, useExpressionMatrix = True)
+            assert tuple(readFile(filePath) for filePath in F.getHighlyExpressedGenesFilePaths(
+                geneExpressionFilePath, tissueFiltering)) == expectedOutput[(tissueFiltering, percentCutoff)]
+
+    filteredGenesFilePaths = F.sweepHighlyExpressedGenes(geneExpressionFilePath, list(F.TISSUE_FILTERING_OPTIONS),
+                                                         list(percentCutoffs))
+    for (tissueFiltering, percentCutoff), filteredGenesFilePath in filteredGenesFilePaths.items():
+        averageGeneExpressionFilePath = F.getHighlyExpressedGenesFilePaths(geneExpressionFilePath, tissueFiltering)[0]
+        assert ((readFile(averageGeneExpressionFilePath), readFile(filteredGenesFilePath)) ==
+                expectedOutput[(tissueFiltering, percentCutoff)])
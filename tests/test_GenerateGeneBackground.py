@@ -0,0 +1,206 @@
+import os, random
+import pytest
+from GenerateGeneBackground import (generateGeneBackground, writeClearGeneRanges, countEncodedTrinucleotides,
+                                    foldTrinucleotideCodeCounts, writeTrinucleotideBackgroundCounts,
+                                    getClearGeneRangesFilePath, getTrinucleotideBackgroundCountsFilePath,
+                                    hasOnlyEncodedBases)
+
+COMPLEMENTS = str.maketrans("ACGTN", "TGCAN")
+
+
+# Writes a small genome (upper case A, C, G, T, and N) with chromosomes of uneven length to the given directory,
+# and returns its path along with its sequences.
+def writeGenome(directory, rng: random.Random):
+
+    sequences = {chromosome: ''.join(rng.choice("ACGTACGTACGTN") for _ in range(rng.randint(300, 2000)))
+                 for chromosome in ("chrI", "chrII", "chrX")}
+    return writeGenomeSequences(directory, sequences), sequences
+
+
+# Writes the given sequences to a genome fasta file in the given directory and returns its path.
+def writeGenomeSequences(directory, sequences):
+
+    genomeFilePath = os.path.join(directory, "test_genome.fa")
+    with open(genomeFilePath, 'w') as genomeFile:
+        for chromosome, sequence in sequences.items():
+            genomeFile.write('>' + chromosome + '\n')
+            for i in range(0, len(sequence), 60): genomeFile.write(sequence[i:i+60] + '\n')
+    return genomeFilePath
+
+
+# Writes sets of sorted gene designations with overlapping genes on the same and opposite strands, genes at the very
+# start and past the end of their chromosomes, and genes on a chromosome that isn't in the genome.
+def writeGeneDesignations(directory, rng: random.Random, sequences, setCount = 3):
+
+    geneDesignationsFilePaths = list()
+    for setIndex in range(setCount):
+        genes = [("chrI", 0, 50, '+'), ("chrV", 10, 200, '-'), ("chrX", len(sequences["chrX"]) - 20, len(sequences["chrX"]) + 5, '-')]
+        for chromosome, sequence in sequences.items():
+            for _ in range(rng.randint(5, 25)):
+                startPos = rng.randint(1, len(sequence) - 10)
+                genes.append((chromosome, startPos, min(startPos + rng.randint(1, 300), len(sequence) - 1), rng.choice("+-")))
+        genes.sort(key = lambda gene: (gene[0], gene[1], gene[2]))
+
+        geneDesignationsFilePaths.append(os.path.join(directory, "set_{}_gene_designations.bed".format(setIndex)))
+        with open(geneDesignationsFilePaths[-1], 'w') as geneDesignationsFile:
+            for i, (chromosome, startPos, endPos, strand) in enumerate(genes):
+                geneDesignationsFile.write('\t'.join((chromosome, str(startPos), str(endPos), "gene-" + str(i), '.', strand)) + '\n')
+
+    return geneDesignationsFilePaths
+
+
+# Returns the sequence of each clear gene range in the given file that is within the genome, as bedToFasta would
+# write it (reverse complemented on the '-' strand).
+def getClearGeneRangeSequences(clearGeneRangesFilePath, sequences):
+
+    clearGeneRangeSequences = list()
+    with open(clearGeneRangesFilePath, 'r') as clearGeneRangesFile:
+        for line in clearGeneRangesFile:
+            chromosome, rangeStart, rangeEnd, _, _, strand = line.strip().split('\t')
+            rangeStart, rangeEnd = int(rangeStart), int(rangeEnd)
+            if chromosome not in sequences or rangeStart < 0 or rangeEnd > len(sequences[chromosome]): continue
+            sequence = sequences[chromosome][rangeStart:rangeEnd]
+            if strand == '-': sequence = sequence.translate(COMPLEMENTS)[::-1]
+            clearGeneRangeSequences.append(sequence)
+    return clearGeneRangeSequences
+
+
+# The original, one position at a time trinucleotide counting.
+def countTrinucleotidesBySubstring(clearGeneRangeSequences):
+
+    trinucleotideCountsNTS = dict()
+    trinucleotideCountsTS = dict()
+    for sequence in clearGeneRangeSequences:
+        for i in range(0, len(sequence) - 2):
+            trinucleotide = sequence[i:i+3]
+            if trinucleotide[1] in "AG":
+                trinucleotide = trinucleotide.translate(COMPLEMENTS)[::-1]
+                trinucleotideCountsTS[trinucleotide] = trinucleotideCountsTS.setdefault(trinucleotide, 0) + 1
+            else: trinucleotideCountsNTS[trinucleotide] = trinucleotideCountsNTS.setdefault(trinucleotide, 0) + 1
+    return trinucleotideCountsNTS, trinucleotideCountsTS
+
+
+def readFile(filePath):
+    with open(filePath, 'r') as file: return file.read()
+
+
+@pytest.fixture(params = range(3))
+def backgroundInputs(tmp_path, request):
+
+    rng = random.Random(request.param)
+    genomeFilePath, sequences = writeGenome(str(tmp_path), rng)
+    geneDesignationsFilePaths = writeGeneDesignations(str(tmp_path), rng, sequences)
+
+    # Write the expected background counts from the substring counter.
+    expectedBackgrounds = list()
+    for geneDesignationsFilePath in geneDesignationsFilePaths:
+        clearGeneRangesFilePath = writeClearGeneRanges(geneDesignationsFilePath)
+        expectedBackgroundFilePath = str(tmp_path / ("expected_" + os.path.basename(geneDesignationsFilePath)))
+        writeTrinucleotideBackgroundCounts(expectedBackgroundFilePath, *countTrinucleotidesBySubstring(
+            getClearGeneRangeSequences(clearGeneRangesFilePath, sequences)))
+        expectedBackgrounds.append(readFile(expectedBackgroundFilePath))
+
+    return genomeFilePath, sequences, geneDesignationsFilePaths, expectedBackgrounds
+
+
+def getBackgrounds(geneDesignationsFilePaths):
+    return [readFile(getTrinucleotideBackgroundCountsFilePath(getClearGeneRangesFilePath(geneDesignationsFilePath)))
+            for geneDesignationsFilePath in geneDesignationsFilePaths]
+
+
+def test_vectorizedCountingMatchesSubstrings(backgroundInputs):
+
+    _, sequences, geneDesignationsFilePaths, _ = backgroundInputs
+    for geneDesignationsFilePath in geneDesignationsFilePaths:
+        clearGeneRangeSequences = getClearGeneRangeSequences(getClearGeneRangesFilePath(geneDesignationsFilePath), sequences)
+        assert (foldTrinucleotideCodeCounts(sum(countEncodedTrinucleotides(sequence) for sequence in clearGeneRangeSequences)) ==
+                countTrinucleotidesBySubstring(clearGeneRangeSequences))
+
+
+@pytest.mark.parametrize("mode", ("genomeIndex", "singleGenomePass"))
+def test_indexedGenomeModesMatchSubstrings(backgroundInputs, mode):
+
+    genomeFilePath, _, geneDesignationsFilePaths, expectedBackgrounds = backgroundInputs
+    with pytest.warns(UserWarning, match = "is not within the genome"):
+        generateGeneBackground(geneDesignationsFilePaths, genomeFilePath, useGenomeIndex = mode == "genomeIndex",
+                               useSingleGenomePass = mode == "singleGenomePass")
+    assert getBackgrounds(geneDesignationsFilePaths) == expectedBackgrounds
+
+
+# The fasta file modes go through mutperiod's bedToFasta, so they can only be checked when it is installed.
+@pytest.mark.parametrize("useVectorizedCounting", (False, True))
+def test_fastaFileModesMatchSubstrings(backgroundInputs, useVectorizedCounting):
+
+    pytest.importorskip("mutperiodpy")
+    genomeFilePath, _, geneDesignationsFilePaths, expectedBackgrounds = backgroundInputs
+    generateGeneBackground(geneDesignationsFilePaths, genomeFilePath, useVectorizedCounting = useVectorizedCounting)
+    assert getBackgrounds(geneDesignationsFilePaths) == expectedBackgrounds
+
+
+# Returns a copy of the given sequences with the given bases (e.g. soft-masked or IUPAC bases) written over every
+# position selected by isReplaced(chromosome, position), which is given the clear gene ranges of every set.
+def replaceBases(sequences, rng: random.Random, replacementBases, isReplaced):
+    return {chromosome: ''.join(rng.choice(replacementBases) if isReplaced(chromosome, position) else base
+                                for position, base in enumerate(sequence))
+            for chromosome, sequence in sequences.items()}
+
+
+# Returns a function giving whether or not each position is in any of the clear gene ranges for the given sets.
+def getClearGeneRangeCoverage(geneDesignationsFilePaths):
+
+    coveredPositions = set()
+    for geneDesignationsFilePath in geneDesignationsFilePaths:
+        with open(getClearGeneRangesFilePath(geneDesignationsFilePath), 'r') as clearGeneRangesFile:
+            for line in clearGeneRangesFile:
+                chromosome, rangeStart, rangeEnd = line.split('\t')[:3]
+                coveredPositions.update((chromosome, position) for position in range(int(rangeStart), int(rangeEnd)))
+    return lambda chromosome, position: (chromosome, position) in coveredPositions
+
+
+def test_onlyUpperCaseBasesAreEncoded():
+
+    assert hasOnlyEncodedBases("ACGTN")
+    for sequence in ("ACGTn", "acgt", "ACRT", "AC-T"):
+        assert not hasOnlyEncodedBases(sequence)
+        with pytest.raises(ValueError): countEncodedTrinucleotides(sequence)
+
+
+# Soft-masked or IUPAC bases outside of every clear gene range don't affect the indexed genome modes, but inside a
+# clear gene range, they can't be counted the same way as the substring counter, so they raise an error.
+@pytest.mark.filterwarnings("ignore:Range .* is not within the genome")
+@pytest.mark.parametrize("mode", ("genomeIndex", "singleGenomePass"))
+@pytest.mark.parametrize("replacementBases", ("acgtn", "RYKMSWN"))
+def test_indexedGenomeModesWithUnencodedBases(backgroundInputs, tmp_path, mode, replacementBases):
+
+    _, sequences, geneDesignationsFilePaths, expectedBackgrounds = backgroundInputs
+    isCovered = getClearGeneRangeCoverage(geneDesignationsFilePaths)
+    rng = random.Random(0)
+
+    genomeFilePath = writeGenomeSequences(str(tmp_path), replaceBases(
+        sequences, rng, replacementBases, lambda chromosome, position: not isCovered(chromosome, position)))
+    with pytest.warns(UserWarning, match = "is not within the genome"):
+        generateGeneBackground(geneDesignationsFilePaths, genomeFilePath, useGenomeIndex = mode == "genomeIndex",
+                               useSingleGenomePass = mode == "singleGenomePass")
+    assert getBackgrounds(geneDesignationsFilePaths) == expectedBackgrounds
+
+    os.remove(genomeFilePath + ".fai")
+    genomeFilePath = writeGenomeSequences(str(tmp_path), replaceBases(
+        sequences, rng, replacementBases, lambda chromosome, position: isCovered(chromosome, position) and rng.random() < 0.05))
+    with pytest.raises(ValueError, match = "upper case"):
+        generateGeneBackground(geneDesignationsFilePaths, genomeFilePath, useGenomeIndex = mode == "genomeIndex",
+                               useSingleGenomePass = mode == "singleGenomePass")
+
+
+# With vectorized counting, sequences with soft-masked or IUPAC bases should be counted just as they are without it.
+def test_vectorizedFastaModeWithUnencodedBases(backgroundInputs, tmp_path):
+
+    pytest.importorskip("mutperiodpy")
+    _, sequences, geneDesignationsFilePaths, _ = backgroundInputs
+    genomeFilePath = writeGenomeSequences(str(tmp_path), replaceBases(
+        sequences, random.Random(0), "acgtnRY", lambda chromosome, position: position % 97 == 0))
+
+    backgrounds = list()
+    for useVectorizedCounting in (False, True):
+        generateGeneBackground(geneDesignationsFilePaths, genomeFilePath, useVectorizedCounting = useVectorizedCounting)
+        backgrounds.append(getBackgrounds(geneDesignationsFilePaths))
+    assert backgrounds[0] == backgrounds[1]
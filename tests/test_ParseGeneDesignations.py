@@ -0,0 +1,100 @@
+import os, random
+import pytest
+from ParseGeneDesignations import (parseGeneDesignations, readIndexedGeneDesignationLines, writeGeneNameIndex,
+                                   getGeneNameIndexFilePath, NAME_COLUMN, OTHER_NAME_COLUMN)
+
+
+# Writes a random gene designations table to parse.  Some genes share names, some names are used in one gene's name
+# column and another gene's other name column, and some names are prefixes of others.
+# Returns the path to the table and the pool of names used.
+def writeGeneDesignationsToParse(directory, seed, geneCount = 300):
+
+    rng = random.Random(seed)
+    namePool = ["abc-" + str(nameNumber) for nameNumber in range(1, 40)] + ["WBGene" + str(nameNumber).zfill(8)
+                                                                           for nameNumber in range(40)]
+
+    geneDesignationsToParseFilePath = os.path.join(directory, "test_gene_designations.tsv")
+    with open(geneDesignationsToParseFilePath, 'w') as geneDesignationsToParseFile:
+        geneDesignationsToParseFile.write('\t'.join("column_" + str(column) for column in range(13)) + '\n')
+        for _ in range(geneCount):
+            columns = ['.']*13
+            startPos = rng.randint(1, 10000)
+            columns[1], columns[12] = rng.choice(namePool), rng.choice(namePool)
+            columns[2], columns[3] = rng.choice(("chrI", "chrII", "chrX")), rng.choice("+-")
+            columns[4], columns[5] = str(startPos), str(startPos + rng.randint(0, 500))
+            geneDesignationsToParseFile.write('\t'.join(columns) + '\n')
+
+    return geneDesignationsToParseFilePath, namePool
+
+
+# The original way of finding the lines for the given genes: scanning every line of the file.
+def scanGeneDesignationLines(geneDesignationsParsedFilePath, geneNames, nameColumn = None):
+    nameColumns = (NAME_COLUMN, OTHER_NAME_COLUMN) if nameColumn is None else (nameColumn,)
+    with open(geneDesignationsParsedFilePath, 'r') as geneDesignationsParsedFile:
+        return [line for line in geneDesignationsParsedFile
+                if any(line.strip().split('\t')[column] in geneNames for column in nameColumns)]
+
+
+@pytest.fixture
+def parsedGeneDesignations(tmp_path):
+    geneDesignationsToParseFilePath, namePool = writeGeneDesignationsToParse(str(tmp_path), 0)
+    geneDesignationsParsedFilePath = str(tmp_path / "test_gene_designations.bed")
+    parseGeneDesignations(geneDesignationsToParseFilePath, geneDesignationsParsedFilePath,
+                          str(tmp_path / "test_gene_names.txt"))
+    return geneDesignationsParsedFilePath, namePool
+
+
+@pytest.mark.parametrize("nameColumn", (None, NAME_COLUMN, OTHER_NAME_COLUMN))
+def test_indexedLinesMatchLinearScan(parsedGeneDesignations, nameColumn):
+
+    geneDesignationsParsedFilePath, namePool = parsedGeneDesignations
+    assert os.path.exists(getGeneNameIndexFilePath(geneDesignationsParsedFilePath))
+
+    rng = random.Random(1)
+    queries = [set(), set(namePool), {"abc-1"}, {"abc-1", "missing"}, {"missing"}]
+    queries += [set(rng.sample(namePool, rng.randint(1, 20))) for _ in range(20)]
+
+    for geneNames in queries:
+        expectedLines = scanGeneDesignationLines(geneDesignationsParsedFilePath, geneNames, nameColumn)
+        assert readIndexedGeneDesignationLines(geneDesignationsParsedFilePath, geneNames, nameColumn) == expectedLines
+
+    # Make sure the two name columns actually pick out different lines.
+    assert (scanGeneDesignationLines(geneDesignationsParsedFilePath, {"abc-1"}, NAME_COLUMN) !=
+            scanGeneDesignationLines(geneDesignationsParsedFilePath, {"abc-1"}, OTHER_NAME_COLUMN))
+
+
+# A missing index, or one written before the gene designations file changed (even without changing its size),
+# should not be used.
+def test_staleIndexIsNotUsed(parsedGeneDesignations):
+
+    geneDesignationsParsedFilePath, namePool = parsedGeneDesignations
+    geneNames = set(namePool[::3])
+
+    with open(geneDesignationsParsedFilePath, 'r') as bedFile: lines = bedFile.readlines()
+    indexedMTime = os.stat(geneDesignationsParsedFilePath).st_mtime_ns
+
+    # Swap the names in the first line, keeping the file the same size.
+    choppedUpLine = lines[0].rstrip('\n').split('\t')
+    choppedUpLine[NAME_COLUMN], choppedUpLine[OTHER_NAME_COLUMN] = (choppedUpLine[OTHER_NAME_COLUMN],
+                                                                    choppedUpLine[NAME_COLUMN])
+    lines[0] = '\t'.join(choppedUpLine) + '\n'
+    with open(geneDesignationsParsedFilePath, 'w') as bedFile: bedFile.writelines(lines)
+    os.utime(geneDesignationsParsedFilePath, ns = (indexedMTime + 10**9, indexedMTime + 10**9))
+    assert readIndexedGeneDesignationLines(geneDesignationsParsedFilePath, geneNames) is None
+
+    # Appending a line changes the size.
+    with open(geneDesignationsParsedFilePath, 'a') as geneDesignationsParsedFile:
+        geneDesignationsParsedFile.write("chrX\t20000\t20100\tabc-1\tabc-2\t+\n")
+    writeGeneNameIndex(geneDesignationsParsedFilePath)
+    with open(geneDesignationsParsedFilePath, 'a') as geneDesignationsParsedFile:
+        geneDesignationsParsedFile.write("chrX\t20200\t20300\tabc-3\tabc-4\t-\n")
+    assert readIndexedGeneDesignationLines(geneDesignationsParsedFilePath, geneNames) is None
+
+    # Rewriting the index brings it back up to date.
+    writeGeneNameIndex(geneDesignationsParsedFilePath)
+    for nameColumn in (None, NAME_COLUMN, OTHER_NAME_COLUMN):
+        assert (readIndexedGeneDesignationLines(geneDesignationsParsedFilePath, geneNames | {"abc-3"}, nameColumn) ==
+                scanGeneDesignationLines(geneDesignationsParsedFilePath, geneNames | {"abc-3"}, nameColumn))
+
+    os.remove(getGeneNameIndexFilePath(geneDesignationsParsedFilePath))
+    assert readIndexedGeneDesignationLines(geneDesignationsParsedFilePath, geneNames) is None
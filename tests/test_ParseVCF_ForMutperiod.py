@@ -0,0 +1,74 @@
+import os, random
+import pytest
+from BedSorting import sortBedLines
+from BgzfFiles import openTextFileForReading, isGzipFile
+from MutationStore import MutationStore, getMutationStorePath
+from ParseVCF_ForMutperiod import parseVCFsForMutperiod, runFromCommandLine
+
+MUTAGENS = ("UV", "MMS", "EMS")
+
+
+# Writes a few small VCF files (with plenty of ties in position across samples) and their sample info file.
+# Returns the SNV directory, the sample info file path, and the expected sorted bed text for each mutagen.
+def writeVCFInputs(directory, seed = 0, sampleCount = 12):
+
+    rng = random.Random(seed)
+    SNVDirectory = os.path.join(directory, "SNVs")
+    os.makedirs(SNVDirectory)
+    sampleInfoFilePath = os.path.join(directory, "sample_info.csv")
+    bedLinesByMutagen = {mutagen: list() for mutagen in MUTAGENS}
+
+    with open(sampleInfoFilePath, 'w') as sampleInfoFile:
+        sampleInfoFile.write("Sample,Genotype,Generation,Dose,Mutagen\n,,,,\n")
+        for sampleNumber in range(sampleCount):
+            sample = "CD" + str(sampleNumber).zfill(4)
+            mutagen = MUTAGENS[sampleNumber % len(MUTAGENS)]
+            sampleInfoFile.write(','.join((sample, "mlh-1 (gk691866)", "20", "1", mutagen)) + '\n')
+            with open(os.path.join(SNVDirectory, sample + "_snv.vcf"), 'w') as VCFFile:
+                VCFFile.write("##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+                for _ in range(rng.randint(0, 40)):
+                    chromosome, position = rng.choice(("I", "II", "X")), rng.randint(1, 200)
+                    referenceBase, alternateBase = rng.sample("ACGT", 2)
+                    VCFFile.write('\t'.join((chromosome, str(position), '.', referenceBase, alternateBase,
+                                             "50", "PASS", '.')) + '\n')
+                    bedLinesByMutagen[mutagen].append('\t'.join(("chr" + chromosome, str(position - 1), str(position),
+                                                                 referenceBase, alternateBase, '+',
+                                                                 "mlh-1_gk691866")) + '\n')
+
+    return SNVDirectory, sampleInfoFilePath, {mutagen: ''.join(sortBedLines(bedLines))
+                                              for mutagen, bedLines in bedLinesByMutagen.items()}
+
+
+# Runs held in memory, runs spilled to disk, and a mix of the two (with or without incremental shards)
+# should all merge into the same sorted file for each mutagen.
+@pytest.mark.parametrize("maxInMemoryRunSize", (0, 1000, 10**9))
+@pytest.mark.parametrize("incremental", (False, True))
+def test_inMemoryAndSpilledRunsMergeTheSame(tmp_path, maxInMemoryRunSize, incremental):
+
+    SNVDirectory, sampleInfoFilePath, expectedBedTextByMutagen = writeVCFInputs(str(tmp_path))
+    outputDirectory = str(tmp_path / "output")
+    os.makedirs(outputDirectory)
+
+    outputFilePathsByMutagen = parseVCFsForMutperiod(SNVDirectory, sampleInfoFilePath, outputDirectory,
+                                                     incremental = incremental, maxInMemoryRunSize = maxInMemoryRunSize)
+
+    assert sorted(outputFilePathsByMutagen) == sorted(MUTAGENS)
+    for mutagen, outputFilePath in outputFilePathsByMutagen.items():
+        with open(outputFilePath, 'r') as outputFile: assert outputFile.read() == expectedBedTextByMutagen[mutagen]
+
+
+@pytest.mark.parametrize("incremental", (False, True))
+def test_runFromCommandLine(tmp_path, incremental):
+
+    SNVDirectory, sampleInfoFilePath, expectedBedTextByMutagen = writeVCFInputs(str(tmp_path))
+    outputDirectory = str(tmp_path / "output")
+
+    runFromCommandLine(["--snv-directory", SNVDirectory, "--sample-info", sampleInfoFilePath, "-o", outputDirectory,
+                        "--workers", "2", "--compress", "--mutation-store"] + ([] if incremental else ["--no-incremental"]))
+
+    assert os.path.exists(os.path.join(outputDirectory, "ingestion_manifest.json")) == incremental
+    for mutagen, expectedBedText in expectedBedTextByMutagen.items():
+        outputFilePath = os.path.join(outputDirectory, mutagen, mutagen + "_custom_input.bed.gz")
+        assert isGzipFile(outputFilePath)
+        with openTextFileForReading(outputFilePath) as outputFile: assert outputFile.read() == expectedBedText
+        assert len(MutationStore(getMutationStorePath(outputFilePath))) == expectedBedText.count('\n')
@@ -0,0 +1,189 @@
+import os, random
+import pytest
+from PipelineRunner import PipelineRunner, buildGeneExpressionPipeline, writeLines, readLines
+
+
+# Moves the modification times of every file in the given directory back by the given number of seconds, so that
+# files written (or touched) afterwards are clearly newer.
+def ageFiles(directory, seconds = 100):
+    for fileName in os.listdir(directory):
+        fileStats = os.stat(os.path.join(directory, fileName))
+        os.utime(os.path.join(directory, fileName), ns = (fileStats.st_atime_ns - seconds*10**9,
+                                                          fileStats.st_mtime_ns - seconds*10**9))
+
+
+def getMTimes(filePaths):
+    return {filePath: os.stat(filePath).st_mtime_ns for filePath in filePaths if os.path.exists(filePath)}
+
+
+# Returns a small pipeline:  source text -> upper case lines (file) -> reversed lines (in memory only) -> line count (file),
+# along with the list that the names of called stage functions are appended to.
+def buildTestPipeline(directory):
+
+    sourceFilePath = os.path.join(directory, "source.txt")
+    if not os.path.exists(sourceFilePath): writeLines(["a\n", "b\n", "c\n"], sourceFilePath)
+    calls = list()
+
+    runner = PipelineRunner()
+    runner.addSource("source", sourceFilePath)
+    runner.addArtifact("upper", os.path.join(directory, "upper.txt"), writeLines, readLines)
+    runner.addArtifact("reversed")
+    runner.addArtifact("lineCount", os.path.join(directory, "line_count.txt"),
+                       lambda lineCount, filePath: writeLines([str(lineCount) + '\n'], filePath))
+
+    def upper(sourceFilePath):
+        calls.append("upper")
+        return [line.upper() for line in readLines(sourceFilePath)]
+    def reverse(lines):
+        calls.append("reverse")
+        return lines[::-1]
+    def countLines(lines):
+        calls.append("countLines")
+        return len(lines)
+
+    runner.addStage("upper", ["source"], ["upper"], upper)
+    runner.addStage("reverse", ["upper"], ["reversed"], reverse)
+    runner.addStage("countLines", ["reversed"], ["lineCount"], countLines)
+
+    return runner, calls
+
+
+def test_secondRunDoesNoWork(tmp_path):
+
+    runner, calls = buildTestPipeline(str(tmp_path))
+    assert runner.run(["upper", "lineCount"]) == ["upper", "reverse", "countLines"]
+    assert readLines(str(tmp_path / "upper.txt")) == ["A\n", "B\n", "C\n"]
+    assert readLines(str(tmp_path / "line_count.txt")) == ["3\n"]
+
+    # Neither the same runner nor a new one should run (or call) anything the second time around.
+    mTimes = getMTimes([str(tmp_path / "upper.txt"), str(tmp_path / "line_count.txt")])
+    calls.clear()
+    assert runner.run(["upper", "lineCount"]) == []
+    runner, calls = buildTestPipeline(str(tmp_path))
+    assert runner.run(["upper", "lineCount"]) == [] and calls == []
+    assert getMTimes(mTimes) == mTimes
+
+
+def test_outOfDateFilesAreRebuilt(tmp_path):
+
+    runner, calls = buildTestPipeline(str(tmp_path))
+    runner.run(["upper", "lineCount"])
+
+    # A missing target is rebuilt from the up to date files it depends on, which are read back instead of regenerated.
+    os.remove(tmp_path / "line_count.txt")
+    calls.clear()
+    assert runner.run(["upper", "lineCount"]) == ["reverse", "countLines"] and calls == ["reverse", "countLines"]
+
+    # A changed source makes everything that depends on it out of date, even through in memory artifacts.
+    ageFiles(str(tmp_path))
+    writeLines(["a\n", "b\n", "c\n", "d\n"], str(tmp_path / "source.txt"))
+    assert not runner.isUpToDate("lineCount")
+    assert runner.run(["lineCount"]) == ["upper", "reverse", "countLines"]
+    assert readLines(str(tmp_path / "line_count.txt")) == ["4\n"]
+
+    # Only the requested targets are written, so the upper case file is still out of date.  Rewriting it rewrites the
+    # line count generated from it as well, so that neither looks out of date afterwards.
+    assert readLines(str(tmp_path / "upper.txt")) == ["A\n", "B\n", "C\n"]
+    assert runner.run(["upper", "lineCount"]) == ["upper", "reverse", "countLines"]
+    assert readLines(str(tmp_path / "upper.txt")) == ["A\n", "B\n", "C\n", "D\n"]
+    assert runner.run(["upper", "lineCount"]) == []
+    assert runner.run(["upper"]) == [] and runner.run(["lineCount"]) == []
+
+    # An intermediate file newer than the target makes the target out of date, but not the intermediate itself.
+    ageFiles(str(tmp_path))
+    os.utime(tmp_path / "upper.txt")
+    assert runner.run(["upper", "lineCount"]) == ["reverse", "countLines"]
+
+    # Forced runs rebuild everything.
+    assert runner.run(["lineCount"], force = True) == ["upper", "reverse", "countLines"]
+
+
+def test_invalidTargets(tmp_path):
+    runner, _ = buildTestPipeline(str(tmp_path))
+    with pytest.raises(ValueError): runner.run(["missing"])
+    with pytest.raises(ValueError): runner.run(["reversed"])
+
+
+# Writes a small genome, gene designations table, and gene expression file for the gene expression pipeline.
+def writeGeneExpressionPipelineInputs(directory, seed = 0, geneCount = 40):
+
+    rng = random.Random(seed)
+    chromosomeLengths = {"chrI": 3000, "chrII": 2500, "chrX": 2000}
+
+    genomeFilePath = os.path.join(directory, "test_genome.fa")
+    with open(genomeFilePath, 'w') as genomeFile:
+        for chromosome, chromosomeLength in chromosomeLengths.items():
+            genomeFile.write('>' + chromosome + '\n' + ''.join(rng.choice("ACGT") for _ in range(chromosomeLength)) + '\n')
+
+    geneDesignationsTableFilePath = os.path.join(directory, "test_gene_designations.tsv")
+    with open(geneDesignationsTableFilePath, 'w') as geneDesignationsTableFile:
+        geneDesignationsTableFile.write('\t'.join("column_" + str(column) for column in range(13)) + '\n')
+        for geneNumber in range(geneCount):
+            chromosome = rng.choice(list(chromosomeLengths))
+            startPos = rng.randint(1, chromosomeLengths[chromosome] - 300)
+            columns = ['.']*13
+            columns[1], columns[12] = "WBGene" + str(geneNumber).zfill(8), "gene-" + str(geneNumber)
+            columns[2], columns[3] = chromosome, rng.choice("+-")
+            columns[4], columns[5] = str(startPos), str(startPos + rng.randint(20, 250))
+            geneDesignationsTableFile.write('\t'.join(columns) + '\n')
+
+    geneExpressionFilePath = os.path.join(directory, "test_gene_expression.txt")
+    with open(geneExpressionFilePath, 'w') as geneExpressionFile:
+        geneExpressionFile.write("Test gene expression data\n")
+        geneExpressionFile.write('\t'.join(["ID", "Study", "Strain", "Stage", "Tissue", "Method", "Notes"] +
+                                           ["Gene (gene-{}, alias-{})".format(i, i) for i in range(geneCount)]) + '\n')
+        for dataSet in range(10):
+            geneExpressionFile.write('\t'.join([str(dataSet), "S", "N2", "L4", "Muscle", "RNA-seq", ""] +
+                                               [repr(rng.random()*100) for _ in range(geneCount)]) + '\n')
+
+    return geneDesignationsTableFilePath, geneExpressionFilePath, genomeFilePath
+
+
+def test_geneExpressionPipelineIsUpToDateOnSecondRun(tmp_path):
+
+    inputFilePaths = writeGeneExpressionPipelineInputs(str(tmp_path))
+    targetNames = ["geneDesignations", "highlyExpressedGenes", "trinucleotideBackgroundCounts"]
+
+    runner = buildGeneExpressionPipeline(*inputFilePaths)
+    assert runner.run(targetNames) == ["parseGeneDesignations", "findHighlyExpressedGenes",
+                                       "filterGeneDesignationsByExpression", "generateGeneBackground"]
+    targetFilePaths = [runner.artifacts[targetName].filePath for targetName in targetNames]
+    mTimes = getMTimes(targetFilePaths)
+    assert len(mTimes) == len(targetNames)
+
+    assert buildGeneExpressionPipeline(*inputFilePaths).run(targetNames) == []
+    assert getMTimes(targetFilePaths) == mTimes
+
+    # New gene expression data only reruns the stages that depend on it, reading back the parsed gene designations.
+    ageFiles(str(tmp_path))
+    os.utime(inputFilePaths[1])
+    assert buildGeneExpressionPipeline(*inputFilePaths).run(targetNames) == [
+        "findHighlyExpressedGenes", "filterGeneDesignationsByExpression", "generateGeneBackground"]
+    assert buildGeneExpressionPipeline(*inputFilePaths).run(targetNames) == []
+
+
+# The pipeline's mutation counts should go to the same kind of path as countInTranscribedRegions' own counts
+# (with the gene set added), and be left alone on a second run.
+def test_pipelineCountsFilePath(tmp_path):
+
+    pytest.importorskip("mutperiodpy")
+    from CountInTranscribedRegions import getCountsFilePath
+
+    inputFilePaths = writeGeneExpressionPipelineInputs(str(tmp_path))
+    mutationFilePath = str(tmp_path / "test_trinuc_context_mutations.bed")
+    writeLines(["chrI\t{}\t{}\tACA\tT\t+\n".format(position, position + 1) for position in range(0, 3000, 7)],
+               mutationFilePath)
+    try: getCountsFilePath(mutationFilePath)
+    except Exception as error: pytest.skip("mutperiod can't read metadata for the test mutation file: " + str(error))
+
+    runner = buildGeneExpressionPipeline(*inputFilePaths, [mutationFilePath])
+    countsTargetName = "counts_" + os.path.basename(mutationFilePath)
+    geneSetName = os.path.basename(runner.artifacts["filteredGeneDesignations"].filePath).rsplit(
+        "_gene_designations.bed", 1)[0]
+    assert runner.artifacts[countsTargetName].filePath == getCountsFilePath(mutationFilePath, geneSetName = geneSetName)
+    assert geneSetName in os.path.basename(runner.artifacts[countsTargetName].filePath)
+
+    assert "countInTranscribedRegions_" + os.path.basename(mutationFilePath) in runner.run([countsTargetName])
+    with open(runner.artifacts[countsTargetName].filePath, 'r') as countsFile:
+        assert countsFile.readline().startswith("Mutation_Context\tMutant_Base\tTS_Counts")
+    assert buildGeneExpressionPipeline(*inputFilePaths, [mutationFilePath]).run([countsTargetName]) == []
@@ -0,0 +1,112 @@
+import os, random, shutil, subprocess
+import numpy as np
+import pytest
+from GeneAnnotationIndex import GeneIntervalIndex
+
+PERL_SCRIPTS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "perl_scripts")
+CHROMOSOME_LENGTH = 2000
+
+
+# Writes a gene designations file (with a header line, as CelegansGeneCoord expects) with overlapping genes on both
+# strands, a gene at the very start of a chromosome, and a chromosome with no genes.
+def writeGeneDesignations(genePositionsFilePath, seed):
+
+    rng = random.Random(seed)
+    genes = [("chrI", 0, 10, '+')]
+    for chromosome in ("chrI", "chrII", "chrX"):
+        for _ in range(40):
+            startPos = rng.randint(0, CHROMOSOME_LENGTH - 100)
+            genes.append((chromosome, startPos, startPos + rng.randint(2, 60), rng.choice("+-")))
+    genes.sort(key = lambda gene: (gene[0], gene[1], gene[2]))
+
+    with open(genePositionsFilePath, 'w') as genePositionsFile:
+        genePositionsFile.write("chrom\tstart\tend\tname\tother_name\tstrand\n")
+        for i, (chromosome, startPos, endPos, strand) in enumerate(genes):
+            genePositionsFile.write('\t'.join((chromosome, str(startPos), str(endPos), "g" + str(i), "G" + str(i), strand)) + '\n')
+    return genePositionsFilePath
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_bitmapMatchesIntervalIndex(tmp_path, seed):
+
+    genePositionsFilePath = writeGeneDesignations(str(tmp_path / "test_gene_designations.bed"), seed)
+    geneIntervalIndex = GeneIntervalIndex(genePositionsFilePath, useCache = False)
+    bitmapIntervalIndex = GeneIntervalIndex(genePositionsFilePath, useCache = False, useStrandAnnotationBitmap = True)
+
+    positions = np.arange(CHROMOSOME_LENGTH + 100)
+    for chromosome in ("chrI", "chrII", "chrV", "chrX"):
+        assert np.array_equal(bitmapIntervalIndex.getStrandAnnotations(chromosome, positions),
+                              geneIntervalIndex.getStrandAnnotations(chromosome, positions)), chromosome
+
+
+# Runs mutsig_celegansorf_bins.pl on the given mutation file with the given arguments and returns the finished process.
+def runPerlScript(perlScriptsDirectory, mutationFilePath, arguments = (), check = True):
+    return subprocess.run(["perl", os.path.join(perlScriptsDirectory, "mutsig_celegansorf_bins.pl")] + list(arguments),
+                          input = mutationFilePath + '\n', capture_output = True, text = True, check = check)
+
+
+# Runs mutsig_celegansorf_bins.pl on the given mutation file with the given arguments and returns its output.
+def runMutsigCelegansorfBins(perlScriptsDirectory, mutationFilePath, arguments = ()):
+    runPerlScript(perlScriptsDirectory, mutationFilePath, arguments)
+    with open(mutationFilePath.replace(".bed", "_TrxStrandBins.txt"), 'r') as outputFile: return outputFile.read()
+
+
+# Copies the perl scripts to a perl_scripts directory in the given directory, next to the data directory that
+# CelegansGeneCoord reads its genes from (../data/test_gene_designations.bed relative to the scripts).
+# Returns the perl scripts directory and the path to the gene designations file.
+def setUpPerlScripts(directory):
+    perlScriptsDirectory = directory / "perl_scripts"
+    perlScriptsDirectory.mkdir()
+    (directory / "data").mkdir()
+    for fileName in ("mutsig_celegansorf_bins.pl", "CelegansGeneCoord.pm"):
+        shutil.copy(os.path.join(PERL_SCRIPTS_DIRECTORY, fileName), perlScriptsDirectory)
+    return perlScriptsDirectory, str(directory / "data" / "test_gene_designations.bed")
+
+
+# The perl script should give the same counts with the strand annotation bitmap as with its own gene lookup hash,
+# with a mutation at every base (including the bases just outside each gene).
+@pytest.mark.skipif(shutil.which("perl") is None, reason = "perl is not installed")
+@pytest.mark.parametrize("seed", range(3))
+def test_perlBitmapMatchesGeneLookup(tmp_path, seed):
+
+    perlScriptsDirectory, genePositionsFilePath = setUpPerlScripts(tmp_path)
+    writeGeneDesignations(genePositionsFilePath, seed)
+
+    rng = random.Random(seed)
+    mutationFilePath = str(tmp_path / "test_mutations.bed")
+    with open(mutationFilePath, 'w') as mutationFile:
+        for chromosome in ("chrI", "chrII", "chrV", "chrX"):
+            for position in range(CHROMOSOME_LENGTH + 100):
+                mutationFile.write('\t'.join((chromosome, str(position), str(position + 1), rng.choice(("ACG", "TCA")),
+                                              rng.choice("AT"), rng.choice("+-"))) + '\n')
+
+    geneLookupOutput = runMutsigCelegansorfBins(perlScriptsDirectory, mutationFilePath)
+
+    # The bitmap is only used when asked for, and must exist when it is.
+    with pytest.raises(subprocess.CalledProcessError):
+        runMutsigCelegansorfBins(perlScriptsDirectory, mutationFilePath, ["--strand-bitmap"])
+    GeneIntervalIndex(genePositionsFilePath, useCache = False, useStrandAnnotationBitmap = True)
+    assert runMutsigCelegansorfBins(perlScriptsDirectory, mutationFilePath) == geneLookupOutput
+
+    assert runMutsigCelegansorfBins(perlScriptsDirectory, mutationFilePath, ["--strand-bitmap"]) == geneLookupOutput
+
+
+# The bitmap should make the same checks on the gene coordinates as the gene lookup hash.
+@pytest.mark.skipif(shutil.which("perl") is None, reason = "perl is not installed")
+def test_perlBitmapChecksGeneCoords(tmp_path):
+
+    perlScriptsDirectory, genePositionsFilePath = setUpPerlScripts(tmp_path)
+    writeGeneDesignations(genePositionsFilePath, 0)
+    mutationFilePath = str(tmp_path / "test_mutations.bed")
+    with open(mutationFilePath, 'w') as mutationFile: mutationFile.write("chrI\t100\t101\tACG\tT\t+\n")
+
+    GeneIntervalIndex(genePositionsFilePath, useCache = False, useStrandAnnotationBitmap = True)
+    for arguments in ((), ("--strand-bitmap",)):
+        assert "0 skipped genes" in runPerlScript(perlScriptsDirectory, mutationFilePath, arguments).stderr
+
+    # Add a gene with no length.
+    with open(genePositionsFilePath, 'a') as genePositionsFile: genePositionsFile.write("chrI\t50\t50\tg\tG\t-\n")
+    GeneIntervalIndex(genePositionsFilePath, useCache = False, useStrandAnnotationBitmap = True)
+    for arguments in ((), ("--strand-bitmap",)):
+        process = runPerlScript(perlScriptsDirectory, mutationFilePath, arguments, check = False)
+        assert process.returncode != 0 and "Error with gene coords!" in process.stderr, arguments